@@ -1,5 +1,7 @@
 """ Imports for flow.integration."""
 
 from .integrator import Integrator
+from .multichannel import MultiChannelIntegrator
+from .multiflow import MultiFlowIntegrator
 
-__all__ = ['Integrator']
+__all__ = ['Integrator', 'MultiChannelIntegrator', 'MultiFlowIntegrator']
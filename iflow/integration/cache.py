@@ -0,0 +1,72 @@
+""" Implement a cache for the integrand values of sample batches. """
+
+import collections
+import hashlib
+
+import numpy as np
+
+
+class IntegrandCache():
+    """ Least recently used store of the integrand values of point sets.
+
+    The values are stored per batch of points and looked up by a hash of
+    the raw bytes of the points, i.e. only exactly the same batch of points
+    is a hit. Once more than 'maxsize' values are stored, the least
+    recently used batches are evicted.
+
+    Args:
+        maxsize (int): Maximal number of stored function values.
+
+    """
+
+    def __init__(self, maxsize):
+        """ Initialize an empty cache. """
+        self.maxsize = maxsize
+        self.size = 0
+        self._store = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._store)
+
+    @staticmethod
+    def _key(samples):
+        samples = np.ascontiguousarray(samples)
+        digest = hashlib.sha1(samples.tobytes())
+        digest.update(str((samples.shape, samples.dtype.str)).encode())
+        return digest.hexdigest()
+
+    def get(self, samples):
+        """ Look up the function values of a batch of points.
+
+        Args:
+            samples (np.ndarray): Points of size (nsamples, ndims).
+
+        Returns:
+            np.ndarray of size (nsamples,) or None if the batch is unknown
+
+        """
+        key = self._key(samples)
+        values = self._store.get(key)
+        if values is not None:
+            self._store.move_to_end(key)
+        return values
+
+    def put(self, samples, values):
+        """ Store the function values of a batch of points.
+
+        Args:
+            samples (np.ndarray): Points of size (nsamples, ndims).
+            values (np.ndarray): Function values of size (nsamples,).
+
+        """
+        values = np.asarray(values)
+        if values.size > self.maxsize:
+            return
+        key = self._key(samples)
+        if key in self._store:
+            self.size -= self._store.pop(key).size
+        self._store[key] = values
+        self.size += values.size
+        while self.size > self.maxsize:
+            _, evicted = self._store.popitem(last=False)
+            self.size -= evicted.size
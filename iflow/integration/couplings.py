@@ -9,6 +9,27 @@ from ..splines import rational_quadratic
 tfb = tfp.bijectors
 
 
+def _merge_last_axes(tensor):
+    """ Merge the two innermost axes, keeping any number of leading axes.
+
+    The leading axes are the samples, and for an ensemble of flows also the
+    members, whose sizes may be unknown. The merged size stays static.
+
+    """
+    merged = tf.reshape(tensor, tf.concat([tf.shape(tensor)[:-2], [-1]], 0))
+    merged.set_shape(tensor.shape[:-2].concatenate(
+        tensor.shape[-2] * tensor.shape[-1]))
+    return merged
+
+
+def _split_last_axis(tensor, rows, columns):
+    """ Split the innermost axis into the static sizes (rows, columns). """
+    split = tf.reshape(tensor, tf.concat(
+        [tf.shape(tensor)[:-1], [rows, columns]], 0))
+    split.set_shape(tensor.shape[:-1].concatenate([rows, columns]))
+    return split
+
+
 class CouplingBijector(tfb.Bijector):
     """ Define base coupling bijector. """
     def __init__(self, mask, transform_net_create_fn, blob=None,
@@ -26,11 +47,22 @@ class CouplingBijector(tfb.Bijector):
         assert (self.num_identity_features + self.num_transform_features
                 == self.features)
 
+        # The mask is fixed, so the permutation restoring the feature order
+        # after splitting is computed once. If the identity features already
+        # come first, the split reduces to slicing and no gather is needed.
+        self._permutation = tf.argsort(tf.concat(
+            [self.identity_features, self.transform_features], axis=-1))
+        self._ordered = bool(tf.get_static_value(
+            tf.reduce_all(self._permutation == features_vector)))
+
         self.blob = bool(blob)
         if self.blob:
             if not isinstance(blob, int):
                 raise ValueError('Blob encoding requires a number of bins')
             self.nbins_in = int(blob)
+            self._blob_centers = ((0.5 + tf.range(self.nbins_in,
+                                                  dtype=tf.float64))
+                                  / self.nbins_in)
 
         if self.blob:
             self.transform_net = transform_net_create_fn(
@@ -56,22 +88,41 @@ class CouplingBijector(tfb.Bijector):
         return len(self.transform_features)
 
     def _one_blob(self, xd):
-        """ Return input vector with one-blob encoding. """
-        y = tf.tile(((0.5/self.nbins_in) + tf.range(0., 1.,
-                                                    delta=1./self.nbins_in)),
-                    [tf.size(xd)])
-        y = tf.cast(tf.reshape(y, (-1, self.num_identity_features,
-                                   self.nbins_in)),
-                    dtype=tf.float64)
+        """ Return input vector with one-blob encoding.
+
+        The bin centers are computed once at construction and broadcast
+        against the inputs, such that no batch sized copy of them is made.
+        The encoding is computed in the dtype of the inputs.
+
+        """
+        centers = tf.cast(self._blob_centers, xd.dtype)
         res = tf.exp(((-self.nbins_in*self.nbins_in)/2.)
-                     * (y-xd[..., tf.newaxis])**2)
-        res = tf.reshape(res, (-1, self.num_identity_features*self.nbins_in))
-        return res
+                     * (xd[..., tf.newaxis] - centers)**2)
+        return _merge_last_axes(res)
 
-    def _forward(self, inputs, context=None):
-        """ Forward pass through Coupling Layer. """
-        identity_split = tf.gather(inputs, self.identity_features, axis=-1)
-        transform_split = tf.gather(inputs, self.transform_features, axis=-1)
+    def _transform(self, inputs, inverse=False, context=None):
+        """ Pass through Coupling Layer returning outputs and log det Jacobian.
+
+        The transform network and the coupling transform are evaluated only
+        once, such that the outputs and the log determinant of the Jacobian
+        come from the same pass.
+
+        Args:
+            inputs (tf.Tensor): Points to be transformed.
+            inverse (bool): Whether to calculate the forward or inverse pass
+            context (tf.Tensor): Optional context for the transform network
+
+        Returns:
+            tuple: The transformation and the associated log jacobian
+
+        """
+        if self._ordered:
+            identity_split = inputs[..., :self.num_identity_features]
+            transform_split = inputs[..., self.num_identity_features:]
+        else:
+            identity_split = tf.gather(inputs, self.identity_features, axis=-1)
+            transform_split = tf.gather(inputs, self.transform_features,
+                                        axis=-1)
 
         if self.blob:
             identity_split_blob = self._one_blob(identity_split)
@@ -79,76 +130,62 @@ class CouplingBijector(tfb.Bijector):
         else:
             transform_params = self.transform_net(identity_split, context)
 
-        transform_split, _ = self._coupling_transform_forward(
-            inputs=transform_split,
-            transform_params=transform_params
-        )
+        if inverse:
+            transform_split, logabsdet = self._coupling_transform_inverse(
+                inputs=transform_split,
+                transform_params=transform_params
+            )
+        else:
+            transform_split, logabsdet = self._coupling_transform_forward(
+                inputs=transform_split,
+                transform_params=transform_params
+            )
 
-        outputs = tf.concat([identity_split, transform_split], axis=1)
-        indices = tf.concat(
-            [self.identity_features, self.transform_features], axis=-1)
-        outputs = tf.gather(outputs, tf.argsort(indices), axis=1)
+        outputs = tf.concat([identity_split, transform_split], axis=-1)
+        if not self._ordered:
+            outputs = tf.gather(outputs, self._permutation, axis=-1)
 
-        return outputs
+        return outputs, logabsdet
 
-    def _inverse(self, inputs, context=None):
-        """ Inverse pass through Coupling Layer. """
+    def forward_and_log_det(self, inputs, context=None):
+        """ Forward pass returning outputs and forward log det Jacobian.
 
-        identity_split = tf.gather(inputs, self.identity_features, axis=-1)
-        transform_split = tf.gather(inputs, self.transform_features, axis=-1)
+        Unlike a call to forward followed by forward_log_det_jacobian, the
+        transform network is evaluated only once.
 
-        if self.blob:
-            identity_split_blob = self._one_blob(identity_split)
-            transform_params = self.transform_net(identity_split_blob, context)
-        else:
-            transform_params = self.transform_net(identity_split, context)
+        """
+        return self._transform(inputs, context=context)
 
-        transform_split, _ = self._coupling_transform_inverse(
-            inputs=transform_split,
-            transform_params=transform_params
-        )
+    def inverse_and_log_det(self, inputs, context=None):
+        """ Inverse pass returning outputs and inverse log det Jacobian.
+
+        Unlike a call to inverse followed by inverse_log_det_jacobian, the
+        transform network is evaluated only once.
+
+        """
+        return self._transform(inputs, inverse=True, context=context)
+
+    def _forward(self, inputs, context=None):
+        """ Forward pass through Coupling Layer. """
+        outputs, _ = self._transform(inputs, context=context)
 
-        outputs = tf.concat([identity_split, transform_split], axis=1)
-        indices = tf.concat(
-            [self.identity_features, self.transform_features], axis=-1)
-        outputs = tf.gather(outputs, tf.argsort(indices), axis=1)
+        return outputs
+
+    def _inverse(self, inputs, context=None):
+        """ Inverse pass through Coupling Layer. """
+        outputs, _ = self._transform(inputs, inverse=True, context=context)
 
         return outputs
 
     def _forward_log_det_jacobian(self, inputs, context=None):
         """ Compute forward log det Jacobian. """
-        identity_split = tf.gather(inputs, self.identity_features, axis=-1)
-        transform_split = tf.gather(inputs, self.transform_features, axis=-1)
-
-        if self.blob:
-            identity_split_blob = self._one_blob(identity_split)
-            transform_params = self.transform_net(identity_split_blob, context)
-        else:
-            transform_params = self.transform_net(identity_split, context)
-
-        transform_split, logabsdet = self._coupling_transform_forward(
-            inputs=transform_split,
-            transform_params=transform_params
-        )
+        _, logabsdet = self._transform(inputs, context=context)
 
         return logabsdet
 
     def _inverse_log_det_jacobian(self, inputs, context=None):
         """ Compute Inverse log det Jacobian. """
-
-        identity_split = tf.gather(inputs, self.identity_features, axis=-1)
-        transform_split = tf.gather(inputs, self.transform_features, axis=-1)
-
-        if self.blob:
-            identity_split_blob = self._one_blob(identity_split)
-            transform_params = self.transform_net(identity_split_blob, context)
-        else:
-            transform_params = self.transform_net(identity_split, context)
-
-        transform_split, logabsdet = self._coupling_transform_inverse(
-            inputs=transform_split,
-            transform_params=transform_params
-        )
+        _, logabsdet = self._transform(inputs, inverse=True, context=context)
 
         return logabsdet
 
@@ -162,14 +199,74 @@ class CouplingBijector(tfb.Bijector):
         raise NotImplementedError()
 
 
+def forward_and_log_det(bijector, inputs, event_ndims=1):
+    """ Forward pass through a bijector or a chain of bijectors.
+
+    Coupling layers evaluate their transform network only once for the
+    outputs and the log det Jacobian. Other bijectors fall back to forward
+    and forward_log_det_jacobian.
+
+    Args:
+        bijector (tfb.Bijector): Bijector, possibly a tfb.Chain.
+        inputs (tf.Tensor): Points to be transformed.
+        event_ndims (int): Number of event dimensions of the inputs.
+
+    Returns:
+        tuple: The transformed points and the forward log det Jacobian
+
+    """
+    if isinstance(bijector, tfb.Chain):
+        logdet = tf.zeros([], dtype=inputs.dtype)
+        # A chain applies its last bijector first.
+        for link in reversed(bijector.bijectors):
+            inputs, link_logdet = forward_and_log_det(link, inputs,
+                                                      event_ndims)
+            logdet = logdet + link_logdet
+        return inputs, logdet
+    if isinstance(bijector, CouplingBijector):
+        return bijector.forward_and_log_det(inputs)
+    return (bijector.forward(inputs),
+            bijector.forward_log_det_jacobian(inputs, event_ndims))
+
+
+def inverse_and_log_det(bijector, inputs, event_ndims=1):
+    """ Inverse pass through a bijector or a chain of bijectors.
+
+    Coupling layers evaluate their transform network only once for the
+    outputs and the log det Jacobian. Other bijectors fall back to inverse
+    and inverse_log_det_jacobian.
+
+    Args:
+        bijector (tfb.Bijector): Bijector, possibly a tfb.Chain.
+        inputs (tf.Tensor): Points to be transformed.
+        event_ndims (int): Number of event dimensions of the inputs.
+
+    Returns:
+        tuple: The transformed points and the inverse log det Jacobian
+
+    """
+    if isinstance(bijector, tfb.Chain):
+        logdet = tf.zeros([], dtype=inputs.dtype)
+        for link in bijector.bijectors:
+            inputs, link_logdet = inverse_and_log_det(link, inputs,
+                                                      event_ndims)
+            logdet = logdet + link_logdet
+        return inputs, logdet
+    if isinstance(bijector, CouplingBijector):
+        return bijector.inverse_and_log_det(inputs)
+    return (bijector.inverse(inputs),
+            bijector.inverse_log_det_jacobian(inputs, event_ndims))
+
+
 class AffineBijector(CouplingBijector):
     """ Define Affine Bijector. """
     def _transform_dim_multiplier(self):
         return 2
 
     def _scale_and_shift(self, transform_params):
-        unconstrained_scale = transform_params[:, self.num_transform_features:]
-        shift = transform_params[:, :self.num_transform_features]
+        unconstrained_scale = transform_params[
+            ..., self.num_transform_features:]
+        shift = transform_params[..., :self.num_transform_features]
         scale = tf.nn.sigmoid(unconstrained_scale + 2) + 1e-3
         return scale, shift
 
@@ -210,8 +307,9 @@ class PiecewiseBijector(CouplingBijector):
         return self._coupling_transform(inputs, transform_params, inverse=True)
 
     def _coupling_transform(self, inputs, transform_params, inverse=False):
-        b, d = inputs.shape
-        transform_params = tf.reshape(transform_params, (b, d, -1))
+        transform_params = _split_last_axis(
+            transform_params, self.num_transform_features,
+            self._transform_dim_multiplier())
 
         outputs, logabsdet = self._piecewise_cdf(
             inputs, transform_params, inverse)
@@ -247,20 +345,27 @@ class PiecewiseQuadratic(PiecewiseBijector):
     def __init__(self, mask, transform_net_create_fn, num_bins=10,
                  min_bin_width=splines.quadratic.DEFAULT_MIN_BIN_WIDTH,
                  min_bin_height=splines.quadratic.DEFAULT_MIN_BIN_HEIGHT,
-                 **kwargs):
+                 uniform_widths=False, **kwargs):
         self.num_bins = num_bins
         self.min_bin_width = min_bin_width
         self.min_bin_height = min_bin_height
+        self.uniform_widths = uniform_widths
 
         super(PiecewiseQuadratic, self).__init__(
             mask, transform_net_create_fn, **kwargs)
 
     def _transform_dim_multiplier(self):
+        if self.uniform_widths:
+            return self.num_bins + 1
         return self.num_bins * 2 + 1
 
     def _piecewise_cdf(self, inputs, transform_params, inverse=False):
-        unnormalized_widths = transform_params[..., :self.num_bins]
-        unnormalized_heights = transform_params[..., self.num_bins:]
+        if self.uniform_widths:
+            unnormalized_widths = None
+            unnormalized_heights = transform_params
+        else:
+            unnormalized_widths = transform_params[..., :self.num_bins]
+            unnormalized_heights = transform_params[..., self.num_bins:]
 
         return splines.quadratic_spline(
             inputs=inputs,
@@ -315,23 +420,32 @@ class PiecewiseRationalQuadratic(PiecewiseBijector):
                  min_bin_width=rational_quadratic.DEFAULT_MIN_BIN_WIDTH,
                  min_bin_height=rational_quadratic.DEFAULT_MIN_BIN_HEIGHT,
                  min_derivative=rational_quadratic.DEFAULT_MIN_DERIVATIVE,
-                 **kwargs):
+                 uniform_widths=False, **kwargs):
         self.num_bins = num_bins
         self.min_bin_width = min_bin_width
         self.min_bin_height = min_bin_height
         self.min_derivative = min_derivative
+        self.uniform_widths = uniform_widths
 
         super(PiecewiseRationalQuadratic, self).__init__(
             mask, transform_net_create_fn, **kwargs)
 
     def _transform_dim_multiplier(self):
+        if self.uniform_widths:
+            return self.num_bins * 2 + 1
         return self.num_bins * 3 + 1
 
     def _piecewise_cdf(self, inputs, transform_params, inverse=False):
-        unnormalized_widths = transform_params[..., :self.num_bins]
-        unnormalized_heights = transform_params[...,
-                                                self.num_bins:2*self.num_bins]
-        unnormalized_derivatives = transform_params[..., 2*self.num_bins:]
+        if self.uniform_widths:
+            unnormalized_widths = None
+            unnormalized_heights = transform_params[..., :self.num_bins]
+            unnormalized_derivatives = transform_params[..., self.num_bins:]
+        else:
+            unnormalized_widths = transform_params[..., :self.num_bins]
+            unnormalized_heights = transform_params[
+                ..., self.num_bins:2*self.num_bins]
+            unnormalized_derivatives = transform_params[
+                ..., 2*self.num_bins:]
 
         return splines.rational_quadratic_spline(
             inputs=inputs,
@@ -1,8 +1,34 @@
 """ Implementation of the divergences. """
 
+import inspect
+
 import tensorflow as tf
 
 
+def _weighted_mean(values, weights=None):
+    """ Mean of the values, self-normalized by the weights if given. """
+    if weights is None:
+        return tf.reduce_mean(values)
+    return tf.reduce_sum(weights * values) / tf.reduce_sum(weights)
+
+
+def _register(func):
+    """ Mark a method of a divergence class as an available divergence. """
+    target = func.__func__ if isinstance(func, staticmethod) else func
+    target.is_divergence = True
+    return func
+
+
+def _log_weighted_mean(log_values, weights=None):
+    """ Logarithm of the mean of exp(log_values), using logsumexp. """
+    if weights is None:
+        return (tf.reduce_logsumexp(log_values)
+                - tf.math.log(tf.cast(tf.size(log_values), log_values.dtype)))
+    log_weights = tf.math.log(weights)
+    return (tf.reduce_logsumexp(log_values + log_weights)
+            - tf.reduce_logsumexp(log_weights))
+
+
 class Divergence:
     """Divergence class conatiner.
 
@@ -13,7 +39,9 @@ class Divergence:
 
     All of the implemented divergences must be called with
     the same four arguments, even though some of them only
-    use two of them.
+    use two of them. Optionally, importance weights of the
+    points can be passed, e.g. for points that were sampled
+    from a previous state of the distribution.
 
     Attributes:
         alpha (float): attribute needed for (alpha, beta)-product divergence
@@ -25,12 +53,13 @@ class Divergence:
     def __init__(self, alpha=None, beta=None):
         self.alpha = alpha
         self.beta = beta
-        self.divergences = [x for x in dir(self)
-                            if ('__' not in x and 'alpha' not in x
-                                and 'beta' not in x)]
+        self.divergences = sorted(
+            name for name, member in inspect.getmembers(type(self))
+            if getattr(member, 'is_divergence', False))
 
+    @_register
     @staticmethod
-    def chi2(true, test, logp, logq):
+    def chi2(true, test, logp, logq, weights=None):
         """ Implement Neyman chi2 divergence.
 
         This function returns the Neyman chi2 divergence for two given sets
@@ -45,18 +74,21 @@ class Divergence:
             test (tf.tensor or array(nbatch) of floats): estimated probability of points
             logp (tf.tensor or array(nbatch) of floats): not used in chi2
             logq (tf.tensor or array(nbatch) of floats): not used in chi2
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
 
         Returns:
             tf.tensor(float): computed Neyman chi2 divergence
 
         """
         del logp, logq
-        return tf.reduce_mean(input_tensor=(tf.stop_gradient(true) - test)**2
-                              / test / tf.stop_gradient(test))
+        return _weighted_mean((tf.stop_gradient(true) - test)**2
+                              / test / tf.stop_gradient(test), weights)
 
     # pylint: disable=invalid-name
+    @_register
     @staticmethod
-    def kl(true, test, logp, logq):
+    def kl(true, test, logp, logq, weights=None):
         """ Implement Kullback-Leibler (KL) divergence.
 
         This function returns the Kullback-Leibler divergence for two given sets
@@ -71,17 +103,20 @@ class Divergence:
             test (tf.tensor or array(nbatch) of floats): estimated probability of points
             logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
             logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
 
         Returns:
             tf.tensor(float): computed KL divergence
 
         """
-        return tf.reduce_mean(input_tensor=tf.stop_gradient(true/test)
-                              * (tf.stop_gradient(logp) - logq))
+        return _weighted_mean(tf.stop_gradient(true/test)
+                              * (tf.stop_gradient(logp) - logq), weights)
     # pylint: enable=invalid-name
 
+    @_register
     @staticmethod
-    def hellinger(true, test, logp, logq):
+    def hellinger(true, test, logp, logq, weights=None):
         """ Implement Hellinger divergence.
 
         This function returns the Hellinger distance for two given sets
@@ -96,19 +131,22 @@ class Divergence:
             test (tf.tensor or array(nbatch) of floats): estimated probability of points
             logp (tf.tensor or array(nbatch) of floats): not used in hellinger
             logq (tf.tensor or array(nbatch) of floats): not used in hellinger
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
 
         Returns:
             tf.tensor(float): computed Hellinger distance
 
         """
         del logp, logq
-        return tf.reduce_mean(
-            input_tensor=(2.0*(tf.stop_gradient(tf.math.sqrt(true))
-                               - tf.math.sqrt(test))**2
-                          / tf.stop_gradient(test)))
+        return _weighted_mean(
+            (2.0*(tf.stop_gradient(tf.math.sqrt(true))
+                  - tf.math.sqrt(test))**2
+             / tf.stop_gradient(test)), weights)
 
+    @_register
     @staticmethod
-    def jeffreys(true, test, logp, logq):
+    def jeffreys(true, test, logp, logq, weights=None):
         """ Implement Jeffreys divergence.
 
         This function returns the Jeffreys divergence for two given sets
@@ -123,17 +161,20 @@ class Divergence:
             test (tf.tensor or array(nbatch) of floats): estimated probability of points
             logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
             logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
 
         Returns:
             tf.tensor(float): computed Jeffreys divergence
 
         """
-        return tf.reduce_mean(
-            input_tensor=((tf.stop_gradient(true) - test)
-                          * (tf.stop_gradient(logp) - logq)
-                          / tf.stop_gradient(test)))
+        return _weighted_mean(
+            ((tf.stop_gradient(true) - test)
+             * (tf.stop_gradient(logp) - logq)
+             / tf.stop_gradient(test)), weights)
 
-    def chernoff(self, true, test, logp, logq):
+    @_register
+    def chernoff(self, true, test, logp, logq, weights=None):
         """ Implement Chernoff divergence.
 
         This function returns the Chernoff divergence for two given sets
@@ -148,6 +189,8 @@ class Divergence:
             test (tf.tensor or array(nbatch) of floats): estimated probability of points
             logp (tf.tensor or array(nbatch) of floats): not used in chernoff
             logq (tf.tensor or array(nbatch) of floats): not used in chernoff
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
 
         Returns:
             tf.tensor(float): computed Chernoff divergence
@@ -163,14 +206,15 @@ class Divergence:
         if not 0 < self.alpha < 1:
             raise ValueError('Alpha must be between 0 and 1.')
 
-        return (4.0 / (1-self.alpha**2)*(1 - tf.reduce_mean(
-            input_tensor=(tf.stop_gradient(tf.pow(true,
-                                                  (1.0-self.alpha)/2.0))
-                          * tf.pow(test, (1.0+self.alpha)/2.0)
-                          / tf.stop_gradient(test)))))
+        return (4.0 / (1-self.alpha**2)*(1 - _weighted_mean(
+            (tf.stop_gradient(tf.pow(true,
+                                     (1.0-self.alpha)/2.0))
+             * tf.pow(test, (1.0+self.alpha)/2.0)
+             / tf.stop_gradient(test)), weights)))
 
+    @_register
     @staticmethod
-    def exponential(true, test, logp, logq):
+    def exponential(true, test, logp, logq, weights=None):
         """ Implement Expoential divergence.
 
         This function returns the Exponential divergence for two given sets
@@ -185,17 +229,20 @@ class Divergence:
             test (tf.tensor or array(nbatch) of floats): estimated probability of points
             logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
             logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
 
         Returns:
             tf.tensor(float): computed Exponential divergence
 
         """
-        return tf.reduce_mean(
-            input_tensor=tf.stop_gradient(true/test)*(
-                tf.stop_gradient(logp) - logq)**2)
+        return _weighted_mean(
+            tf.stop_gradient(true/test)*(
+                tf.stop_gradient(logp) - logq)**2, weights)
 
+    @_register
     @staticmethod
-    def exponential2(true, test, logp, logq):
+    def exponential2(true, test, logp, logq, weights=None):
         """ Implement Expoential divergence with true and test interchanged.
 
         This function returns the Exponential2 divergence for two given sets
@@ -211,16 +258,19 @@ class Divergence:
             test (tf.tensor or array(nbatch) of floats): estimated probability of points
             logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
             logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
 
         Returns:
             tf.tensor(float): computed Exponential2 divergence
 
         """
-        return tf.reduce_mean(
-            input_tensor=tf.stop_gradient(true**2/test)*(
-                tf.stop_gradient(logp) - logq)**2/test)
+        return _weighted_mean(
+            tf.stop_gradient(true**2/test)*(
+                tf.stop_gradient(logp) - logq)**2/test, weights)
 
-    def ab_product(self, true, test, logp, logq):
+    @_register
+    def ab_product(self, true, test, logp, logq, weights=None):
         """ Implement (alpha, beta)-product divergence.
 
         This function returns the (alpha, beta)-product divergence for two given
@@ -235,6 +285,8 @@ class Divergence:
             test (tf.tensor or array(nbatch) of floats): estimated probability of points
             logp (tf.tensor or array(nbatch) of floats): not used in ab_product
             logq (tf.tensor or array(nbatch) of floats): not used in ab_product
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
 
         Returns:
             tf.tensor(float): computed (alpha, beta)-product divergence
@@ -257,17 +309,18 @@ class Divergence:
         if not 0 < self.beta < 1:
             raise ValueError('Beta must be between 0 and 1.')
 
-        return tf.reduce_mean(
-            input_tensor=(2.0/((1-self.alpha)*(1-self.beta))
-                          * (1-tf.pow(test/tf.stop_gradient(true),
-                                      (1-self.alpha)/2.0))
-                          * (1-tf.pow(test/tf.stop_gradient(true),
-                                      (1-self.beta)/2.0))
-                          * tf.stop_gradient(true/test)))
+        return _weighted_mean(
+            (2.0/((1-self.alpha)*(1-self.beta))
+             * (1-tf.pow(test/tf.stop_gradient(true),
+                         (1-self.alpha)/2.0))
+             * (1-tf.pow(test/tf.stop_gradient(true),
+                         (1-self.beta)/2.0))
+             * tf.stop_gradient(true/test)), weights)
 
     # pylint: disable=invalid-name
+    @_register
     @staticmethod
-    def js(true, test, logp, logq):
+    def js(true, test, logp, logq, weights=None):
         """ Implement Jensen-Shannon divergence.
 
         This function returns the Jensen-Shannon divergence for two given
@@ -282,23 +335,358 @@ class Divergence:
             test (tf.tensor or array(nbatch) of floats): estimated probability of points
             logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
             logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
 
         Returns:
             tf.tensor(float): computed Jensen-Shannon divergence
 
         """
         logm = tf.math.log(0.5*(test+tf.stop_gradient(true)))
-        return tf.reduce_mean(input_tensor=(
+        return _weighted_mean((
             tf.stop_gradient(0.5/test) * ((tf.stop_gradient(true)
                                            * (tf.stop_gradient(logp)-logm))
-                                          + (test * (logq-logm)))))
+                                          + (test * (logq-logm)))), weights)
     # pylint: enable=invalid-name
 
+    def monitor(self, names, true, test, logp, logq, weights=None):
+        """ Evaluate several divergences in a single pass for monitoring.
+
+        All divergences are functions of the ratio true/test and of the
+        log ratio logp - logq. These are computed once, and the pointwise
+        terms of all requested divergences are reduced together. No
+        gradient is propagated, the loss for training is obtained from
+        __call__.
+
+        Arguments:
+            names (list of str): names of the divergences to be evaluated
+            true (tf.tensor or array(nbatch) of floats): true probability of points.
+            test (tf.tensor or array(nbatch) of floats): estimated probability of points
+            logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
+            logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            dict: the value of each requested divergence
+
+        """
+        return self.monitor_ratio(names, true / test, logp - logq, weights)
+
+    def monitor_ratio(self, names, ratio, log_ratio, weights=None):
+        """ Evaluate several divergences from the ratio of probabilities.
+
+        Same as monitor, for a ratio true/test and log ratio logp - logq
+        that were already computed, e.g. together with the loss.
+
+        Arguments:
+            names (list of str): names of the divergences to be evaluated
+            ratio (tf.tensor or array(nbatch) of floats): ratio true/test
+            log_ratio (tf.tensor or array(nbatch) of floats): log ratio
+                logp - logq
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            dict: the value of each requested divergence
+
+        """
+        ratio = tf.stop_gradient(ratio)
+        log_ratio = tf.stop_gradient(log_ratio)
+        log_mean = tf.math.log(0.5*(1 + ratio))
+        terms = {
+            'chi2': lambda: (ratio - 1)**2,
+            'kl': lambda: ratio * log_ratio,
+            'hellinger': lambda: 2.0*(tf.math.sqrt(ratio) - 1)**2,
+            'jeffreys': lambda: (ratio - 1) * log_ratio,
+            'chernoff': lambda: tf.pow(ratio, (1.0-self.alpha)/2.0),
+            'exponential': lambda: ratio * log_ratio**2,
+            'exponential2': lambda: (ratio * log_ratio)**2,
+            'ab_product': lambda: (
+                2.0/((1-self.alpha)*(1-self.beta))
+                * (1-tf.pow(ratio, -(1-self.alpha)/2.0))
+                * (1-tf.pow(ratio, -(1-self.beta)/2.0)) * ratio),
+            'js': lambda: 0.5*(ratio * (log_ratio - log_mean) - log_mean),
+        }
+        for name in names:
+            self(name)
+            if name in ('chernoff', 'ab_product') and (
+                    self.alpha is None or not 0 < self.alpha < 1):
+                raise ValueError('Alpha must be between 0 and 1.')
+            if name == 'ab_product' and (
+                    self.beta is None or not 0 < self.beta < 1):
+                raise ValueError('Beta must be between 0 and 1.')
+
+        values = tf.stack([terms[name]() for name in names], axis=-1)
+        if weights is None:
+            values = tf.reduce_mean(values, axis=0)
+        else:
+            values = (tf.reduce_sum(weights[:, tf.newaxis] * values, axis=0)
+                      / tf.reduce_sum(weights))
+        values = dict(zip(names, tf.unstack(values)))
+        if 'chernoff' in values:
+            values['chernoff'] = (4.0 / (1-self.alpha**2)
+                                  * (1 - values['chernoff']))
+        return values
+
     def __call__(self, name):
-        func = getattr(self, name, None)
-        if func is not None:
-            return func
+        if name in self.divergences:
+            return getattr(self, name)
         raise NotImplementedError('The requested loss function {} '
                                   'is not implemented. Allowed '
                                   'options are {}.'.format(
                                       name, self.divergences))
+
+
+class LogDivergence(Divergence):
+    """Divergence class container working on log probabilities.
+
+    This class contains the same f-divergences as Divergence, but all of
+    them are computed from logp and logq only. The probabilities never
+    appear in linear space, only their ratios, such that the divergences
+    stay finite when the probabilities underflow or overflow, e.g. for
+    narrow integrands in many dimensions or when training in float32.
+    Means of exponentials are reduced with logsumexp. The values and
+    gradients agree with the ones of Divergence.
+
+    All of the implemented divergences must be called with logp and logq,
+    and optionally the importance weights of the points. As for Divergence,
+    logp has to be finite, i.e. a vanishing integrand has to be bounded
+    from below.
+
+    Attributes:
+        alpha (float): attribute needed for (alpha, beta)-product divergence
+            and Chernoff divergence
+        beta (float): attribute needed for (alpha, beta)-product divergence
+
+    """
+
+    # pylint: disable=arguments-differ
+    @_register
+    @staticmethod
+    def chi2(logp, logq, weights=None):
+        """ Implement Neyman chi2 divergence in log space.
+
+        Arguments:
+            logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
+            logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            tf.tensor(float): computed Neyman chi2 divergence
+
+        """
+        ratio = tf.exp(tf.stop_gradient(logp) - logq)
+        return _weighted_mean((ratio - 1)**2
+                              * tf.exp(logq - tf.stop_gradient(logq)), weights)
+
+    # pylint: disable=invalid-name
+    @_register
+    @staticmethod
+    def kl(logp, logq, weights=None):
+        """ Implement Kullback-Leibler (KL) divergence in log space.
+
+        Arguments:
+            logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
+            logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            tf.tensor(float): computed KL divergence
+
+        """
+        log_ratio = tf.stop_gradient(logp) - logq
+        return _weighted_mean(tf.exp(tf.stop_gradient(log_ratio))
+                              * log_ratio, weights)
+    # pylint: enable=invalid-name
+
+    @_register
+    @staticmethod
+    def hellinger(logp, logq, weights=None):
+        """ Implement Hellinger divergence in log space.
+
+        Arguments:
+            logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
+            logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            tf.tensor(float): computed Hellinger distance
+
+        """
+        ratio = tf.exp(0.5*(tf.stop_gradient(logp) - logq))
+        return _weighted_mean(2.0*(ratio - 1)**2
+                              * tf.exp(logq - tf.stop_gradient(logq)), weights)
+
+    @_register
+    @staticmethod
+    def jeffreys(logp, logq, weights=None):
+        """ Implement Jeffreys divergence in log space.
+
+        Arguments:
+            logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
+            logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            tf.tensor(float): computed Jeffreys divergence
+
+        """
+        log_ratio = tf.stop_gradient(logp) - logq
+        return _weighted_mean(
+            (tf.exp(log_ratio) - 1) * log_ratio
+            * tf.exp(logq - tf.stop_gradient(logq)), weights)
+
+    @_register
+    def chernoff(self, logp, logq, weights=None):
+        """ Implement Chernoff divergence in log space.
+
+        Arguments:
+            logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
+            logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            tf.tensor(float): computed Chernoff divergence
+
+        Raises:
+           ValueError: If there is no alpha defined or alpha is not between 0 and 1
+
+        """
+        if self.alpha is None:
+            raise ValueError('Must give an alpha value to use Chernoff '
+                             'Divergence.')
+        if not 0 < self.alpha < 1:
+            raise ValueError('Alpha must be between 0 and 1.')
+
+        return (4.0 / (1-self.alpha**2)*(1 - tf.exp(_log_weighted_mean(
+            ((1.0-self.alpha)/2.0*tf.stop_gradient(logp)
+             + (1.0+self.alpha)/2.0*logq - tf.stop_gradient(logq)),
+            weights))))
+
+    @_register
+    @staticmethod
+    def exponential(logp, logq, weights=None):
+        """ Implement Expoential divergence in log space.
+
+        Arguments:
+            logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
+            logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            tf.tensor(float): computed Exponential divergence
+
+        """
+        log_ratio = tf.stop_gradient(logp) - logq
+        return _weighted_mean(tf.exp(tf.stop_gradient(log_ratio))
+                              * log_ratio**2, weights)
+
+    @_register
+    @staticmethod
+    def exponential2(logp, logq, weights=None):
+        """ Implement Expoential divergence with true and test interchanged
+        in log space.
+
+        Arguments:
+            logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
+            logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            tf.tensor(float): computed Exponential2 divergence
+
+        """
+        logp = tf.stop_gradient(logp)
+        return _weighted_mean(tf.exp(2.0*logp - tf.stop_gradient(logq) - logq)
+                              * (logp - logq)**2, weights)
+
+    @_register
+    def ab_product(self, logp, logq, weights=None):
+        """ Implement (alpha, beta)-product divergence in log space.
+
+        Arguments:
+            logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
+            logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            tf.tensor(float): computed (alpha, beta)-product divergence
+
+        Raises:
+           ValueError: If there is no alpha defined or alpha is not between 0 and 1
+           ValueError: If there is no beta defined or beta is not between 0 and 1
+
+        """
+        if self.alpha is None:
+            raise ValueError('Must give an alpha value to use '
+                             '(alpha, beta)-product Divergence.')
+        if not 0 < self.alpha < 1:
+            raise ValueError('Alpha must be between 0 and 1.')
+
+        if self.beta is None:
+            raise ValueError('Must give an beta value to use '
+                             '(alpha, beta)-product Divergence.')
+        if not 0 < self.beta < 1:
+            raise ValueError('Beta must be between 0 and 1.')
+
+        log_ratio = logq - tf.stop_gradient(logp)
+        return _weighted_mean(
+            (2.0/((1-self.alpha)*(1-self.beta))
+             * (1-tf.exp((1-self.alpha)/2.0*log_ratio))
+             * (1-tf.exp((1-self.beta)/2.0*log_ratio))
+             * tf.exp(-tf.stop_gradient(log_ratio))), weights)
+
+    # pylint: disable=invalid-name
+    @_register
+    @staticmethod
+    def js(logp, logq, weights=None):
+        """ Implement Jensen-Shannon divergence in log space.
+
+        Arguments:
+            logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
+            logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            tf.tensor(float): computed Jensen-Shannon divergence
+
+        """
+        logp = tf.stop_gradient(logp)
+        logm = (tf.reduce_logsumexp(tf.stack([logp, logq]), axis=0)
+                - tf.math.log(tf.constant(2.0, logq.dtype)))
+        return _weighted_mean(0.5*(
+            (logp - logm) * tf.exp(logp - tf.stop_gradient(logq))
+            + (logq - logm) * tf.exp(logq - tf.stop_gradient(logq))), weights)
+    # pylint: enable=invalid-name
+
+    def monitor(self, names, logp, logq, weights=None):
+        """ Evaluate several divergences in a single pass for monitoring.
+
+        See Divergence.monitor, the ratio of the probabilities is computed
+        from logp and logq.
+
+        Arguments:
+            names (list of str): names of the divergences to be evaluated
+            logp (tf.tensor or array(nbatch) of floats): logarithm of the true probability
+            logq (tf.tensor or array(nbatch) of floats): logarithm of the estimated probability
+            weights (tf.tensor or array(nbatch) of floats): optional importance
+                weights of the points, the mean is normalized by their sum
+
+        Returns:
+            dict: the value of each requested divergence
+
+        """
+        log_ratio = logp - logq
+        return self.monitor_ratio(names, tf.exp(log_ratio), log_ratio,
+                                  weights)
+    # pylint: enable=arguments-differ
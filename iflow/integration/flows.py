@@ -0,0 +1,286 @@
+""" Implement the construction of normalizing flows on the unit hypercube.
+
+    A flow is a chain of coupling layers on top of a uniform distribution.
+    Each coupling layer transforms the features selected by a mask, the
+    masks are chosen such that every feature is transformed conditioned on
+    every other feature at least once.
+"""
+
+import collections
+import weakref
+
+import numpy as np
+
+import tensorflow as tf
+import tensorflow_probability as tfp
+
+from . import couplings
+from . import networks
+
+tfd = tfp.distributions  # pylint: disable=invalid-name
+tfb = tfp.bijectors  # pylint: disable=invalid-name
+
+COUPLINGS = {
+    'affine': couplings.AffineBijector,
+    'additive': couplings.AdditiveBijector,
+    'linear': couplings.PiecewiseLinear,
+    'quadratic': couplings.PiecewiseQuadratic,
+    'cubic': couplings.PiecewiseCubic,
+    'rational_quadratic': couplings.PiecewiseRationalQuadratic,
+}
+
+
+def binary_masks(ndims):
+    """ Masks from the binary representation of the feature index.
+
+    The k-th pair of masks splits the features by the k-th bit of their
+    index, such that any two features are separated by at least one pair.
+
+    Args:
+        ndims (int): Number of features.
+
+    Returns:
+        np.ndarray of size (2*ceil(log2(ndims)), ndims)
+
+    """
+    nbits = int(np.ceil(np.log2(ndims)))
+    sub_masks = (np.arange(ndims)[np.newaxis, :]
+                 >> np.arange(nbits)[:, np.newaxis]) & 1
+
+    masks = np.empty((2*nbits, ndims))
+    masks[0::2] = 1 - sub_masks
+    masks[1::2] = sub_masks
+    return masks
+
+
+def checkerboard_masks(ndims, nmasks=2):
+    """ Alternating masks transforming every other feature.
+
+    Args:
+        ndims (int): Number of features.
+        nmasks (int): Number of masks.
+
+    Returns:
+        np.ndarray of size (nmasks, ndims)
+
+    """
+    index = np.arange(nmasks)[:, np.newaxis] + np.arange(ndims)
+    return ((index + 1) % 2).astype(np.float64)
+
+
+def random_masks(ndims, nmasks=None, seed=None):
+    """ Pairs of random masks each transforming half of the features.
+
+    Every mask is followed by its complement, such that all features are
+    transformed once per pair.
+
+    Args:
+        ndims (int): Number of features.
+        nmasks (int): Number of masks, the number of binary masks if None.
+        seed (int): Seed of the random number generator.
+
+    Returns:
+        np.ndarray of size (nmasks, ndims)
+
+    """
+    if nmasks is None:
+        nmasks = 2*int(np.ceil(np.log2(ndims)))
+    state = np.random.RandomState(seed)
+    masks = np.zeros((nmasks, ndims))
+    for i in range(0, nmasks, 2):
+        masks[i, state.permutation(ndims)[:ndims//2]] = 1
+        if i + 1 < nmasks:
+            masks[i+1] = 1 - masks[i]
+    return masks
+
+
+MASKS = {
+    'binary': lambda ndims, nmasks, seed: binary_masks(ndims),
+    'checkerboard': lambda ndims, nmasks, seed: checkerboard_masks(
+        ndims, 2 if nmasks is None else nmasks),
+    'random': random_masks,
+}
+
+
+FlowFunctions = collections.namedtuple(
+    'FlowFunctions', ['sample_and_log_prob', 'log_prob'])
+
+_FUNCTIONS = weakref.WeakKeyDictionary()
+
+
+def flow_functions(flow):
+    """ Traced sampling and density functions of a flow.
+
+    The functions use the single pass of the coupling layers that returns
+    the log det Jacobian together with the transformation. They are created
+    once per flow, such that their traces for each batch size are reused
+    by all callers, also across builds of a flow cached by build_flow.
+
+    Args:
+        flow (tfd.TransformedDistribution): Flow, e.g. from build_flow.
+
+    Returns:
+        FlowFunctions: tf.functions sample_and_log_prob(nsamples), which
+        returns the points and their log probability, and log_prob(samples)
+
+    """
+    functions = _FUNCTIONS.get(flow)
+    if functions is not None:
+        return functions
+
+    base = flow.distribution
+    rank = base.event_shape.rank
+
+    @tf.function
+    def sample_and_log_prob(nsamples):
+        inputs, logq = base.experimental_sample_and_log_prob(nsamples)
+        samples, logdet = couplings.forward_and_log_det(
+            flow.bijector, inputs, rank)
+        return samples, logq - logdet
+
+    @tf.function
+    def log_prob(samples):
+        inputs, logdet = couplings.inverse_and_log_det(
+            flow.bijector, samples, rank)
+        return base.log_prob(inputs) + logdet
+
+    functions = FlowFunctions(sample_and_log_prob, log_prob)
+    _FUNCTIONS[flow] = functions
+    return functions
+
+
+class _FlowCache():
+    """ Least recently used store of built flows and their initial state.
+
+    Args:
+        maxsize (int): Maximal number of stored flows.
+
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._store = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._store)
+
+    def get(self, key):
+        """ Look up a flow and restore its initial variables. """
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        self._store.move_to_end(key)
+        flow, initial = entry
+        for variable, value in zip(flow.trainable_variables, initial):
+            variable.assign(value)
+        return flow
+
+    def put(self, key, flow):
+        """ Store a flow with the current values of its variables. """
+        initial = [tf.identity(variable)
+                   for variable in flow.trainable_variables]
+        self._store[key] = (flow, initial)
+        while len(self._store) > self.maxsize:
+            self._store.popitem(last=False)
+
+    def clear(self):
+        """ Remove all stored flows. """
+        self._store.clear()
+
+
+_CACHE = _FlowCache(maxsize=32)
+
+
+def clear_cache():
+    """ Remove all flows stored by build_flow. """
+    _CACHE.clear()
+
+
+def build_flow(ndims, coupling='rational_quadratic', masks='binary',
+               nmasks=None, seed=None, num_bins=16, blob=None, width=32,
+               depth=4, activation='relu', dtype=tf.float64, ensemble=None,
+               cache=False):
+    """ Build a normalizing flow on the unit hypercube.
+
+    By default, every call returns a new flow with its own variables.
+
+    With 'cache', the flow is stored keyed on its configuration, i.e. the
+    dimensions, coupling, masks, bins, networks, dtype and ensemble size.
+    Building the same configuration again returns the stored flow with its
+    variables reset to their initial values, instead of constructing new
+    layers and variables. All functions traced with the flow, e.g. those
+    of flow_functions, then remain valid and are not traced again. This
+    makes repeated scans over configurations fast. Note that the reset
+    applies to all references to the stored flow, so earlier builds of the
+    configuration must no longer be in use.
+
+    With 'ensemble' set, the flow holds that many independent members with
+    their weights stacked along a leading axis, see MultiFlowIntegrator.
+    Its points are then of size (ensemble, nsamples, ndims), with member i
+    along the first axis, e.g. from flow.sample((ensemble, nsamples)).
+
+    Args:
+        ndims (int): Number of dimensions, at least 2.
+        coupling (str): Coupling layer, one of the keys of COUPLINGS.
+        masks (str or array): Masks, one of the keys of MASKS, or an array
+                              of size (nmasks, ndims) of zeros and ones.
+        nmasks (int): Number of masks for the random and checkerboard masks.
+        seed (int): Seed of the random masks.
+        num_bins (int): Number of bins of the piecewise couplings.
+        blob (int): Number of bins of the one-blob encoding, None to
+                    disable it.
+        width (int): Number of nodes per hidden layer of the networks.
+        depth (int): Number of hidden layers of the networks.
+        activation (str): Activation of the hidden layers.
+        dtype (tf.DType): Type of the flow.
+        ensemble (int): Number of members, None for a single flow.
+        cache (bool): Whether to look up and store the flow in the cache.
+
+    Returns:
+        tfd.TransformedDistribution: the flow
+
+    Raises:
+        ValueError: If ndims, the coupling or the masks are invalid.
+
+    """
+    if ndims < 2:
+        raise ValueError('A coupling flow requires at least 2 dimensions')
+    if coupling not in COUPLINGS:
+        raise ValueError('Unknown coupling {}, expected one of {}'.format(
+            coupling, sorted(COUPLINGS)))
+    if isinstance(masks, str):
+        if masks not in MASKS:
+            raise ValueError('Unknown masks {}, expected one of {}'.format(
+                masks, sorted(MASKS)))
+        masks = MASKS[masks](ndims, nmasks, seed)
+    else:
+        masks = np.asarray(masks, dtype=np.float64)
+    if masks.shape[1:] != (ndims,):
+        raise ValueError('Masks need to be of size (nmasks, ndims)')
+    if np.any(np.all(masks > 0, axis=1) | np.all(masks <= 0, axis=1)):
+        raise ValueError('Each mask needs identity and transform features')
+
+    dtype = tf.as_dtype(dtype)
+    key = (ndims, coupling, masks.shape, masks.tobytes(), num_bins, blob,
+           width, depth, activation, dtype.name, ensemble)
+    if cache:
+        flow = _CACHE.get(key)
+        if flow is not None:
+            return flow
+
+    layer_kwargs = {'blob': blob}
+    if coupling not in ('affine', 'additive'):
+        layer_kwargs['num_bins'] = num_bins
+    build = networks.dense(width=width, depth=depth, activation=activation,
+                           dtype=dtype, ensemble=ensemble)
+    bijector = tfb.Chain([COUPLINGS[coupling](mask, build, **layer_kwargs)
+                          for mask in reversed(masks)])
+
+    low = np.zeros(ndims, dtype=dtype.as_numpy_dtype)
+    high = np.ones(ndims, dtype=dtype.as_numpy_dtype)
+    dist = tfd.Independent(distribution=tfd.Uniform(low=low, high=high),
+                           reinterpreted_batch_ndims=1)
+    flow = tfd.TransformedDistribution(distribution=dist, bijector=bijector)
+
+    if cache:
+        _CACHE.put(key, flow)
+    return flow
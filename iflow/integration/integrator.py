@@ -1,12 +1,18 @@
 """ Implement the flow integrator. """
 
+from concurrent.futures import ThreadPoolExecutor
+import warnings
+
 import numpy as np
 
 import tensorflow as tf
 import tensorflow_probability as tfp
 
+from . import couplings
 from . import divergences
-# from . import sinkhorn
+from .cache import IntegrandCache
+from .statistics import RunningMoments, WeightedAverage, unweighting_efficiency
+from . import sinkhorn
 
 # pylint: disable=invalid-name
 tfb = tfp.bijectors
@@ -36,6 +42,115 @@ def ewma(data, window):
     return out[-1]
 
 
+def _stateless_seed(seed, index):
+    """ Stateless seed of shape (2,) for stream 'index' of a seed.
+
+    The seed is reduced modulo 2**31, such that any non-negative integer
+    fits into the int32 seed of the stateless random operations.
+    """
+    return tf.constant([seed % 2**31, index], dtype=tf.int32)
+
+
+class BatchSizeScheduler():
+    """ Adaptive number of samples per training step.
+
+    The number of samples is always a power of two between 'min_samples'
+    and 'max_samples', such that only a few training steps are traced,
+    also when they are compiled with XLA. After every 'window' steps, the
+    losses of the window decide on the next batch size:
+
+    - If the loss fluctuates from step to step by more than 'noise' times
+      the mean absolute loss of the first window, the gradients are noisy
+      and the batch size is halved. This happens early in the training,
+      where cheap steps with noisy gradients are sufficient. The fixed
+      reference scale keeps the criterion meaningful for losses that
+      converge to zero.
+    - If the mean loss did not improve significantly with respect to the
+      previous window, i.e. by less than 'significance' times its
+      statistical uncertainty, the training plateaus and more samples are
+      needed to reduce the noise further. The batch size is doubled.
+    - If the mean loss got significantly worse, the batch size is halved.
+
+    Args:
+        min_samples (int): Minimal number of samples.
+        max_samples (int): Maximal number of samples.
+        initial_samples (int): Initial number of samples, 'min_samples' if
+                               None.
+        window (int): Number of steps between two changes.
+        significance (float): Number of standard deviations for a change
+                              of the loss to be significant.
+        noise (float): Standard deviation of the loss within a window,
+                       relative to the scale of the first window, above
+                       which the gradients are too noisy.
+
+    Raises:
+        ValueError: If there is no power of two between the limits, or if
+                    the window is shorter than two steps.
+
+    """
+    def __init__(self, min_samples=1024, max_samples=131072,
+                 initial_samples=None, window=20, significance=2.,
+                 noise=0.5):
+        self.sizes = [2**k for k in range(int(np.ceil(np.log2(min_samples))),
+                                          int(np.log2(max_samples)) + 1)]
+        if not self.sizes:
+            raise ValueError('No power of two between {} and {}'.format(
+                min_samples, max_samples))
+        if window < 2:
+            raise ValueError('The window needs at least two steps')
+        self.window = window
+        self.significance = significance
+        self.noise = noise
+        if initial_samples is None:
+            initial_samples = min_samples
+        self._index = int(np.argmin(np.abs(
+            np.log2(self.sizes) - np.log2(initial_samples))))
+        self._losses = []
+        self._previous = None
+        self._scale = None
+
+    @property
+    def nsamples(self):
+        """ int: Number of samples of the next step. """
+        return self.sizes[self._index]
+
+    def update(self, loss):
+        """ Record the loss of a step and update the number of samples.
+
+        Args:
+            loss (float): Loss of the last training step.
+
+        Returns:
+            int: Number of samples for the next step
+
+        """
+        self._losses.append(float(loss))
+        if len(self._losses) < self.window:
+            return self.nsamples
+
+        mean, std = np.mean(self._losses), np.std(self._losses, ddof=1)
+        # Differences of successive losses are insensitive to a steady trend
+        jitter = np.std(np.diff(self._losses)) / np.sqrt(2.)
+        current = (mean, std**2 / self.window)
+        if self._scale is None:
+            self._scale = np.mean(np.abs(self._losses))
+        self._losses = []
+        if jitter > self.noise * self._scale:
+            self._index -= 1
+        elif self._previous is not None:
+            improvement = self._previous[0] - current[0]
+            threshold = self.significance * np.sqrt(
+                self._previous[1] + current[1])
+            if improvement < -threshold:
+                self._index -= 1
+            elif improvement < threshold:
+                self._index += 1
+        self._index = min(max(self._index, 0), len(self.sizes) - 1)
+        self._previous = current
+
+        return self.nsamples
+
+
 class Integrator():
     """ Class implementing a normalizing flow integrator.
 
@@ -43,30 +158,64 @@ class Integrator():
         - func: Function to be integrated
         - dist: Distribution to be trained to match the function
         - optimizer: An optimizer from tensorflow used to train the network
-        - loss_func: The loss function to be minimized
+        - loss_func: The loss function to be minimized, the name of a
+                     divergence or a sinkhorn.SinkhornLoss
+        - jit_compile: Compile the training step with XLA. Functions wrapped
+                       in tf.numpy_function cannot be compiled.
+        - cache_size: Number of function values cached for reweight
+        - log_space: Evaluate the loss from log probabilities only
+        - accumulation_dtype: dtype of the function values, weights, moments
+                              and loss, e.g. tf.float64 for a float32 flow.
+                              Defaults to the dtype of the distribution.
+        - monitor: Names of divergences that are evaluated at every
+                   training step and stored in the variables self.metrics
         - kwargs: Additional arguments that need to be passed to the loss
 
     """
-    def __init__(self, func, dist, optimizer, loss_func='chi2', **kwargs):
+    def __init__(self, func, dist, optimizer, loss_func='chi2',
+                 jit_compile=False, cache_size=0, log_space=False,
+                 accumulation_dtype=None, monitor=None, **kwargs):
         """ Initialize the normalizing flow integrator. """
         self._func = func
         self.global_step = 0
         self.dist = dist
         self.optimizer = optimizer
-        self.divergence = divergences.Divergence(**kwargs)
-        # self.loss_func = sinkhorn.sinkhorn_loss
-        self.loss_func = self.divergence(loss_func)
+        self.log_space = log_space
+        self.accumulation_dtype = accumulation_dtype
+        if log_space:
+            self.divergence = divergences.LogDivergence(**kwargs)
+        else:
+            self.divergence = divergences.Divergence(**kwargs)
+        if isinstance(loss_func, sinkhorn.SinkhornLoss):
+            self.loss_func = loss_func
+        else:
+            self.loss_func = self.divergence(loss_func)
+        self.metrics = {}
+        for name in monitor or []:
+            # Fails early for divergences that are not implemented.
+            self.divergence(name)
+            self.metrics[name] = tf.Variable(
+                tf.zeros([], dtype=accumulation_dtype or dist.dtype),
+                trainable=False, name=name)
         # self.samples = tf.constant(self.dist.sample(1))
         self.ckpt_manager = None
+        self._traced_batch_sizes = set()
+        self._train_step = tf.function(self._train_one_step,
+                                       jit_compile=jit_compile)
+        self.cache = IntegrandCache(cache_size)
 
     def manager(self, ckpt_manager):
         """ Set the check point manager """
         self.ckpt_manager = ckpt_manager
 
-    @tf.function
     def train_one_step(self, nsamples, integral=False):
         """ Perform one step of integration and improve the sampling.
 
+        The step is traced once per batch size. If the integrator was
+        created with jit_compile, the whole step, i.e. sampling, flow,
+        integrand, loss and optimizer update, is compiled with XLA for
+        this batch size. Therefore, the batch size should be kept fixed.
+
         Args:
             - nsamples(int): Number of samples to be taken in a training step
             - integral(bool): Flag for returning the integral value or not.
@@ -76,31 +225,313 @@ class Integrator():
             - integral (optional): Estimate of the integral value
             - uncertainty (optional): Integral statistical uncertainty
 
+        Raises:
+            TypeError: If nsamples is a tensor.
+
         """
+        if tf.is_tensor(nsamples):
+            raise TypeError('nsamples needs to be a Python integer, not a '
+                            'tensor')
+        return self._train_step(int(nsamples), integral)
+
+    def _train_one_step(self, nsamples, integral=False):
+        """ Training step, wrapped in a tf.function at initialization. """
+        if not tf.executing_eagerly():
+            # Only runs while tracing.
+            self._traced_batch_sizes.add(nsamples)
+            if len(self._traced_batch_sizes) > 1:
+                warnings.warn(
+                    "train_one_step was retraced for {} different batch "
+                    "sizes. Keep the batch size fixed to avoid recompiling "
+                    "the training step.".format(
+                        len(self._traced_batch_sizes)), RuntimeWarning)
+
         samples = self.dist.sample(nsamples)
         # self.samples = tf.concat([self.samples, samples], 0)
         # if self.samples.shape[0] > 5001:
         #     self.samples = self.samples[nsamples:]
-        true = tf.abs(self._func(samples))
+        true = tf.abs(self._func(self._cast(samples)))
+        # The gradient is taken at fixed samples, which needs the inverse
+        # pass through the flow on the tape.
+        samples = tf.stop_gradient(samples)
         with tf.GradientTape() as tape:
-            test = self.dist.prob(samples)
-            logq = self.dist.log_prob(samples)
-            mean, var = tf.nn.moments(x=true/test, axes=[0])
-            true = tf.stop_gradient(true/mean)
-            logp = tf.where(true > 1e-16, tf.math.log(true),
-                            tf.math.log(true+1e-16))
-            # loss = self.loss_func(samples, samples, 1e-1, true, test, 100)
-            loss = self.loss_func(true, test, logp, logq)
+            logq = self._cast(self._dist_log_prob(samples))
+            if self.log_space:
+                logp, log_mean, log_var = self._log_moments(true, logq)
+                ratio = None
+            else:
+                test = tf.exp(logq)
+                ratio = true/test
+                mean, var = tf.nn.moments(x=ratio, axes=[0])
+                ratio = ratio/mean
+                true = tf.stop_gradient(true/mean)
+                logp = tf.where(true > 1e-16, tf.math.log(true),
+                                tf.math.log(true+1e-16))
+
+            if isinstance(self.loss_func, sinkhorn.SinkhornLoss):
+                loss = self.loss_func(self._cast(samples), logp, logq)
+            elif self.log_space:
+                loss = self.loss_func(logp, logq)
+            else:
+                loss = self.loss_func(true, test, logp, logq)
+
+        self._update_metrics(logp - logq, ratio)
 
         grads = tape.gradient(loss, self.dist.trainable_variables)
         self.optimizer.apply_gradients(
             zip(grads, self.dist.trainable_variables))
 
         if integral:
+            if self.log_space:
+                return loss, tf.exp(log_mean), tf.exp(
+                    0.5*(log_var - np.log(nsamples-1.)))
             return loss, mean, tf.sqrt(var/(nsamples-1.))
 
         return loss
 
+    @staticmethod
+    def _log_moments(true, logq):
+        """ Normalized log probability of the function, and log moments.
+
+        The weights true/q are only formed as exp(log true - log q), and
+        their mean with logsumexp, such that neither the function values
+        nor the probabilities need to be representable on their own.
+
+        Args:
+            - true: Absolute function values of the points
+            - logq: Log probability of the distribution the points were
+                    sampled from
+
+        Returns:
+            - logp: Log of the function normalized by its integral,
+                    bounded from below by log(1e-16)
+            - log_mean: Log of the estimate of the integral
+            - log_var: Log of the variance of the weights
+
+        """
+        logf = tf.math.log(true)
+        log_weights = logf - tf.stop_gradient(logq)
+        log_nsamples = tf.math.log(tf.cast(tf.size(true), true.dtype))
+        log_mean = tf.reduce_logsumexp(log_weights) - log_nsamples
+        log_mean2 = tf.reduce_logsumexp(2*log_weights) - log_nsamples
+        log_var = log_mean2 + tf.math.log1p(
+            -tf.minimum(tf.exp(2*log_mean - log_mean2), 1))
+        logp = tf.maximum(logf - log_mean, tf.math.log(
+            tf.constant(1e-16, true.dtype)))
+        return tf.stop_gradient(logp), log_mean, log_var
+
+    def train_replay(self, nsamples, replay_buffer, nupdates=4,
+                     integral=False):
+        """ Perform training steps reusing previously evaluated points.
+
+        A fresh batch of 'nsamples' points is drawn, the function is
+        evaluated once and the points are added to the replay buffer.
+        Then, 'nupdates' gradient steps are performed on batches drawn
+        from the buffer. Since the stored points were sampled from earlier
+        states of the distribution, the loss is reweighted by the self
+        normalized importance weights q_new(x) / q_old(x).
+
+        Args:
+            - nsamples(int): Number of samples to be taken in a training step
+            - replay_buffer(ReplayBuffer): Buffer of previously evaluated
+                                           points
+            - nupdates(int): Number of gradient steps per function evaluation
+            - integral(bool): Flag for returning the integral value or not.
+
+        Returns:
+            - loss: Value of the loss function for the last update
+            - integral (optional): Estimate of the integral value
+            - uncertainty (optional): Integral statistical uncertainty
+
+        Raises:
+            ValueError: If nupdates is smaller than 1.
+
+        """
+        if nupdates < 1:
+            raise ValueError('At least one update per step is required')
+
+        samples, values, logq = self._sample_and_evaluate(nsamples)
+        replay_buffer.add(samples, values, logq)
+
+        for _ in range(nupdates):
+            loss = self._train_on_samples(*replay_buffer.sample(nsamples))
+
+        if integral:
+            mean, var = tf.nn.moments(x=values/tf.exp(logq), axes=[0])
+            return loss, mean, tf.sqrt(var/(nsamples-1.))
+
+        return loss
+
+    def train_pipelined(self, nsamples, nsteps, nworkers=1,
+                        python_func=False):
+        """ Perform training steps with the function evaluated concurrently.
+
+        While the optimizer processes batch k, batch k+1 is already sampled
+        and the function is evaluated on it by a pool of 'nworkers' threads,
+        each evaluating an equal share of the batch. This hides the latency
+        of expensive external integrands. Batch k+1 is sampled before the
+        update of step k, i.e. from a distribution that is one step stale.
+        This is corrected by the importance weights q_new(x) / q_old(x),
+        as for train_replay.
+
+        By default, the function is called within a tf.function. An
+        integrand wrapped in tf.numpy_function then holds the GIL while it
+        runs, such that it is not evaluated concurrently. With
+        'python_func', the threads call the function directly on NumPy
+        arrays, which lets NumPy or external code that releases the GIL
+        run in parallel to the training.
+
+        Args:
+            - nsamples(int): Number of samples to be taken in a training step
+            - nsteps(int): Number of training steps
+            - nworkers(int): Number of threads evaluating the function
+            - python_func(bool): Whether the function takes and returns
+                                 NumPy arrays and is called directly
+
+        Returns:
+            - losses: np.ndarray of the loss of each step
+
+        """
+        evaluate = self._evaluate_numpy if python_func else self._evaluate
+
+        def _submit(pool):
+            samples, logq = self.sample_and_log_prob(nsamples)
+            chunks = np.array_split(samples.numpy(), nworkers)
+            return samples, logq, [pool.submit(evaluate, chunk)
+                                   for chunk in chunks]
+
+        losses = []
+        with ThreadPoolExecutor(nworkers) as pool:
+            pending = _submit(pool)
+            for step in range(nsteps):
+                samples, logq, futures = pending
+                values = tf.abs(tf.concat(
+                    [future.result() for future in futures], axis=0))
+                if step + 1 < nsteps:
+                    pending = _submit(pool)
+                losses.append(self._train_on_samples(samples, values, logq))
+
+        return np.array(losses)
+
+    @tf.function
+    def _sample_and_evaluate(self, nsamples):
+        """ Sample points with their log probability and function values. """
+        samples, logq = self._dist_sample_and_log_prob(nsamples)
+        return (samples, tf.abs(self._func(self._cast(samples))),
+                self._cast(logq))
+
+    @tf.function
+    def _train_on_samples(self, samples, values, logq_old):
+        """ Gradient step on points drawn from another distribution.
+
+        Args:
+            - samples: Points of size (nsamples, ndims)
+            - values: Absolute function values of the points
+            - logq_old: Log probability of the distribution the points
+                        were sampled from
+
+        Returns:
+            - loss: Value of the loss function for this step
+
+        """
+        values = self._cast(values)
+        logq_old = self._cast(logq_old)
+        if self.log_space:
+            logp, _, _ = self._log_moments(values, logq_old)
+        else:
+            mean = tf.reduce_mean(values/tf.exp(logq_old))
+            true = values/mean
+            logp = tf.where(true > 1e-16, tf.math.log(true),
+                            tf.math.log(true+1e-16))
+        with tf.GradientTape() as tape:
+            logq = self._cast(self._dist_log_prob(samples))
+            weights = tf.stop_gradient(tf.exp(logq - logq_old))
+            if self.log_space:
+                ratio = None
+            else:
+                test = tf.exp(logq)
+                ratio = true/test
+            if isinstance(self.loss_func, sinkhorn.SinkhornLoss):
+                loss = self.loss_func(self._cast(samples), logp, logq,
+                                      weights=weights)
+            elif self.log_space:
+                loss = self.loss_func(logp, logq, weights=weights)
+            else:
+                loss = self.loss_func(true, test, logp, logq,
+                                      weights=weights)
+
+        self._update_metrics(logp - logq, ratio, weights)
+
+        grads = tape.gradient(loss, self.dist.trainable_variables)
+        self.optimizer.apply_gradients(
+            zip(grads, self.dist.trainable_variables))
+
+        return loss
+
+    def _update_metrics(self, log_ratio, ratio=None, weights=None):
+        """ Store the monitored divergences of a training step.
+
+        All training steps call this with the log ratio logp - logq of their
+        loss, and the ratio true/test if it was computed for the loss. The
+        ratio is obtained from the log ratio otherwise. The importance
+        weights of reused points normalize the means.
+
+        """
+        if not self.metrics:
+            return
+        if ratio is None:
+            ratio = tf.exp(log_ratio)
+        values = self.divergence.monitor_ratio(list(self.metrics), ratio,
+                                               log_ratio, weights)
+        for name, value in values.items():
+            self.metrics[name].assign(value)
+
+    def train_to_target(self, target, scheduler=None, max_steps=10000):
+        """ Train until the combined integral reaches a relative precision.
+
+        The integral estimates of the training steps are combined weighted
+        by their inverse variance. The number of samples per step is set
+        by the scheduler, such that the target is reached with few function
+        calls. The training step is traced once for each batch size of the
+        scheduler, without the warning about retracing.
+
+        Args:
+            target (float): Target relative precision of the integral.
+            scheduler (BatchSizeScheduler): Scheduler of the number of
+                                            samples, default if None.
+            max_steps (int): Maximal number of training steps.
+
+        Returns:
+            (tuple): numpy arrays of the integral estimates, uncertainties
+            and number of samples of each step
+
+        """
+        if scheduler is None:
+            scheduler = BatchSizeScheduler()
+
+        means, stddevs, sizes = [], [], []
+        average = WeightedAverage()
+        for _ in range(max_steps):
+            nsamples = scheduler.nsamples
+            with warnings.catch_warnings():
+                warnings.filterwarnings('ignore', message='train_one_step '
+                                        'was retraced',
+                                        category=RuntimeWarning)
+                loss, mean, error = self.train_one_step(nsamples,
+                                                        integral=True)
+            means.append(float(mean))
+            stddevs.append(float(error))
+            sizes.append(nsamples)
+            scheduler.update(loss)
+
+            if stddevs[-1] == 0:
+                break
+            average.add(means[-1], stddevs[-1])
+            if average.error < target * average.mean:
+                break
+
+        return np.array(means), np.array(stddevs), np.array(sizes)
+
     @tf.function
     def sample(self, nsamples):
         """ Sample from the trained distribution.
@@ -115,7 +546,26 @@ class Integrator():
         return self.dist.sample(nsamples)
 
     @tf.function
-    def integrate(self, nsamples):
+    def sample_and_log_prob(self, nsamples):
+        """ Sample from the trained distribution with their log probability.
+
+        The points are obtained by pushing samples of the base distribution
+        forward through the bijector, while accumulating the log det Jacobian.
+        Therefore, the probability of the points comes at no extra cost and
+        no inverse pass through the bijector is needed.
+
+        Args:
+            nsamples(int): Number of points to be sampled.
+
+        Returns:
+            tuple of 2 tf.tensors: sampled points of size (nsamples, ndim)
+            and their log probability of size (nsamples,)
+
+        """
+        return self._dist_sample_and_log_prob(nsamples)
+
+    @tf.function
+    def integrate(self, nsamples, seed=None):
         """ Integrate the function with trained distribution.
 
         This method estimates the value of the integral based on
@@ -127,18 +577,91 @@ class Integrator():
 
         Args:
             nsamples(int): Number of points on which the estimate is based on.
+            seed(tf.Tensor): Optional stateless seed of shape (2,).
 
         Returns:
             tuple of 2 tf.tensors: mean and variance
 
         """
-        samples = self.dist.sample(nsamples)
-        test = self.dist.prob(samples)
-        true = self._func(samples)
+        samples, logq = self._dist_sample_and_log_prob(
+            nsamples, seed=seed)
+        test = tf.exp(self._cast(logq))
+        true = self._func(self._cast(samples))
         return tf.nn.moments(x=true/test, axes=[0])
 
+    def _map_chunks(self, func, nsamples, chunk_size, nworkers, seed):
+        """ Evaluate func(size, seed) on chunks of the total sample.
+
+        Each chunk gets the stateless seed (seed, chunk index), such that
+        the result does not depend on the number of workers. The results
+        are yielded in the order of the chunks.
+        """
+        if seed is None:
+            seed = np.random.randint(np.iinfo(np.int32).max)
+        sizes = [min(chunk_size, nsamples - start)
+                 for start in range(0, nsamples, chunk_size)]
+        seeds = [_stateless_seed(seed, ichunk)
+                 for ichunk in range(len(sizes))]
+
+        if nworkers > 1:
+            with ThreadPoolExecutor(nworkers) as pool:
+                yield from pool.map(func, sizes, seeds)
+        else:
+            yield from map(func, sizes, seeds)
+
+    def integrate_chunked(self, nsamples, chunk_size=100000, nworkers=1,
+                          seed=None, python_func=False):
+        """ Integrate the function with trained distribution in chunks.
+
+        Same estimate as integrate, but the points are processed in chunks
+        of at most 'chunk_size' points and the moments are merged on the
+        fly. Therefore, the memory is bounded by the chunk size and not by
+        the total number of points.
+
+        The chunks can be evaluated in parallel by a pool of 'nworkers'
+        threads. Each chunk is sampled with its own reproducible random
+        stream, derived from 'seed'.
+
+        By default, the function is evaluated within a tf.function, so only
+        TensorFlow integrands run in parallel. An integrand wrapped in
+        tf.numpy_function holds the GIL. With 'python_func', the points are
+        still sampled in TensorFlow, but the threads call the function
+        directly on NumPy arrays, such that NumPy or external code that
+        releases the GIL runs in parallel.
+
+        Args:
+            nsamples(int): Number of points on which the estimate is based on.
+            chunk_size(int): Maximal number of points evaluated at once.
+            nworkers(int): Number of chunks evaluated in parallel.
+            seed(int): Seed of the random streams, drawn randomly if None.
+            python_func(bool): Whether the function takes and returns NumPy
+                               arrays and is called directly.
+
+        Returns:
+            tuple of 3 floats: mean, variance and effective sample size
+
+        Raises:
+            ValueError: If nsamples is not positive.
+
+        """
+        if nsamples < 1:
+            raise ValueError('nsamples needs to be positive')
+
+        def _chunk(size, chunk_seed):
+            if python_func:
+                weights = self._sample_weights_numpy(size, chunk_seed)
+                return size, (np.mean(weights), np.var(weights))
+            return size, self.integrate(size, chunk_seed)
+
+        moments = RunningMoments()
+        for size, (mean, var) in self._map_chunks(
+                _chunk, nsamples, chunk_size, nworkers, seed):
+            moments.add(size, mean, var)
+
+        return moments.mean, moments.variance, moments.ess
+
     @tf.function
-    def sample_weights(self, nsamples, yield_samples=False):
+    def sample_weights(self, nsamples, yield_samples=False, seed=None):
         """ Sample from the trained distribution and return their weights.
 
         This method samples 'nsamples' points from the trained distribution
@@ -151,49 +674,301 @@ class Integrator():
         Args:
             nsamples (int): Number of samples to be drawn.
             yield_samples (bool): Also return samples if true.
+            seed (tf.Tensor): Optional stateless seed of shape (2,).
 
         Returns:
             true/test: tf.tensor of size (nsamples, 1) of sampled weights
             (samples: tf.tensor of size (nsamples, ndims) of sampled points)
 
         """
-        samples = self.dist.sample(nsamples)
-        test = self.dist.prob(samples)
-        true = self._func(samples)
+        samples, logq = self._dist_sample_and_log_prob(
+            nsamples, seed=seed)
+        test = tf.exp(self._cast(logq))
+        true = self._func(self._cast(samples))
 
         if yield_samples:
             return true/test, samples
 
         return true/test
 
-    def acceptance(self, nopt, npool=50, nreplica=1000):
+    def sample_weights_chunked(self, nsamples, yield_samples=False,
+                               chunk_size=100000, nworkers=1, seed=None,
+                               python_func=False):
+        """ Sample weights in chunks, optionally in parallel.
+
+        Same as sample_weights, but the points are drawn in chunks of at
+        most 'chunk_size' points by a pool of 'nworkers' threads. Each chunk
+        is sampled with its own reproducible random stream, derived from
+        'seed'. The function is evaluated as for integrate_chunked.
+
+        Args:
+            nsamples (int): Number of samples to be drawn.
+            yield_samples (bool): Also return samples if true.
+            chunk_size (int): Maximal number of points evaluated at once.
+            nworkers (int): Number of chunks evaluated in parallel.
+            seed (int): Seed of the random streams, drawn randomly if None.
+            python_func (bool): Whether the function takes and returns NumPy
+                                arrays and is called directly.
+
+        Returns:
+            np.ndarray of size (nsamples,) of sampled weights
+            (np.ndarray of size (nsamples, ndims) of sampled points)
+
+        Raises:
+            ValueError: If nsamples is not positive.
+
+        """
+        if nsamples < 1:
+            raise ValueError('nsamples needs to be positive')
+
+        def _chunk(size, chunk_seed):
+            if python_func:
+                return self._sample_weights_numpy(size, chunk_seed,
+                                                  yield_samples)
+            return self.sample_weights(size, yield_samples, chunk_seed)
+
+        chunks = list(self._map_chunks(
+            _chunk, nsamples, chunk_size, nworkers, seed))
+
+        if yield_samples:
+            return (np.concatenate([wgt for wgt, _ in chunks]),
+                    np.concatenate([pts for _, pts in chunks]))
+
+        return np.concatenate(chunks)
+
+    def _sample_weights_numpy(self, nsamples, seed, yield_samples=False):
+        """ Weights of points sampled in the graph for a NumPy function. """
+        samples, logq = self._sample_chunk(nsamples, seed)
+        weights = self._evaluate_numpy(samples) / np.exp(np.asarray(logq))
+
+        if yield_samples:
+            return weights, samples.numpy()
+
+        return weights
+
+    def unweight(self, nevents, batch_size=100000, max_weight=None,
+                 quantile=None, out=None, seed=None):
+        """ Generate unweighted events by hit-or-miss sampling.
+
+        Weighted points are drawn in batches and each point is accepted
+        with probability w / w_max. If no fixed 'max_weight' is given,
+        w_max is the running maximum of the weights drawn so far. To make
+        it robust against rare, very large weights, the running maximum
+        can be taken over the 'quantile' of each batch instead, at the
+        cost of a small bias from the weights above w_max. Whenever w_max
+        increases, the events accepted so far are unweighted again with
+        probability w_max_old / w_max_new, such that all events are
+        unweighted with respect to the same w_max.
+
+        Args:
+            nevents (int): Number of unweighted events to generate.
+            batch_size (int): Number of weighted points drawn at once.
+            max_weight (float): Fixed maximal weight. If None, the
+                                maximum is determined on the fly.
+            quantile (float): Quantile of the batch weights used as the
+                              maximum, e.g. 0.999. If None, the maximum
+                              of the batch is used.
+            out (np.ndarray): Optional array of size (nevents, ndims) the
+                              events are written to, e.g. np.memmap.
+            seed (int): Seed for sampling and the accept-reject step.
+
+        Returns:
+            np.ndarray of size (nevents, ndims) of unweighted events
+
+        """
+        rng = np.random.default_rng(seed)
+        if seed is None:
+            seed = rng.integers(np.iinfo(np.int32).max)
+        wgt_max = 0. if max_weight is None else max_weight
+        naccepted = 0
+        ibatch = 0
+        while naccepted < nevents:
+            weights, samples = self.sample_weights(
+                batch_size, yield_samples=True,
+                seed=_stateless_seed(seed, ibatch))
+            weights, samples = np.asarray(weights), np.asarray(samples)
+            ibatch += 1
+            if out is None:
+                out = np.empty((nevents,) + samples.shape[1:],
+                               dtype=samples.dtype)
+
+            if max_weight is None:
+                if quantile is None:
+                    batch_max = np.max(weights)
+                else:
+                    batch_max = np.quantile(weights, quantile)
+                if batch_max > wgt_max:
+                    if naccepted > 0:
+                        keep = (rng.random(naccepted) * batch_max < wgt_max)
+                        naccepted = np.count_nonzero(keep)
+                        out[:naccepted] = out[:len(keep)][keep]
+                    wgt_max = batch_max
+
+            accept = weights > rng.random(len(weights)) * wgt_max
+            events = samples[accept][:nevents - naccepted]
+            out[naccepted:naccepted + len(events)] = events
+            naccepted += len(events)
+
+        return out
+
+    def reweight(self, samples, values=None):
+        """ Weights of a fixed set of points under the current distribution.
+
+        Only the probability of the points is recomputed. The function
+        values are taken from 'values' if given, or else from the cache.
+        The function is only evaluated for a set of points that is in
+        neither. Given or evaluated function values are stored in the cache,
+        such that reweighting the same points again, e.g. after further
+        training, does not call the function.
+
+        Args:
+            samples (np.ndarray): Points of size (nsamples, ndims).
+            values (np.ndarray): Optional function values of the points.
+
+        Returns:
+            np.ndarray of size (nsamples,) of weights
+
+        """
+        samples = np.asarray(samples)
+        if values is None:
+            values = self.cache.get(samples)
+            if values is None:
+                values = np.asarray(self._evaluate(samples))
+                self.cache.put(samples, values)
+        else:
+            self.cache.put(samples, values)
+
+        return values / np.exp(np.asarray(self._log_prob(samples)))
+
+    @tf.function
+    def _evaluate(self, samples):
+        """ Evaluate the function. """
+        return self._func(self._cast(samples))
+
+    def _evaluate_numpy(self, samples):
+        """ Evaluate a function of NumPy arrays outside of the graph. """
+        samples = np.asarray(self._cast(samples))
+        return np.asarray(self._func(samples), dtype=samples.dtype)
+
+    @tf.function
+    def _sample_chunk(self, nsamples, seed):
+        """ Sample points and their log probability from a stateless seed. """
+        samples, logq = self._dist_sample_and_log_prob(nsamples, seed=seed)
+        return samples, self._cast(logq)
+
+    @tf.function
+    def _log_prob(self, samples):
+        """ Log probability of the points under the current distribution. """
+        return self._cast(self._dist_log_prob(samples))
+
+    def _dist_log_prob(self, samples):
+        """ Log probability of the flow from a single inverse pass.
+
+        The coupling layers return the inverse pass together with its log
+        det Jacobian, such that the transform networks are evaluated once.
+
+        """
+        if not isinstance(self.dist, tfd.TransformedDistribution):
+            return self.dist.log_prob(samples)
+        base = self.dist.distribution
+        inputs, logdet = couplings.inverse_and_log_det(
+            self.dist.bijector, samples, base.event_shape.rank)
+        return base.log_prob(inputs) + logdet
+
+    def _dist_sample_and_log_prob(self, nsamples, seed=None):
+        """ Sample from the flow with the log probability of a single pass.
+
+        The coupling layers return the forward pass together with its log
+        det Jacobian, such that the transform networks are evaluated once.
+
+        """
+        if not isinstance(self.dist, tfd.TransformedDistribution):
+            return self.dist.experimental_sample_and_log_prob(
+                nsamples, seed=seed)
+        base = self.dist.distribution
+        inputs, logq = base.experimental_sample_and_log_prob(
+            nsamples, seed=seed)
+        samples, logdet = couplings.forward_and_log_det(
+            self.dist.bijector, inputs, base.event_shape.rank)
+        return samples, logq - logdet
+
+    def _cast(self, tensor):
+        """ Cast to the accumulation dtype, if one is set. """
+        if self.accumulation_dtype is None:
+            return tensor
+        return tf.cast(tensor, self.accumulation_dtype)
+
+    def validate(self, reference, nsamples):
+        """ Compare the distribution against a higher precision reference.
+
+        The variables of the reference, i.e. the same flow built in
+        float64, are set to the ones of the trained distribution. Both are
+        evaluated on the same points sampled from the trained distribution,
+        to check that training in lower precision does not bias the
+        probabilities or the integral.
+
+        Args:
+            reference: Distribution with the same variables as self.dist
+            nsamples (int): Number of points for the comparison.
+
+        Returns:
+            tuple of 2 floats: maximal absolute difference of the log
+            probabilities, and relative difference of the integral estimates
+
+        Raises:
+            ValueError: If the variables of the reference do not match.
+
+        """
+        variables = self.dist.trainable_variables
+        ref_variables = reference.trainable_variables
+        if (len(variables) != len(ref_variables)
+                or any(var.shape != ref_var.shape for var, ref_var
+                       in zip(variables, ref_variables))):
+            raise ValueError('The variables of the reference distribution '
+                             'do not match the trained distribution.')
+        for var, ref_var in zip(variables, ref_variables):
+            ref_var.assign(tf.cast(var, ref_var.dtype))
+
+        samples = self.sample(nsamples)
+        logq = tf.cast(self._log_prob(samples), reference.dtype)
+        samples = tf.cast(samples, reference.dtype)
+        ref_logq = reference.log_prob(samples)
+        true = tf.cast(self._func(samples), reference.dtype)
+        mean = tf.reduce_mean(true / tf.exp(logq))
+        ref_mean = tf.reduce_mean(true / tf.exp(ref_logq))
+
+        return (float(tf.reduce_max(tf.abs(logq - ref_logq))),
+                float(tf.abs(mean / ref_mean - 1)))
+
+    def acceptance(self, nopt, npool=50, nreplica=1000, chunk_size=100000,
+                   seed=None):
         """ Calculate the acceptance, i.e. the unweighting
             efficiency as discussed in
             "Event Generation with Normalizing Flows"
             by C. Gao, S. Hoeche, J. Isaacson, C. Krause and H. Schulz
 
+        The pool of npool * nopt weights is drawn in chunks of at most
+        'chunk_size' points, see sample_weights_chunked, such that only the
+        weights and not the points of the whole pool are kept in memory.
+        The bootstrap replicas are evaluated without materializing them,
+        see statistics.unweighting_efficiency.
+
         Args:
-            nopt (int): Number of points on which the optimization was based on.
+            nopt (int): Number of points on which the optimization was
+                        based on.
             npool (int): called n in the reference
             nreplica (int): called m in the reference
+            chunk_size (int): Maximal number of points evaluated at once.
+            seed (int): Seed of the pool and of the replicas, drawn
+                        randomly if None.
 
         Returns:
             (float): unweighting efficiency
 
         """
-
-        weights = []
-        for _ in range(npool):
-            wgt = self.sample_weights(nopt)
-            weights.append(wgt)
-        weights = np.concatenate(weights)
-
-        sample = np.random.choice(weights, (nreplica, nopt))
-        s_max = np.max(sample, axis=1)
-        s_mean = np.mean(sample, axis=1)
-        s_acc = np.mean(s_mean) / np.median(s_max)
-
-        return s_acc
+        weights = self.sample_weights_chunked(
+            npool * nopt, chunk_size=chunk_size, seed=seed)
+        return unweighting_efficiency(weights, nopt, nreplica, seed)
 
 #    def acceptance_calc(self, accuracy, max_samples=50000, min_samples=5000):
 #        """ Calculate the acceptance using a right tailed confidence interval
@@ -0,0 +1,277 @@
+""" Implement the multi-channel flow integrator. """
+
+import numpy as np
+
+import tensorflow as tf
+import tensorflow_probability as tfp
+
+from . import couplings
+from . import divergences
+
+tfd = tfp.distributions  # pylint: disable=invalid-name
+
+
+class MultiChannelIntegrator():
+    r""" Class implementing a multi-channel normalizing flow integrator.
+
+    The integrand is sampled from the mixture
+
+    .. math::
+
+        g(x) = \sum_c \alpha_c q_c(x),
+
+    of several trainable distributions :math:`q_c`, the channels, with
+    trainable channel weights :math:`\alpha_c`. Each channel can adapt to
+    a different peak of the integrand. As in the multi-channel method of
+    VEGAS, the samples are allocated proportional to
+    :math:`\alpha_c s_c`, with the standard deviation :math:`s_c` of the
+    weights of channel c in the last training step, which minimizes the
+    variance of the stratified estimate. A fraction of the samples is
+    allocated proportional to :math:`\alpha_c` alone, such that a channel
+    with an underestimated variance still gets points to correct it. The
+    points of all channels are evaluated together in one batch. The
+    channel weights are trained jointly with the flows by minimizing the
+    loss of the mixture.
+
+    Args:
+        - func: Function to be integrated
+        - dists: List of distributions, one for each channel
+        - optimizer: An optimizer from tensorflow used to train the network
+        - loss_func: The loss function to be minimized
+        - weight_fraction: Fraction of the samples allocated proportional
+                           to the channel weights alone
+        - kwargs: Additional arguments that need to be passed to the loss
+
+    """
+    def __init__(self, func, dists, optimizer, loss_func='chi2',
+                 weight_fraction=0.1, **kwargs):
+        """ Initialize the multi-channel integrator. """
+        self._func = func
+        self.global_step = 0
+        self.dists = list(dists)
+        self.nchannels = len(self.dists)
+        self.optimizer = optimizer
+        self.divergence = divergences.Divergence(**kwargs)
+        self.loss_func = self.divergence(loss_func)
+        self.weight_fraction = weight_fraction
+        dtype = self.dists[0].dtype
+        self.channel_logits = tf.Variable(
+            tf.zeros(self.nchannels, dtype=dtype), name='channel_logits')
+        self.channel_stddevs = None
+
+    @property
+    def channel_weights(self):
+        """ tf.Tensor: The normalized channel weights alpha. """
+        return tf.nn.softmax(self.channel_logits)
+
+    @property
+    def trainable_variables(self):
+        """ list: The channel logits and the variables of all channels. """
+        variables = [self.channel_logits]
+        for dist in self.dists:
+            variables += list(dist.trainable_variables)
+        return variables
+
+    def allocate(self, nsamples):
+        """ Number of samples of each channel.
+
+        Apart from the 'weight_fraction' allocated proportional to the
+        channel weights alpha_c, the number of samples is proportional to
+        alpha_c s_c, with the standard deviations s_c of the channels in
+        the last training step. Before the first step, or if all of them
+        vanish, it is proportional to alpha_c. Each channel gets at least
+        two points, such that all of them keep training and their variance
+        is estimated. The counts are rounded by the largest remainder, such
+        that they add up to 'nsamples'. The allocation is corrected by the
+        weights of the points, see _sample.
+
+        Args:
+            nsamples(int): Total number of points.
+
+        Returns:
+            tf.tensor of size (nchannels,) of the number of samples
+
+        Raises:
+            ValueError: If nsamples is smaller than two per channel.
+
+        """
+        if nsamples < 2 * self.nchannels:
+            raise ValueError('At least two samples per channel are required')
+
+        alphas = self.channel_weights.numpy()
+        shares = alphas
+        if self.channel_stddevs is not None and np.any(
+                self.channel_stddevs > 0):
+            shares = alphas * self.channel_stddevs
+            shares = ((1 - self.weight_fraction) * shares / np.sum(shares)
+                      + self.weight_fraction * alphas)
+
+        ideal = nsamples * shares / np.sum(shares)
+        counts = np.maximum(np.floor(ideal), 2).astype(int)
+        excess = nsamples - np.sum(counts)
+        if excess > 0:
+            counts[np.argsort(counts - ideal)[:excess]] += 1
+        for _ in range(-excess):
+            surplus = np.where(counts > 2, counts - ideal, -np.inf)
+            counts[np.argmax(surplus)] -= 1
+        return tf.constant(counts, dtype=tf.int32)
+
+    def log_prob(self, samples):
+        """ Log probability of the mixture of all channels.
+
+        Args:
+            samples: Points of size (nsamples, ndims)
+
+        Returns:
+            tf.tensor of size (nsamples,) of the log probability
+
+        """
+        log_probs = tf.stack([self._channel_log_prob(dist, samples)
+                              for dist in self.dists], axis=-1)
+        log_alphas = tf.nn.log_softmax(self.channel_logits)
+        return tf.reduce_logsumexp(log_probs + log_alphas, axis=-1)
+
+    @staticmethod
+    def _channel_log_prob(dist, samples):
+        """ Log probability of one channel from a single inverse pass.
+
+        The coupling layers return the inverse pass together with its log
+        det Jacobian, such that the transform networks are evaluated once.
+
+        """
+        if not isinstance(dist, tfd.TransformedDistribution):
+            return dist.log_prob(samples)
+        base = dist.distribution
+        inputs, logdet = couplings.inverse_and_log_det(
+            dist.bijector, samples, base.event_shape.rank)
+        return base.log_prob(inputs) + logdet
+
+    def _sample(self, counts):
+        """ Sample the points of all channels.
+
+        Returns the points, the index of the channel they were sampled from,
+        and their weight alpha_c N / n_c that corrects for the number of
+        points allocated to each channel.
+        """
+        samples = tf.concat([dist.sample(counts[i])
+                             for i, dist in enumerate(self.dists)], axis=0)
+        channels = tf.repeat(tf.range(self.nchannels), counts)
+        ntotal = tf.cast(tf.reduce_sum(counts), self.channel_logits.dtype)
+        weights = (self.channel_weights * ntotal
+                   / tf.cast(counts, self.channel_logits.dtype))
+        return (tf.stop_gradient(samples), channels,
+                tf.stop_gradient(tf.gather(weights, channels)))
+
+    def _moments(self, values, channels, counts):
+        """ Stratified estimate of the mean and the variance.
+
+        With the unbiased variances s_c^2 of the n_c points of each channel,
+        the uncertainty of the mean is sqrt(sum_c alpha_c^2 s_c^2 / n_c).
+        The variance is scaled by (nsamples-1), such that
+        sqrt(var/(nsamples-1)) is this uncertainty, as for
+        Integrator.integrate. The variances s_c^2 are returned as well.
+        """
+        dtype = values.dtype
+        alphas = tf.stop_gradient(self.channel_weights)
+        counts = tf.cast(counts, dtype)
+        means = tf.math.unsorted_segment_sum(
+            values, channels, self.nchannels) / counts
+        sq_means = tf.math.unsorted_segment_sum(
+            values**2, channels, self.nchannels) / counts
+        variances = tf.maximum(sq_means - means**2, 0) * counts / tf.maximum(
+            counts - 1, 1)
+        mean = tf.reduce_sum(alphas * means)
+        var = ((tf.reduce_sum(counts) - 1)
+               * tf.reduce_sum(alphas**2 * variances / counts))
+        return mean, var, variances
+
+    def train_one_step(self, nsamples, integral=False):
+        """ Perform one step of integration and improve the sampling.
+
+        Args:
+            - nsamples(int): Number of samples to be taken in a training step
+            - integral(bool): Flag for returning the integral value or not.
+
+        Returns:
+            - loss: Value of the loss function for this step
+            - integral (optional): Estimate of the integral value
+            - uncertainty (optional): Integral statistical uncertainty
+
+        """
+        counts = self.allocate(nsamples)
+        loss, mean, var, variances = self._train_one_step(counts)
+        self.channel_stddevs = np.sqrt(variances.numpy())
+        self.global_step += 1
+
+        if integral:
+            return loss, mean, tf.sqrt(var/(nsamples-1.))
+
+        return loss
+
+    @tf.function
+    def _train_one_step(self, counts):
+        """ Training step for a given number of samples per channel. """
+        samples, channels, weights = self._sample(counts)
+        true = tf.abs(self._func(samples))
+        with tf.GradientTape() as tape:
+            logq = self.log_prob(samples)
+            test = tf.exp(logq)
+            mean, var, variances = self._moments(
+                true/tf.stop_gradient(test), channels, counts)
+            true = tf.stop_gradient(true/mean)
+            logp = tf.where(true > 1e-16, tf.math.log(true),
+                            tf.math.log(true+1e-16))
+            loss = self.loss_func(true, test, logp, logq, weights=weights)
+
+        variables = self.trainable_variables
+        grads = tape.gradient(loss, variables)
+        self.optimizer.apply_gradients(zip(grads, variables))
+
+        return loss, mean, var, variances
+
+    def integrate(self, nsamples):
+        """ Integrate the function with the trained channels.
+
+        Args:
+            nsamples(int): Number of points on which the estimate is based on.
+
+        Returns:
+            tuple of 2 tf.tensors: mean and variance, see Integrator.integrate
+
+        """
+        return self._integrate(self.allocate(nsamples))
+
+    @tf.function
+    def _integrate(self, counts):
+        samples, channels, _ = self._sample(counts)
+        true = self._func(samples)
+        test = tf.exp(self.log_prob(samples))
+        return self._moments(true/test, channels, counts)[:2]
+
+    def sample_weights(self, nsamples, yield_samples=False):
+        """ Sample from the channels and return the weights of the points.
+
+        The weights include the correction alpha_c N / n_c for the number
+        of points allocated to each channel.
+
+        Args:
+            nsamples (int): Number of samples to be drawn.
+            yield_samples (bool): Also return samples if true.
+
+        Returns:
+            weights: tf.tensor of size (nsamples,) of sampled weights
+            (samples: tf.tensor of size (nsamples, ndims) of sampled points)
+
+        """
+        weights, samples = self._sample_weights(self.allocate(nsamples))
+        if yield_samples:
+            return weights, samples
+
+        return weights
+
+    @tf.function
+    def _sample_weights(self, counts):
+        samples, _, weights = self._sample(counts)
+        true = self._func(samples)
+        test = tf.exp(self.log_prob(samples))
+        return weights * true / test, samples
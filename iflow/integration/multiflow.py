@@ -0,0 +1,138 @@
+""" Implement the joint training of an ensemble of independent flows. """
+
+import tensorflow as tf
+import tensorflow_probability as tfp
+
+from . import couplings
+from . import divergences
+
+tfd = tfp.distributions  # pylint: disable=invalid-name
+
+
+class MultiFlowIntegrator():
+    """ Class training an ensemble of independent flows in one step.
+
+    The members of the ensemble are stacked along a leading axis of a single
+    flow, see build_flow with the 'ensemble' option. The transform networks
+    and splines of all members are then evaluated by the same batched
+    operations, and the optimizer updates the stacked variables, such that
+    its state is vectorized as well. The points of all members are
+    evaluated in a single call of the integrand. Each member is trained on
+    its own samples with its own loss, as separate Integrators would be,
+    which makes the ensemble suited to train several seeds of a flow at
+    once. The optimizer should not clip the global norm of the gradients,
+    as this couples the members.
+
+    Args:
+        - func: Function to be integrated
+        - dist: Distribution of the ensemble, whose points of size
+                (nmembers, nsamples, ndims) hold the points of member i
+                along the first axis
+        - nmembers: Number of members of the ensemble
+        - optimizer: An optimizer from tensorflow used to train the networks
+        - loss_func: The loss function to be minimized
+        - kwargs: Additional arguments that need to be passed to the loss
+
+    """
+    def __init__(self, func, dist, nmembers, optimizer, loss_func='chi2',
+                 **kwargs):
+        """ Initialize the multi-flow integrator. """
+        self._func = func
+        self.dist = dist
+        self.nmembers = nmembers
+        self.optimizer = optimizer
+        self.divergence = divergences.Divergence(**kwargs)
+        self.loss_func = self.divergence(loss_func)
+
+    @property
+    def trainable_variables(self):
+        """ list: The stacked variables of all members. """
+        return list(self.dist.trainable_variables)
+
+    def _sample_and_evaluate(self, nsamples):
+        """ Sample all members and evaluate the integrand in one batch.
+
+        Returns the points of size (nmembers, nsamples, ndims) and the
+        function values of size (nmembers, nsamples).
+        """
+        samples = self.dist.sample((self.nmembers, nsamples))
+        ndims = tf.shape(samples)[-1]
+        true = self._func(tf.reshape(samples, [-1, ndims]))
+        return (tf.stop_gradient(samples),
+                tf.reshape(true, [self.nmembers, nsamples]))
+
+    def _log_prob(self, samples):
+        """ Log probability of each member for its own points.
+
+        The coupling layers of a flow return the inverse pass together with
+        its log det Jacobian, such that the networks are evaluated once.
+
+        """
+        if not isinstance(self.dist, tfd.TransformedDistribution):
+            return self.dist.log_prob(samples)
+        base = self.dist.distribution
+        inputs, logdet = couplings.inverse_and_log_det(
+            self.dist.bijector, samples, base.event_shape.rank)
+        return base.log_prob(inputs) + logdet
+
+    def train_one_step(self, nsamples, integral=False):
+        """ Perform one step of integration and improve all members.
+
+        Args:
+            - nsamples(int): Number of samples per member
+            - integral(bool): Flag for returning the integral values or not.
+
+        Returns:
+            - loss: Values of the loss function of each member
+            - integral (optional): Estimates of the integral of each member
+            - uncertainty (optional): Their statistical uncertainties
+
+        """
+        loss, mean, var = self._train_one_step(nsamples)
+
+        if integral:
+            return loss, mean, tf.sqrt(var/(nsamples-1.))
+
+        return loss
+
+    @tf.function
+    def _train_one_step(self, nsamples):
+        """ Training step of all members for a given number of samples. """
+        samples, true = self._sample_and_evaluate(nsamples)
+        true = tf.abs(true)
+        with tf.GradientTape() as tape:
+            logq = self._log_prob(samples)
+            test = tf.exp(logq)
+            mean, var = tf.nn.moments(x=true/test, axes=[1])
+            true = tf.stop_gradient(true/mean[:, tf.newaxis])
+            logp = tf.where(true > 1e-16, tf.math.log(true),
+                            tf.math.log(true+1e-16))
+            # Only the reductions of the loss are done per member.
+            loss = tf.stack([self.loss_func(true[i], test[i], logp[i],
+                                            logq[i])
+                             for i in range(self.nmembers)])
+            # The members share no weights, so the gradient of the sum
+            # is the gradient of each loss with respect to its member.
+            total = tf.reduce_sum(loss)
+
+        variables = self.trainable_variables
+        grads = tape.gradient(total, variables)
+        self.optimizer.apply_gradients(zip(grads, variables))
+
+        return loss, mean, var
+
+    @tf.function
+    def integrate(self, nsamples):
+        """ Integrate the function with each member.
+
+        Args:
+            nsamples(int): Number of points per member.
+
+        Returns:
+            tuple of 2 tf.tensors of size (nmembers,): means and variances,
+            see Integrator.integrate
+
+        """
+        samples, true = self._sample_and_evaluate(nsamples)
+        test = tf.exp(self._log_prob(samples))
+        return tf.nn.moments(x=true/test, axes=[1])
@@ -0,0 +1,147 @@
+""" Implement lightweight transform networks for the coupling layers.
+
+    The coupling layers only need a function of the identity features that
+    returns the parameters of the transform. A plain stack of dense layers
+    is enough for this, and building it directly from variables avoids the
+    overhead of the Keras functional API when the flow is constructed and
+    when it is called. Each layer is a matmul followed by a bias add and the
+    activation, which the graph optimizer fuses into a single kernel on CPU.
+"""
+
+import numpy as np
+
+import tensorflow as tf
+
+
+class DenseNetwork(tf.Module):
+    """ Multilayer perceptron used as transform network.
+
+    The hidden layers are initialized with the Glorot uniform distribution
+    and zero bias. The output layer is initialized to zero, such that the
+    coupling layer is the identity transformation before training.
+
+    With 'ensemble' set, the network holds the independent weights of
+    several members stacked along a leading axis. It then maps inputs of
+    size (ensemble, nsamples, in_features) with batched matrix products,
+    such that all members are evaluated by the same few kernels.
+
+    Args:
+        in_features (int): Dimensionality of the inputs.
+        out_features (int): Dimensionality of the outputs.
+        width (int): Number of nodes per hidden layer.
+        depth (int): Number of hidden layers.
+        activation (str or callable): Activation of the hidden layers.
+        dtype (tf.DType): Type of the weights, the Keras float type if None.
+        seed (int): Operation seed of the initialization, which is
+                    reproducible with tf.random.set_seed.
+        ensemble (int): Number of members, None for a single network.
+        name (str): Name of the module.
+
+    """
+    def __init__(self, in_features, out_features, width=32, depth=4,
+                 activation='relu', dtype=None, seed=None, ensemble=None,
+                 name=None):
+        super(DenseNetwork, self).__init__(name=name)
+        if dtype is None:
+            dtype = tf.keras.backend.floatx()
+        self.dtype = tf.as_dtype(dtype)
+        self.activation = tf.keras.activations.get(activation)
+        self.ensemble = ensemble
+        # The biases of an ensemble broadcast over the samples of a member.
+        kernel_shape = () if ensemble is None else (ensemble,)
+        bias_shape = () if ensemble is None else (ensemble, 1)
+
+        sizes = [in_features] + [width]*depth
+        self.kernels = []
+        self.biases = []
+        for i, (size_in, size_out) in enumerate(zip(sizes[:-1], sizes[1:])):
+            limit = float(np.sqrt(6. / (size_in + size_out)))
+            self.kernels.append(tf.Variable(
+                tf.random.uniform(kernel_shape + (size_in, size_out),
+                                  -limit, limit, dtype=self.dtype, seed=seed),
+                name='kernel_{}'.format(i)))
+            self.biases.append(tf.Variable(
+                tf.zeros(bias_shape + (size_out,), dtype=self.dtype),
+                name='bias_{}'.format(i)))
+        self.kernels.append(tf.Variable(
+            tf.zeros(kernel_shape + (sizes[-1], out_features),
+                     dtype=self.dtype),
+            name='kernel_{}'.format(depth)))
+        self.biases.append(tf.Variable(
+            tf.zeros(bias_shape + (out_features,), dtype=self.dtype),
+            name='bias_{}'.format(depth)))
+
+    def __call__(self, inputs, context=None):
+        """ Evaluate the network.
+
+        Args:
+            inputs (tf.Tensor): Inputs of size (nsamples, in_features), or
+                                (ensemble, nsamples, in_features) for an
+                                ensemble.
+            context (tf.Tensor): Not used, accepted for the coupling layers.
+
+        Returns:
+            tf.Tensor of size (nsamples, out_features), or (ensemble,
+            nsamples, out_features) for an ensemble
+
+        """
+        del context
+        if self.ensemble is None:
+            affine = tf.nn.bias_add
+        else:
+            affine = tf.add
+        hidden = inputs
+        for kernel, bias in zip(self.kernels[:-1], self.biases[:-1]):
+            hidden = self.activation(affine(tf.matmul(hidden, kernel), bias))
+        return affine(tf.matmul(hidden, self.kernels[-1]), self.biases[-1])
+
+    def save_weights(self, filepath):
+        """ Save the variables to a TensorFlow checkpoint.
+
+        Args:
+            filepath (str): Prefix of the checkpoint files.
+
+        """
+        tf.train.Checkpoint(network=self).write(filepath)
+
+    def load_weights(self, filepath):
+        """ Load the variables from a checkpoint written by save_weights.
+
+        Args:
+            filepath (str): Prefix of the checkpoint files.
+
+        """
+        tf.train.Checkpoint(network=self).read(filepath).assert_consumed()
+
+
+def dense(width=32, depth=4, activation='relu', dtype=None, seed=None,
+          ensemble=None):
+    """ Create a transform network factory for the coupling layers.
+
+    The returned function has the signature expected for the
+    'transform_net_create_fn' of the coupling layers. A dictionary passed
+    as 'options' to a coupling layer overrides the arguments given here.
+
+    Args:
+        width (int): Number of nodes per hidden layer.
+        depth (int): Number of hidden layers.
+        activation (str or callable): Activation of the hidden layers.
+        dtype (tf.DType): Type of the weights, the Keras float type if None.
+        seed (int): Operation seed of the initialization.
+        ensemble (int): Number of members, None for a single network.
+
+    Returns:
+        callable: function (in_features, out_features, options) returning
+        a DenseNetwork
+
+    """
+    defaults = {'width': width, 'depth': depth, 'activation': activation,
+                'dtype': dtype, 'seed': seed, 'ensemble': ensemble}
+
+    def build(in_features, out_features, options):
+        kwargs = dict(defaults)
+        if options is not None:
+            kwargs.update(options)
+        return DenseNetwork(in_features, out_features, **kwargs)
+
+    return build
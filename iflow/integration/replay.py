@@ -0,0 +1,75 @@
+""" Implement a replay buffer of evaluated samples. """
+
+import numpy as np
+
+
+class ReplayBuffer():
+    """ Bounded buffer of points, their function values and probabilities.
+
+    The buffer stores the points x, the function values f(x) and the log
+    probability log q_old(x) of the distribution the points were drawn
+    from. Once the capacity is reached, the oldest points are evicted.
+    The stored points can be reused for training with importance weights
+    q_new(x) / q_old(x), without calling the integrand again.
+
+    Args:
+        capacity (int): Maximal number of points stored.
+        seed (int): Seed for drawing points from the buffer.
+
+    """
+
+    def __init__(self, capacity, seed=None):
+        """ Initialize an empty buffer. """
+        self.capacity = capacity
+        self._samples = None
+        self._values = None
+        self._logq = None
+        self._size = 0
+        self._next = 0
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, samples, values, logq):
+        """ Add points to the buffer, evicting the oldest ones if full.
+
+        Args:
+            samples (np.ndarray): Points of size (nsamples, ndims).
+            values (np.ndarray): Function values of size (nsamples,).
+            logq (np.ndarray): Log probability of the points of size
+                               (nsamples,) under the sampling distribution.
+
+        """
+        samples = np.asarray(samples)[-self.capacity:]
+        values = np.asarray(values)[-self.capacity:]
+        logq = np.asarray(logq)[-self.capacity:]
+
+        if self._samples is None:
+            self._samples = np.empty((self.capacity,) + samples.shape[1:],
+                                     dtype=samples.dtype)
+            self._values = np.empty(self.capacity, dtype=values.dtype)
+            self._logq = np.empty(self.capacity, dtype=logq.dtype)
+
+        idx = (self._next + np.arange(len(samples))) % self.capacity
+        self._samples[idx] = samples
+        self._values[idx] = values
+        self._logq[idx] = logq
+        self._next = (self._next + len(samples)) % self.capacity
+        self._size = min(self._size + len(samples), self.capacity)
+
+    def sample(self, nsamples):
+        """ Draw points from the buffer uniformly with replacement.
+
+        Args:
+            nsamples (int): Number of points to be drawn.
+
+        Returns:
+            tuple of 3 np.ndarrays: points, function values and log
+            probability of the sampling distribution
+
+        """
+        if self._size == 0:
+            raise ValueError('Cannot sample from an empty replay buffer.')
+        idx = self._rng.integers(0, self._size, nsamples)
+        return self._samples[idx], self._values[idx], self._logq[idx]
@@ -1,10 +1,23 @@
 """ Implement the Sinkhorn loss.
 
-    Modified from the pyTorch implementation found here,
-    https://github.com/gpeyre/SinkhornAutoDiff/tree/generalization
-    into Tensorflow.
+    The Sinkhorn divergence [1] between two weighted point clouds is
+    computed with log-domain Sinkhorn iterations and epsilon-scaling, as
+    in the GeomLoss library [2]. The cost matrix is never stored: the
+    soft-minimum over one point cloud is reduced block by block with an
+    online logsumexp, such that the memory grows linearly with the number
+    of points, also for the gradient.
+
+    [1] Interpolating between Optimal Transport and MMD using
+        Sinkhorn Divergences
+    by: Jean Feydy, Thibault Sejourne, Francois-Xavier Vialard,
+        Shun-ichi Amari, Alain Trouve, and Gabriel Peyre
+    arXiv: 1810.08278
+
+    [2] https://github.com/jeanfeydy/geomloss
 """
 
+import numpy as np
+
 import tensorflow as tf
 
 
@@ -17,190 +30,247 @@ def dist(pts_x, pts_y):
     return tf.maximum(distances, 0)
 
 
-def sinkhorn2(wgt_a, wgt_b, mat, reg, niter):
-    """ Preform Sinkhorn iterations to converge on the loss. """
-    wgt_a = tf.convert_to_tensor(wgt_a, dtype=tf.float64)
-    wgt_b = tf.convert_to_tensor(wgt_b, dtype=tf.float64)
-    mat = tf.convert_to_tensor(mat, dtype=tf.float64)
-
-    dim_a = len(wgt_a)
-    dim_b = len(wgt_b)
-    vec_u = tf.ones((dim_a, 1), dtype=tf.float64) / dim_a
-    vec_v = tf.ones((dim_b, 1), dtype=tf.float64) / dim_b
-
-    mat_k = tf.zeros_like(mat, dtype=tf.float64)
-    mat_k = tf.divide(mat, -reg)
-    mat_k = tf.exp(mat_k)
-
-    tmp2 = tf.zeros_like(wgt_b, dtype=tf.float64)
-
-    mat_kp = tf.reshape((1 / wgt_a), (-1, 1)) * mat_k
-    cpt = 0
-    err = 1
-    while (err > 1e-6 and cpt < niter):
-        k_transpose_u = tf.matmul(tf.transpose(mat_k), vec_u)
-        vec_v = wgt_b/k_transpose_u
-        vec_u = 1. / tf.matmul(mat_kp, vec_v)
-
-        if cpt % 10 == 0:
-            tmp2 = tf.einsum('ik,ij,jk->jk', vec_u, mat_k, vec_v)
-            err = tf.norm(tmp2 - wgt_b)
-
-        cpt += 1
+def _blocks(pts_y, log_b, block_size):
+    """ Split the points into blocks, padding with zero weight points. """
+    ncols = tf.shape(pts_y)[0]
+    nblocks = (ncols + block_size - 1) // block_size
+    pad = nblocks * block_size - ncols
+    pts_y = tf.pad(pts_y, [[0, pad], [0, 0]])
+    log_b = tf.pad(log_b, [[0, pad]], constant_values=-np.inf)
+    return (nblocks, tf.reshape(pts_y, [nblocks, block_size, -1]),
+            tf.reshape(log_b, [nblocks, block_size]))
+
+
+def _softmin(pts_x, pts_y, log_b, epsilon, block_size):
+    r""" Soft-minimum of the cost over the points y, for each point x.
+
+    Computes
+
+    .. math::
+
+        f_i = -\epsilon \log \sum_j \exp(h_j - |x_i - y_j|^2 / \epsilon),
+
+    where h_j = log_b contains the log weights and the potential of the
+    points y. The sum runs over blocks of 'block_size' points y with a
+    running maximum, such that only blocks of the cost matrix are
+    computed. The gradient is computed blockwise as well.
+
+    """
+    nblocks, y_blocks, h_blocks = _blocks(pts_y, log_b, block_size)
+    nrows = tf.shape(pts_x)[0]
+
+    def _reduce(pts_x, y_blocks, h_blocks):
+        def body(i, running_max, running_sum):
+            values = (h_blocks[i][tf.newaxis, :]
+                      - dist(pts_x, y_blocks[i]) / epsilon)
+            new_max = tf.maximum(running_max, tf.reduce_max(values, axis=1))
+            running_sum = (running_sum * tf.exp(running_max - new_max)
+                           + tf.reduce_sum(
+                               tf.exp(values - new_max[:, tf.newaxis]),
+                               axis=1))
+            return i + 1, new_max, running_sum
+
+        _, running_max, running_sum = tf.while_loop(
+            lambda i, *_: i < nblocks, body,
+            [tf.constant(0), tf.fill([nrows], pts_x.dtype.min),
+             tf.zeros([nrows], dtype=pts_x.dtype)])
+        return running_max + tf.math.log(running_sum)
+
+    @tf.custom_gradient
+    def _softmin_blocks(pts_x, y_blocks, h_blocks):
+        lse = _reduce(pts_x, y_blocks, h_blocks)
+
+        def grad(upstream):
+            # With the transport plan P_ij = exp(h_j - C_ij/eps - lse_i),
+            # df_i/dh_j = -eps P_ij and dC_ij/dx_i = 2 (x_i - y_j).
+            def body(i, weighted_y, col_weights, col_x):
+                plan = tf.exp(h_blocks[i][tf.newaxis, :]
+                              - dist(pts_x, y_blocks[i]) / epsilon
+                              - lse[:, tf.newaxis])
+                weighted_y += tf.matmul(plan, y_blocks[i])
+                col_weights = col_weights.write(
+                    i, tf.linalg.matvec(plan, upstream, transpose_a=True))
+                col_x = col_x.write(i, tf.matmul(
+                    plan, upstream[:, tf.newaxis] * pts_x, transpose_a=True))
+                return i + 1, weighted_y, col_weights, col_x
+
+            _, weighted_y, col_weights, col_x = tf.while_loop(
+                lambda i, *_: i < nblocks, body,
+                [tf.constant(0), tf.zeros_like(pts_x),
+                 tf.TensorArray(pts_x.dtype, size=nblocks),
+                 tf.TensorArray(pts_x.dtype, size=nblocks)])
+            col_weights = col_weights.stack()
+            grad_x = 2 * upstream[:, tf.newaxis] * (pts_x - weighted_y)
+            grad_y = 2 * (col_weights[..., tf.newaxis] * y_blocks
+                          - col_x.stack())
+            grad_h = -epsilon * col_weights
+            return grad_x, grad_y, grad_h
+
+        return -epsilon * lse, grad
+
+    return _softmin_blocks(pts_x, y_blocks, h_blocks)
+
+
+def _potentials(pts_x, pts_y, log_a, log_b, epsilon, scaling, niter, tol,
+                block_size):
+    """ Dual potentials of the entropic transport from a to b.
+
+    The iterations start at a blur of the size of the point clouds, which
+    is reduced by the factor 'scaling' in every iteration until 'epsilon'
+    is reached. Then, they run until the potentials change by less than
+    'tol' or 'niter' iterations are done. No gradients are propagated.
+
+    """
+    pts_x = tf.stop_gradient(pts_x)
+    pts_y = tf.stop_gradient(pts_y)
+    log_a = tf.stop_gradient(log_a)
+    log_b = tf.stop_gradient(log_b)
+    epsilon = tf.cast(epsilon, pts_x.dtype)
+
+    pts = tf.concat([pts_x, pts_y], axis=0)
+    diameter = tf.reduce_sum(
+        (tf.reduce_max(pts, axis=0) - tf.reduce_min(pts, axis=0))**2)
+    eps_start = tf.maximum(diameter, epsilon)
+
+    def cond(i, pot_f, pot_g, eps, err):
+        del pot_f, pot_g
+        return (i < niter) & ((eps > epsilon) | (err > tol))
+
+    def body(i, pot_f, pot_g, eps, err):
+        del err
+        new_f = _softmin(pts_x, pts_y, log_b + pot_g / eps, eps, block_size)
+        new_g = _softmin(pts_y, pts_x, log_a + new_f / eps, eps, block_size)
+        err = tf.reduce_max(tf.abs(new_f - pot_f))
+        return (i + 1, new_f, new_g, tf.maximum(epsilon, eps * scaling), err)
+
+    _, pot_f, pot_g, _, _ = tf.while_loop(
+        cond, body,
+        [tf.constant(0), tf.zeros_like(log_a), tf.zeros_like(log_b),
+         eps_start, tf.constant(np.inf, dtype=pts_x.dtype)])
+    return tf.stop_gradient(pot_f), tf.stop_gradient(pot_g)
+
+
+def sinkhorn_divergence(pts_x, pts_y, log_a=None, log_b=None, epsilon=1e-2,
+                        scaling=0.5, niter=100, tol=1e-4, block_size=1024):
+    r""" Sinkhorn divergence between two weighted point clouds.
+
+    Computes the debiased divergence
+
+    .. math::
+
+        S_\epsilon(a, b) = OT_\epsilon(a, b)
+            - \frac{1}{2} OT_\epsilon(a, a) - \frac{1}{2} OT_\epsilon(b, b)
+
+    for the squared Euclidean cost. The potentials are found without
+    gradients. A final Sinkhorn step is then taken with gradients, which
+    gives the gradient with respect to the points and the weights.
+    Only a, b and the potentials of the size of the point clouds are
+    stored, the cost is evaluated in blocks of 'block_size' points.
+
+    Args:
+        pts_x (tf.Tensor): Points of the first cloud, size (n, ndims).
+        pts_y (tf.Tensor): Points of the second cloud, size (m, ndims).
+        log_a (tf.Tensor): Normalized log weights of the first cloud,
+                           uniform if None.
+        log_b (tf.Tensor): Normalized log weights of the second cloud,
+                           uniform if None.
+        epsilon (float): Entropic regularization, i.e. blur squared.
+        scaling (float): Factor by which epsilon is reduced per iteration.
+        niter (int): Maximal number of iterations.
+        tol (float): Tolerance for the change of the potentials.
+        block_size (int): Number of points per block of the cost matrix.
+
+    Returns:
+        tf.Tensor: the Sinkhorn divergence
+
+    """
+    if log_a is None:
+        log_a = tf.fill([tf.shape(pts_x)[0]], -tf.math.log(
+            tf.cast(tf.shape(pts_x)[0], pts_x.dtype)))
+    if log_b is None:
+        log_b = tf.fill([tf.shape(pts_y)[0]], -tf.math.log(
+            tf.cast(tf.shape(pts_y)[0], pts_y.dtype)))
+    epsilon = tf.cast(epsilon, pts_x.dtype)
+    options = (epsilon, scaling, niter, tol, block_size)
+
+    pot_f, pot_g = _potentials(pts_x, pts_y, log_a, log_b, *options)
+    # The potentials are only defined up to opposite constant shifts,
+    # the symmetric problems need the symmetric potential.
+    pot_aa = 0.5 * tf.add_n(_potentials(pts_x, pts_x, log_a, log_a,
+                                        *options))
+    pot_bb = 0.5 * tf.add_n(_potentials(pts_y, pts_y, log_b, log_b,
+                                        *options))
+
+    # Last extrapolation: by the envelope theorem, the gradient only flows
+    # through the first points of each soft-minimum and the outer weights.
+    def _extrapolate(pts_x, pts_y, log_b, pot):
+        return _softmin(pts_x, tf.stop_gradient(pts_y),
+                        tf.stop_gradient(log_b + pot / epsilon), epsilon,
+                        block_size)
+
+    pot_f, pot_g = (_extrapolate(pts_x, pts_y, log_b, pot_g),
+                    _extrapolate(pts_y, pts_x, log_a, pot_f))
+    pot_aa = _extrapolate(pts_x, pts_x, log_a, pot_aa)
+    pot_bb = _extrapolate(pts_y, pts_y, log_b, pot_bb)
+
+    return (tf.reduce_sum(tf.exp(log_a) * (pot_f - pot_aa))
+            + tf.reduce_sum(tf.exp(log_b) * (pot_g - pot_bb)))
+
+
+class SinkhornLoss():
+    """ Sinkhorn divergence as loss function of the Integrator.
+
+    The points x_i are sampled from the trained distribution q. The target
+    measure is given by the same points weighted by p(x_i)/q(x_i), and the
+    measure of the distribution by the points with uniform weights. The
+    divergence vanishes if q is proportional to p. If importance weights
+    are passed for points that were sampled from another distribution,
+    both measures are reweighted by them.
+
+    Args:
+        epsilon (float): Entropic regularization, i.e. blur squared.
+        scaling (float): Factor by which epsilon is reduced per iteration.
+        niter (int): Maximal number of iterations.
+        tol (float): Tolerance for the change of the potentials.
+        block_size (int): Number of points per block of the cost matrix.
+
+    """
+    def __init__(self, epsilon=1e-2, scaling=0.5, niter=100, tol=1e-4,
+                 block_size=1024):
+        self.epsilon = epsilon
+        self.scaling = scaling
+        self.niter = niter
+        self.tol = tol
+        self.block_size = block_size
+
+    def __call__(self, samples, logp, logq, weights=None):
+        """ Calculate the Sinkhorn loss.
+
+        Args:
+            samples (tf.Tensor): Points of size (nsamples, ndims).
+            logp (tf.Tensor): Logarithm of the true probability.
+            logq (tf.Tensor): Logarithm of the estimated probability.
+            weights (tf.Tensor): Optional importance weights of the points.
+
+        Returns:
+            tf.Tensor: the Sinkhorn divergence
+
+        """
+        log_weights = tf.zeros_like(logq)
+        if weights is not None:
+            log_weights = tf.math.log(weights)
+        log_a = tf.nn.log_softmax(tf.stop_gradient(logp) - logq + log_weights)
+        log_b = tf.nn.log_softmax(log_weights)
+        return sinkhorn_divergence(samples, samples, log_a, log_b,
+                                   self.epsilon, self.scaling, self.niter,
+                                   self.tol, self.block_size)
 
-    return tf.einsum('ik,ij,jk,ij->k', vec_u, mat_k, vec_v, mat)
 
-
-def empirical_sinkhorn2(x_s, x_t, reg, wgt_a, wgt_b, niter=100):
-    """ Calculate the Sinkhorn loss. """
-    x_s = tf.convert_to_tensor(x_s, dtype=tf.float64)
-    x_t = tf.convert_to_tensor(x_t, dtype=tf.float64)
-
-    mat = dist(x_s, x_t)
-
-    return sinkhorn2(wgt_a, wgt_b, mat, reg, niter)
-
-
-@tf.function
 def sinkhorn_loss(x_s, x_t, reg, wgt_a, wgt_b, niter):
     """ Calculate the Sinkhorn divergence. """
-    if len(wgt_a.shape) != 2:
-        wgt_a = wgt_a[:, tf.newaxis]
-
-    if len(wgt_b.shape) != 2:
-        wgt_b = wgt_b[:, tf.newaxis]
-
-    sinkhorn_ab = empirical_sinkhorn2(x_s, x_t, reg, wgt_a, wgt_b, niter)
-    sinkhorn_a = empirical_sinkhorn2(x_s, x_s, reg, wgt_a, wgt_a, niter)
-    sinkhorn_b = empirical_sinkhorn2(x_t, x_t, reg, wgt_b, wgt_b, niter)
-
-    print(sinkhorn_ab - 1/2 * (sinkhorn_a + sinkhorn_b))
-
-    return (sinkhorn_ab - 1/2 * (sinkhorn_a + sinkhorn_b))[0]
-
-
-# @tf.function
-# def sinkhorn_normalized(true, test, eps, mu, nu, niter):
-#     """ Computes Sinkhorn divergence. """
-#     print('here', true, test, eps, mu, nu)
-#     w_xy = sinkhorn_loss(true, test, eps, mu, nu, niter)
-#     w_xx = sinkhorn_loss(true, true, eps, mu, mu, niter)
-#     w_yy = sinkhorn_loss(test, test, eps, nu, nu, niter)
-#     print(w_xy, w_xx, w_yy)
-
-#     return w_xy - 0.5 * w_xx - 0.5 * w_yy
-
-
-# @tf.function
-# def sinkhorn_loss(true, test, eps, mu, nu, niter=100,
-#                   acc=1e-3, unbalanced=False):
-#     """ Calculate the Sinkhorn loss. """
-#     C = cost_matrix(true, test)
-
-#     tau = -0.8
-#     thresh = acc
-
-#     if unbalanced:
-#         rho = (0.5)**2
-#         lam = rho / (rho + eps)
-
-#     def ave(u, u1):
-#         """ Barycenter subroutine. """
-#         return tau * u + (1-tau) * u1
-
-#     def M(u, v):
-#         """ Modified cost for logarithmic updates. """
-#         return (-C + tf.transpose(u) + v) / eps
-
-#     def squeeze_lse(arg):
-#         """ Preform squeeze and log sum exp. """
-#         return tf.squeeze(tf.reduce_logsumexp(arg, axis=1, keepdims=True))
-
-#     u, v, err = tf.zeros_like(mu), tf.zeros_like(nu), 0.
-#     actual_nits = 0
-
-#     for _ in range(niter):
-#         u1 = u
-#         if unbalanced:
-#             u = ave(u, lam*(eps*(tf.math.log(mu)-squeeze_lse(M(u, v))+u)))
-#             v = ave(v, lam*(eps*(tf.math.log(nu)
-#                             - squeeze_lse(tf.transpose(M(u, v)))+v)))
-#         else:
-#             u += eps * (tf.math.log(mu) - squeeze_lse(M(u, v)))
-#             v += eps * (tf.math.log(nu) - squeeze_lse(tf.transpose(M(u, v))))
-
-#         err = tf.reduce_sum(tf.abs(u - u1))
-#         actual_nits += 1
-# #        if err/tf.reduce_sum(tf.abs(u)) < thresh:
-# #            break
-
-# #    tf.print(actual_nits, err/tf.reduce_sum(tf.abs(u)))
-#     return tf.reduce_sum(tf.exp(M(u, v)) * C)
-
-
-# def cost_matrix(x, y, p=2):
-#     """ Returns the matrix of |x_i - y_j|^p. """
-#     x_col = tf.expand_dims(x, 1)
-#     y_row = tf.expand_dims(y, 0)
-#     return tf.reduce_sum(tf.abs(x_col - y_row)**p, axis=2)
-
-
-# def main():
-#     """ Basic test of the Sinkhorn loss. """
-#     import numpy as np
-#     import matplotlib.pyplot as plt
-
-#     n = 1000
-#     m = 1000
-#     N = [n, m]
-
-#     x = tf.convert_to_tensor(np.random.rand(N[0], 2)-0.5, dtype=tf.float32)
-#     theta = 2*np.pi*np.random.rand(1, N[1])
-#     r = 0.8 + 0.2 * np.random.rand(1, N[1])
-#     y = tf.convert_to_tensor(np.vstack((np.cos(theta)*r, np.sin(theta)*r)).T,
-#                              dtype=tf.float32)
-
-#     def plotp(x, col):
-#         plt.scatter(x[:, 0], x[:, 1], s=50,
-#                     edgecolors='k', c=col, linewidths=1)
-
-#     mu = tf.random.uniform([n])
-#     mu /= tf.reduce_sum(mu)
-#     nu = tf.ones(m)/m
-
-#     plt.figure(figsize=(6, 6))
-#     plotp(x, 'b')
-#     plotp(y, 'r')
-
-#     plt.xlim(np.min(y[:, 0]) - 0.1, np.max(y[:, 0]) + 0.1)
-#     plt.ylim(np.min(y[:, 1]) - 0.1, np.max(y[:, 1]) + 0.1)
-#     plt.title('Input marginals')
-
-#     eps = tf.constant(0.5)
-#     niter = 100
-
-#     with tf.GradientTape() as tape:
-#         # l1 = sinkhorn_loss(x, y, eps, mu, nu, niter=5)
-#         l2 = sinkhorn_normalized(y, y, eps, mu, nu, niter=2)
-
-#         # print('Sinkhorn loss: ', l1)
-#         print('Sinkhorn normalized: ', l2)
-
-#         # l1 = sinkhorn_loss(x, y, eps, mu, nu, niter=5)
-#         l2 = sinkhorn_normalized(y, y, eps, mu, nu, niter=10)
-
-#         # print('Sinkhorn loss: ', l1)
-#         print('Sinkhorn normalized: ', l2)
-
-#         # l1 = sinkhorn_loss(x, y, eps, mu, nu, niter=5)
-#         l2 = sinkhorn_normalized(y, y, eps, mu, nu, niter=100)
-
-#         # print('Sinkhorn loss: ', l1)
-#         print('Sinkhorn normalized: ', l2)
-
-#     print(tape.gradient(l2, y))
-#     # plt.show()
-
-
-# if __name__ == '__main__':
-#     main()
+    wgt_a = tf.reshape(wgt_a, [-1])
+    wgt_b = tf.reshape(wgt_b, [-1])
+    log_a = tf.math.log(wgt_a / tf.reduce_sum(wgt_a))
+    log_b = tf.math.log(wgt_b / tf.reduce_sum(wgt_b))
+    return sinkhorn_divergence(x_s, x_t, log_a, log_b, epsilon=reg,
+                               niter=niter)
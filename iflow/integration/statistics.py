@@ -0,0 +1,211 @@
+""" Implement streaming statistics for the integration results. """
+
+import numpy as np
+
+
+class RunningMoments():
+    """ Running mean and variance of a stream of weights.
+
+    The moments are accumulated chunk by chunk, such that the memory does
+    not depend on the total number of weights. Chunks are combined with
+    the pairwise update of Chan et al., which is numerically stable also
+    for a large number of chunks, in contrast to accumulating the sum and
+    the sum of squares.
+
+    The variance follows the convention of tf.nn.moments, i.e. it is the
+    variance of the weights and not the variance of the mean.
+
+    """
+    def __init__(self):
+        """ Initialize the moments without any weights. """
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+
+    def add(self, count, mean, variance):
+        """ Merge the moments of a chunk of weights.
+
+        Args:
+            count (int): Number of weights in the chunk.
+            mean (float): Mean of the weights in the chunk.
+            variance (float): Variance of the weights in the chunk.
+
+        """
+        count = int(count)
+        if count == 0:
+            return
+        mean = float(mean)
+        m2 = float(variance) * count
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self._m2 += m2 + delta**2 * self.count * count / total
+        self.count = total
+
+    def update(self, weights):
+        """ Merge a chunk of weights.
+
+        Args:
+            weights (np.ndarray): The weights of the chunk.
+
+        """
+        weights = np.asarray(weights, dtype=np.float64).ravel()
+        if weights.size == 0:
+            return
+        self.add(weights.size, np.mean(weights), np.var(weights))
+
+    def merge(self, other):
+        """ Merge the moments of another RunningMoments instance.
+
+        Args:
+            other (RunningMoments): The moments to be merged.
+
+        """
+        self.add(other.count, other.mean, other.variance)
+
+    @property
+    def variance(self):
+        """ float: Variance of the weights. """
+        if self.count == 0:
+            return 0.
+        return self._m2 / self.count
+
+    @property
+    def error(self):
+        """ float: Statistical uncertainty of the mean. """
+        if self.count < 2:
+            return np.inf
+        return np.sqrt(self.variance / (self.count - 1))
+
+    @property
+    def ess(self):
+        """ float: Effective sample size, (sum w)^2 / sum w^2. """
+        second_moment = self.variance + self.mean**2
+        if second_moment == 0:
+            return 0.
+        return self.count * self.mean**2 / second_moment
+
+
+def unweighting_efficiency(weights, nopt, nreplica=1000, seed=None):
+    """ Bootstrap estimate of the unweighting efficiency.
+
+    Draws 'nreplica' replicas of 'nopt' weights with replacement from the
+    pool of weights, and returns the mean weight over the median of the
+    replica maxima. The replicas are never materialized: the maximum of
+    'nopt' draws from the N sorted weights is the order statistic with
+    index ceil(N * U^(1/nopt)) - 1 for U uniform in (0, 1], and the mean
+    of the replica means is the mean of the pool.
+
+    Args:
+        weights (np.ndarray): Pool of weights.
+        nopt (int): Number of weights in each replica.
+        nreplica (int): Number of replicas.
+        seed (int): Seed of the random number generator.
+
+    Returns:
+        float: unweighting efficiency
+
+    """
+    weights = np.sort(np.asarray(weights, dtype=np.float64).ravel())
+    npool = weights.size
+    state = np.random.RandomState(seed)
+    uniform = 1. - state.random_sample(nreplica)
+    idx = np.ceil(npool * uniform**(1. / nopt)).astype(np.int64) - 1
+    s_max = weights[np.clip(idx, 0, npool - 1)]
+    return np.mean(weights) / np.median(s_max)
+
+
+class WeightedAverage():
+    r""" Running inverse-variance weighted average of independent estimates.
+
+    Combines estimates :math:`\mu_i \pm \sigma_i`, e.g. the integral of
+    each training epoch, into
+
+    .. math::
+
+        \bar{\mu} = \frac{\sum_i \mu_i/\sigma_i^2}{\sum_i 1/\sigma_i^2},
+        \qquad \bar{\sigma}^2 = \frac{1}{\sum_i 1/\sigma_i^2},
+
+    in constant time per estimate. The first 'burn_in' estimates, e.g. of
+    the first epochs of an untrained flow, are discarded. The chi2 per
+    degree of freedom of the estimates around the average checks whether
+    they are consistent with each other, it is updated with the weighted
+    variant of Welford's algorithm. Estimates with an error that is zero
+    or not finite, e.g. of a degenerate first epoch, have no usable weight
+    and are skipped, they are counted in 'skipped' instead of 'count'.
+
+    Args:
+        burn_in (int): Number of estimates to discard at the start.
+
+    """
+    def __init__(self, burn_in=0):
+        """ Initialize the average without any estimates. """
+        self.burn_in = burn_in
+        self.count = 0
+        self.skipped = 0
+        self.sum_weights = 0.
+        self.mean = np.nan
+        self._chi2 = 0.
+        self._means = []
+        self._errors = []
+
+    def __len__(self):
+        """ Number of usable estimates, without the skipped ones. """
+        return self.count
+
+    def add(self, mean, error):
+        """ Add an estimate to the average.
+
+        Args:
+            mean (float): The estimate.
+            error (float): The uncertainty of the estimate, the estimate is
+                           skipped unless it is positive and finite.
+
+        """
+        mean = float(mean)
+        error = float(error)
+        valid = 0 < error < np.inf
+        if valid:
+            self.count += 1
+        else:
+            self.skipped += 1
+        if valid and self.count > self.burn_in:
+            weight = 1. / error**2
+            if self.sum_weights == 0:
+                self.mean = mean
+            self.sum_weights += weight
+            delta = mean - self.mean
+            self.mean += delta * weight / self.sum_weights
+            self._chi2 += weight * delta * (mean - self.mean)
+        self._means.append(self.mean)
+        self._errors.append(self.error)
+
+    @property
+    def error(self):
+        """ float: Uncertainty of the average. """
+        if self.sum_weights == 0:
+            return np.inf
+        return np.sqrt(1. / self.sum_weights)
+
+    @property
+    def chi2_dof(self):
+        """ float: Chi2 per degree of freedom of the estimates. """
+        dof = self.count - self.burn_in - 1
+        if dof < 1:
+            return np.nan
+        return self._chi2 / dof
+
+    def history(self):
+        """ Average and uncertainty after each estimate.
+
+        There is one entry for every call of add, including the skipped
+        estimates, such that the history lines up with the epochs. It is
+        therefore longer than len(self) if estimates were skipped.
+
+        Returns:
+            tuple of 2 np.ndarrays of size (count + skipped,): the averages
+            and their uncertainties, nan and inf during the burn in.
+
+        """
+        return np.array(self._means), np.array(self._errors)
@@ -6,7 +6,8 @@
 # pylint: disable=invalid-name
 
 import tensorflow as tf
-from .spline import _knot_positions, _gather_squeeze, _search_sorted
+from .spline import _normalize_widths_and_heights, _gather_squeeze
+from .spline import _gather_bins, _search_sorted
 from .spline import _cube_root, _check_bounds, _shift_output
 
 DEFAULT_MIN_BIN_WIDTH = 1e-3
@@ -84,13 +85,9 @@ def cubic_spline(inputs,
     if min_bin_height * num_bins > 1.0:
         raise ValueError('Minimal bin height too large for the number of bins')
 
-    widths = tf.nn.softmax(unnormalized_widths, axis=-1)
-    widths = min_bin_width + (1 - min_bin_width * num_bins) * widths
-    cumwidths = _knot_positions(widths, 0)
-
-    heights = tf.nn.softmax(unnormalized_heights, axis=-1)
-    heights = min_bin_height + (1 - min_bin_height * num_bins) * heights
-    cumheights = _knot_positions(heights, 0)
+    cumwidths, widths, cumheights, heights = _normalize_widths_and_heights(
+        unnormalized_widths, unnormalized_heights,
+        min_bin_width, min_bin_height)
 
     slopes = heights / widths
     min_slope_1 = tf.minimum(tf.abs(slopes[..., :-1]),
@@ -124,13 +121,9 @@ def cubic_spline(inputs,
     else:
         bin_idx = _search_sorted(cumwidths, inputs)
 
-    inputs_a = _gather_squeeze(a, bin_idx)
-    inputs_b = _gather_squeeze(b, bin_idx)
-    inputs_c = _gather_squeeze(c, bin_idx)
-    inputs_d = _gather_squeeze(d, bin_idx)
-
-    input_left_cumwidths = _gather_squeeze(cumwidths, bin_idx)
-    input_right_cumwidths = _gather_squeeze(cumwidths, bin_idx+1)
+    (inputs_a, inputs_b, inputs_c, inputs_d,
+     input_left_cumwidths, input_right_cumwidths) = _gather_bins(
+         bin_idx, a, b, c, d, cumwidths, cumwidths[..., 1:])
 
     if inverse:
         # Modified coefficients for solving the cubic.
@@ -164,10 +157,10 @@ def cubic_spline(inputs,
 
             root_1 = cubic_root_1
             root_2 = (-0.5 * cubic_root_1
-                      - tf.cast(0.5 * tf.sqrt(3.), dtype=tf.float64)
+                      - tf.cast(0.5 * tf.sqrt(3.), dtype=cubic_root_2.dtype)
                       * cubic_root_2)
             root_3 = (-0.5 * cubic_root_1
-                      + tf.cast(0.5 * tf.sqrt(3.), dtype=tf.float64)
+                      + tf.cast(0.5 * tf.sqrt(3.), dtype=cubic_root_2.dtype)
                       * cubic_root_2)
 
             root_scale = 2 * tf.sqrt(-depressed_2)
@@ -178,22 +171,22 @@ def cubic_spline(inputs,
             root_3 = root_3 * root_scale + root_shift
 
             root1_mask = tf.cast((input_left_cumwidths - eps)
-                                 < root_1, dtype=tf.float64)
+                                 < root_1, dtype=root_1.dtype)
             root1_mask *= tf.cast(root_1 <
                                   (input_right_cumwidths + eps),
-                                  dtype=tf.float64)
+                                  dtype=root_1.dtype)
 
             root2_mask = tf.cast((input_left_cumwidths - eps)
-                                 < root_2, dtype=tf.float64)
+                                 < root_2, dtype=root_1.dtype)
             root2_mask *= tf.cast(root_2 <
                                   (input_right_cumwidths + eps),
-                                  dtype=tf.float64)
+                                  dtype=root_1.dtype)
 
             root3_mask = tf.cast((input_left_cumwidths - eps)
-                                 < root_3, dtype=tf.float64)
+                                 < root_3, dtype=root_1.dtype)
             root3_mask *= tf.cast(root_3 <
                                   (input_right_cumwidths + eps),
-                                  dtype=tf.float64)
+                                  dtype=root_1.dtype)
 
             roots = tf.stack([root_1, root_2, root_3], axis=-1)
             masks = tf.stack([root1_mask, root2_mask, root3_mask], axis=-1)
@@ -5,7 +5,7 @@
 # pylint: disable=too-many-arguments, too-many-locals
 
 import tensorflow as tf
-from .spline import _knot_positions, _gather_squeeze, _search_sorted
+from .spline import _knot_positions, _gather_bins, _search_sorted
 from .spline import _check_bounds, _shift_output
 
 
@@ -58,18 +58,17 @@ def linear_spline(inputs, unnormalized_pdf,
     if inverse:
         inv_bin_idx = _search_sorted(cdf, inputs)
         bin_boundaries = tf.cast(tf.linspace(
-            0., 1., num_bins+1), dtype=tf.float64)
+            0., 1., num_bins+1), dtype=inputs.dtype)
         slopes = ((cdf[..., 1:] - cdf[..., :-1])
                   / (bin_boundaries[..., 1:] - bin_boundaries[..., :-1]))
         offsets = cdf[..., 1:] - slopes * bin_boundaries[..., 1:]
 
-        input_slopes = _gather_squeeze(slopes, inv_bin_idx)
-        input_offsets = _gather_squeeze(offsets, inv_bin_idx)
+        input_slopes, input_offsets, input_pdfs = _gather_bins(
+            inv_bin_idx, slopes, offsets, pdf)
 
         outputs = (inputs - input_offsets) / input_slopes
 
-        input_pdfs = _gather_squeeze(pdf, inv_bin_idx)
-        bin_width = tf.cast(1.0 / num_bins, dtype=tf.float64)
+        bin_width = tf.cast(1.0 / num_bins, dtype=inputs.dtype)
         logabsdet = -tf.math.log(input_pdfs) + tf.math.log(bin_width)
     else:
         bin_pos = inputs * num_bins
@@ -77,12 +76,10 @@ def linear_spline(inputs, unnormalized_pdf,
         bin_idx = tf.cast(bin_idx_float, dtype=tf.int32)[..., tf.newaxis]
 
         alpha = bin_pos - bin_idx_float
-        input_pdfs = _gather_squeeze(pdf, bin_idx)
-
-        outputs = _gather_squeeze(cdf[..., :-1], bin_idx)
+        input_pdfs, outputs = _gather_bins(bin_idx, pdf, cdf)
         outputs += alpha * input_pdfs
 
-        bin_width = tf.cast(1.0 / num_bins, dtype=tf.float64)
+        bin_width = tf.cast(1.0 / num_bins, dtype=inputs.dtype)
         logabsdet = tf.math.log(input_pdfs) - tf.math.log(bin_width)
 
     return _shift_output(outputs, logabsdet, left, right, top, bottom, inverse)
@@ -6,7 +6,8 @@
 # pylint: disable=too-many-statements, invalid-name
 
 import tensorflow as tf
-from .spline import _padded, _knot_positions, _gather_squeeze, _search_sorted
+from .spline import _padded, _normalize_bins, _gather_bins, _search_sorted
+from .spline import _uniform_bin_index
 
 DEFAULT_MIN_BIN_WIDTH = 1e-3
 DEFAULT_MIN_BIN_HEIGHT = 1e-3
@@ -51,6 +52,8 @@ def quadratic_spline(inputs,
         Args:
             inputs (tf.Tensor): An array of inputs to be transformed by the spline.
             unnormalized_widths (tf.Tensor): A set of unnormalized widths for the bins.
+                If None, the bins have a fixed, equal width and the forward bin
+                lookup is done by arithmetic instead of a search.
             unnormalized_heights (tf.Tensor): A set of unnormalized heights for the bins.
             inverse (bool): Whether to calculate the forward or inverse pass
             left (float64): Left edge of the valid spline region
@@ -64,10 +67,10 @@ def quadratic_spline(inputs,
             tuple: The transformation and the associated log jacobian
     """
 
-    left = tf.cast(left, dtype=tf.float64)
-    right = tf.cast(right, dtype=tf.float64)
-    bottom = tf.cast(bottom, dtype=tf.float64)
-    top = tf.cast(top, dtype=tf.float64)
+    left = tf.cast(left, dtype=inputs.dtype)
+    right = tf.cast(right, dtype=inputs.dtype)
+    bottom = tf.cast(bottom, dtype=inputs.dtype)
+    top = tf.cast(top, dtype=inputs.dtype)
 
     if not inverse:
         out_of_bounds = (inputs < left) | (inputs > right)
@@ -81,15 +84,22 @@ def quadratic_spline(inputs,
     else:
         inputs = (inputs - left) / (right - left)
 
-    num_bins = unnormalized_widths.shape[-1]
+    uniform_widths = unnormalized_widths is None
+    if uniform_widths:
+        num_bins = unnormalized_heights.shape[-1] - 1
+    else:
+        num_bins = unnormalized_widths.shape[-1]
 
     if min_bin_width * num_bins > 1.0:
         raise ValueError('Minimal bin width too large for the number of bins')
     if min_bin_height * num_bins > 1.0:
         raise ValueError('Minimal bin height too large for the number of bins')
 
-    widths = tf.nn.softmax(unnormalized_widths, axis=-1)
-    widths = min_bin_width + (1 - min_bin_width * num_bins) * widths
+    if uniform_widths:
+        widths = tf.constant(1. / num_bins, dtype=unnormalized_heights.dtype)
+    else:
+        bin_locations, widths = _normalize_bins(unnormalized_widths,
+                                                min_bin_width)
 
     unnormalized_heights_exp = tf.math.exp(unnormalized_heights)
 
@@ -121,19 +131,24 @@ def quadratic_spline(inputs,
         ((heights[..., :-1] + heights[..., 1:]) / 2.) * widths, axis=-1)
     bin_left_cdf = _padded(bin_left_cdf, lhs=0.)
 
-    bin_locations = _knot_positions(widths, 0.)
-
     if inverse:
         bin_idx = _search_sorted(bin_left_cdf, inputs)
+    elif uniform_widths:
+        bin_idx = _uniform_bin_index(inputs, num_bins)
     else:
         bin_idx = _search_sorted(bin_locations, inputs)
 
-    input_bin_locations = _gather_squeeze(bin_locations, bin_idx)
-    input_bin_widths = _gather_squeeze(widths, bin_idx)
-
-    input_left_cdf = _gather_squeeze(bin_left_cdf, bin_idx)
-    input_left_heights = _gather_squeeze(heights, bin_idx)
-    input_right_heights = _gather_squeeze(heights, bin_idx+1)
+    if uniform_widths:
+        input_left_cdf, input_left_heights, input_right_heights = \
+            _gather_bins(bin_idx, bin_left_cdf, heights, heights[..., 1:])
+        input_bin_widths = widths
+        input_bin_locations = widths * tf.cast(bin_idx[..., 0],
+                                               dtype=widths.dtype)
+    else:
+        (input_left_cdf, input_left_heights, input_right_heights,
+         input_bin_locations, input_bin_widths) = _gather_bins(
+             bin_idx, bin_left_cdf, heights, heights[..., 1:],
+             bin_locations, widths)
 
     a = 0.5 * (input_right_heights - input_left_heights) * input_bin_widths
     b = input_left_heights * input_bin_widths
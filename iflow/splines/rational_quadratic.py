@@ -5,7 +5,8 @@
 # pylint: disable=too-many-arguments, too-many-locals, invalid-name
 
 import tensorflow as tf
-from .spline import _knot_positions, _gather_squeeze, _search_sorted
+from .spline import _normalize_widths_and_heights, _normalize_bins
+from .spline import _gather_bins, _search_sorted, _uniform_bin_index
 
 DEFAULT_MIN_BIN_WIDTH = 1e-15
 DEFAULT_MIN_BIN_HEIGHT = 1e-15
@@ -56,6 +57,8 @@ def rational_quadratic_spline(inputs,
         Args:
             inputs (tf.Tensor): An array of inputs to be transformed by the spline.
             unnormalized_widths (tf.Tensor): A set of unnormalized widths for the knots.
+                If None, the bins have a fixed, equal width and the forward bin
+                lookup is done by arithmetic instead of a search.
             unnormalized_heights (tf.Tensor): A set of unnormalized heights for the knots.
             unnormalized_derivatives (tf.Tensor): A set of unnormalized derivatives for the knots.
             inverse (bool): Whether to calculate the forward or inverse pass
@@ -74,47 +77,53 @@ def rational_quadratic_spline(inputs,
     out_of_bounds = (inputs < left) | (inputs > right)
     tf.where(out_of_bounds, tf.cast(left, dtype=inputs.dtype), inputs)
 
-    num_bins = unnormalized_widths.shape[-1]
+    uniform_widths = unnormalized_widths is None
+    num_bins = unnormalized_heights.shape[-1]
     # check that number of widths, heights, and derivatives match
-    assert num_bins == unnormalized_heights.shape[-1] \
-            == unnormalized_derivatives.shape[-1]-1
+    assert num_bins == unnormalized_derivatives.shape[-1]-1
+    assert uniform_widths or num_bins == unnormalized_widths.shape[-1]
 
     if min_bin_width * num_bins > 1.0:
         raise ValueError('Minimal bin width too large for the number of bins')
     if min_bin_height * num_bins > 1.0:
         raise ValueError('Minimal bin height too large for the number of bins')
 
-    widths = tf.nn.softmax(unnormalized_widths, axis=-1)
-    widths = min_bin_width + (1 - min_bin_width * num_bins) * widths
-    cumwidths = _knot_positions(widths, 0)
-    cumwidths = (right - left) * cumwidths + left
-    widths = cumwidths[..., 1:] - cumwidths[..., :-1]
+    if uniform_widths:
+        cumheights, heights = _normalize_bins(
+            unnormalized_heights, min_bin_height, bottom, top)
+        widths = (right - left) / num_bins
+    else:
+        cumwidths, widths, cumheights, heights = _normalize_widths_and_heights(
+            unnormalized_widths, unnormalized_heights,
+            min_bin_width, min_bin_height, left, right, bottom, top)
 
     derivatives = ((min_derivative + tf.nn.softplus(unnormalized_derivatives))
-                   / (tf.cast(min_derivative + tf.math.log(2.), tf.float64)))
-
-    heights = tf.nn.softmax(unnormalized_heights, axis=-1)
-    heights = min_bin_height + (1 - min_bin_height * num_bins) * heights
-    cumheights = _knot_positions(heights, 0)
-    cumheights = (top - bottom) * cumheights + bottom
-    heights = cumheights[..., 1:] - cumheights[..., :-1]
+                   / (tf.cast(min_derivative + tf.math.log(2.),
+                              unnormalized_derivatives.dtype)))
 
     if inverse:
         bin_idx = _search_sorted(cumheights, inputs)
+    elif uniform_widths:
+        bin_idx = _uniform_bin_index(inputs, num_bins, left, right)
     else:
         bin_idx = _search_sorted(cumwidths, inputs)
 
-    input_cumwidths = _gather_squeeze(cumwidths, bin_idx)
-    input_bin_widths = _gather_squeeze(widths, bin_idx)
-
-    input_cumheights = _gather_squeeze(cumheights, bin_idx)
     delta = heights / widths
-    input_delta = _gather_squeeze(delta, bin_idx)
 
-    input_derivatives = _gather_squeeze(derivatives, bin_idx)
-    input_derivatives_p1 = _gather_squeeze(derivatives[..., 1:], bin_idx)
-
-    input_heights = _gather_squeeze(heights, bin_idx)
+    if uniform_widths:
+        (input_cumheights, input_delta, input_derivatives,
+         input_derivatives_p1, input_heights) = _gather_bins(
+             bin_idx, cumheights, delta, derivatives, derivatives[..., 1:],
+             heights)
+        input_cumwidths = left + widths * tf.cast(bin_idx[..., 0],
+                                                  dtype=heights.dtype)
+        input_bin_widths = widths
+    else:
+        (input_cumheights, input_delta, input_derivatives,
+         input_derivatives_p1, input_heights,
+         input_cumwidths, input_bin_widths) = _gather_bins(
+             bin_idx, cumheights, delta, derivatives, derivatives[..., 1:],
+             heights, cumwidths, widths)
 
     if inverse:
         a = ((inputs - input_cumheights) * (input_derivatives
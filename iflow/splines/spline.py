@@ -13,10 +13,10 @@ import tensorflow as tf
 
 
 def _check_bounds(inputs, left, right, top, bottom, inverse):
-    left = tf.cast(left, dtype=tf.float64)
-    right = tf.cast(right, dtype=tf.float64)
-    bottom = tf.cast(bottom, dtype=tf.float64)
-    top = tf.cast(top, dtype=tf.float64)
+    left = tf.cast(left, dtype=inputs.dtype)
+    right = tf.cast(right, dtype=inputs.dtype)
+    bottom = tf.cast(bottom, dtype=inputs.dtype)
+    top = tf.cast(top, dtype=inputs.dtype)
 
     if not inverse:
         out_of_bounds = (inputs < left) | (inputs > right)
@@ -34,10 +34,10 @@ def _check_bounds(inputs, left, right, top, bottom, inverse):
 
 
 def _shift_output(outputs, logabsdet, left, right, top, bottom, inverse):
-    left = tf.cast(left, dtype=tf.float64)
-    right = tf.cast(right, dtype=tf.float64)
-    bottom = tf.cast(bottom, dtype=tf.float64)
-    top = tf.cast(top, dtype=tf.float64)
+    left = tf.cast(left, dtype=outputs.dtype)
+    right = tf.cast(right, dtype=outputs.dtype)
+    bottom = tf.cast(bottom, dtype=outputs.dtype)
+    top = tf.cast(top, dtype=outputs.dtype)
 
     outputs = tf.clip_by_value(outputs, 0, 1)
 
@@ -55,13 +55,22 @@ def _shift_output(outputs, logabsdet, left, right, top, bottom, inverse):
 
 def _padded(t, lhs, rhs=None):
     """Left pads and optionally right pads the innermost axis of `t`."""
+    rank = tf.TensorShape(t.shape).rank
     lhs = tf.convert_to_tensor(lhs, dtype=t.dtype)
-    zeros = tf.zeros([tf.rank(t) - 1, 2], dtype=tf.int32)
-    lhs_paddings = tf.concat([zeros, [[1, 0]]], axis=0)
-    result = tf.pad(t, paddings=lhs_paddings, constant_values=lhs)
     if rhs is not None:
-        rhs = tf.convert_to_tensor(lhs, dtype=t.dtype)
+        rhs = tf.convert_to_tensor(rhs, dtype=t.dtype)
+
+    if rank is None:
+        zeros = tf.zeros([tf.rank(t) - 1, 2], dtype=tf.int32)
+        lhs_paddings = tf.concat([zeros, [[1, 0]]], axis=0)
         rhs_paddings = tf.concat([zeros, [[0, 1]]], axis=0)
+    else:
+        # Static rank: build the paddings without any runtime ops.
+        lhs_paddings = [[0, 0]] * (rank - 1) + [[1, 0]]
+        rhs_paddings = [[0, 0]] * (rank - 1) + [[0, 1]]
+
+    result = tf.pad(t, paddings=lhs_paddings, constant_values=lhs)
+    if rhs is not None:
         result = tf.pad(result, paddings=rhs_paddings, constant_values=rhs)
     return result
 
@@ -70,6 +79,76 @@ def _knot_positions(bin_sizes, range_min):
     return _padded(tf.cumsum(bin_sizes, axis=-1) + range_min, lhs=range_min)
 
 
+def _normalize_bins(unnormalized_sizes, min_bin_size, lower=0., upper=1.):
+    """ Normalize bin sizes and calculate the knot positions.
+
+    The unnormalized sizes are normalized with a softmax, restricted to the
+    minimal bin size, and mapped onto the range [lower, upper]. The bin
+    sizes are recalculated from the knot positions, such that they add up
+    exactly to the range.
+
+    The arguments min_bin_size, lower and upper can be given per row of
+    the second to last axis, in order to normalize several sets of bins,
+    e.g. widths and heights, with a single set of operations.
+
+    Args:
+        unnormalized_sizes (tf.Tensor): A set of unnormalized bin sizes.
+        min_bin_size (float64): The minimum allowed size of a given bin
+        lower (float64): Lower edge of the range
+        upper (float64): Upper edge of the range
+
+    Returns:
+        tuple: The knot positions and the bin sizes
+
+    """
+    num_bins = unnormalized_sizes.shape[-1]
+    dtype = unnormalized_sizes.dtype
+    min_bin_size = tf.convert_to_tensor(min_bin_size, dtype=dtype)
+    lower = tf.convert_to_tensor(lower, dtype=dtype)
+    upper = tf.convert_to_tensor(upper, dtype=dtype)
+
+    sizes = tf.nn.softmax(unnormalized_sizes, axis=-1)
+    sizes = min_bin_size + (1 - min_bin_size * num_bins) * sizes
+    knots = _knot_positions(sizes, 0)
+    knots = (upper - lower) * knots + lower
+    sizes = knots[..., 1:] - knots[..., :-1]
+
+    return knots, sizes
+
+
+def _normalize_widths_and_heights(unnormalized_widths, unnormalized_heights,
+                                  min_bin_width, min_bin_height,
+                                  left=0., right=1., bottom=0., top=1.):
+    """ Normalize the bin widths and heights of a spline in one go.
+
+    The widths and heights are stacked, such that the softmax, the knot
+    positions and the bin sizes are calculated once for both of them.
+
+    Args:
+        unnormalized_widths (tf.Tensor): A set of unnormalized widths for
+                                         the bins.
+        unnormalized_heights (tf.Tensor): A set of unnormalized heights for
+                                          the bins.
+        min_bin_width (float64): The minimum allowed width of a given bin
+        min_bin_height (float64): The minimum allowed height of a given bin
+        left (float64): Left edge of the valid spline region
+        right (float64): Right edge of the valid spline region
+        bottom (float64): Bottom edge of the valid spline region
+        top (float64): Top edge of the valid spline region
+
+    Returns:
+        tuple: cumwidths, widths, cumheights and heights of the bins
+
+    """
+    knots, sizes = _normalize_bins(
+        tf.stack([unnormalized_widths, unnormalized_heights], axis=-2),
+        [[min_bin_width], [min_bin_height]],
+        [[left], [bottom]], [[right], [top]])
+
+    return (knots[..., 0, :], sizes[..., 0, :],
+            knots[..., 1, :], sizes[..., 1, :])
+
+
 def _gather_squeeze(params, indices):
     rank = len(indices.shape)
     if rank is None:
@@ -77,6 +156,29 @@ def _gather_squeeze(params, indices):
     return tf.gather(params, indices, axis=-1, batch_dims=rank - 1)[..., 0]
 
 
+def _gather_bins(bin_idx, *params):
+    """ Gather the coefficients of the selected bins with a single gather.
+
+    The per-bin coefficients are packed along a new last axis, such that all
+    of them are fetched in one batched gather (and one scatter in the
+    backward pass) instead of one gather per coefficient. Coefficients with
+    more entries than bins, e.g. knot positions, are truncated to the number
+    of bins, pass a shifted slice to access the right edge of a bin.
+
+    Args:
+        bin_idx (tf.Tensor): Bin indices of shape (..., 1).
+        params (tf.Tensor): Per-bin coefficients of shape (..., num_bins[+1]).
+
+    Returns:
+        tuple: The coefficients of the selected bins, each of shape (...).
+    """
+    rank = len(bin_idx.shape)
+    num_bins = min(param.shape[-1] for param in params)
+    packed = tf.stack([param[..., :num_bins] for param in params], axis=-1)
+    gathered = tf.gather(packed, bin_idx, axis=-2, batch_dims=rank - 1)
+    return tuple(tf.unstack(gathered[..., 0, :], axis=-1))
+
+
 def _search_sorted(cdf, inputs):
     return tf.maximum(tf.zeros([], dtype=tf.int32),
                       tf.searchsorted(
@@ -86,5 +188,16 @@ def _search_sorted(cdf, inputs):
                           out_type=tf.int32) - 1)
 
 
+def _uniform_bin_index(inputs, num_bins, left=0., right=1.):
+    """ Bin index of the inputs for bins of equal width.
+
+    Equivalent to ``_search_sorted`` on uniformly spaced knots, but the
+    index is obtained directly with floor(x * num_bins) instead of a search.
+    """
+    bin_pos = (inputs - left) / (right - left) * num_bins
+    bin_idx = tf.cast(tf.floor(bin_pos), dtype=tf.int32)
+    return tf.clip_by_value(bin_idx, 0, num_bins - 1)[..., tf.newaxis]
+
+
 def _cube_root(x):
     return tf.sign(x) * tf.exp(tf.math.log(tf.abs(x))/3.0)
@@ -9,17 +9,15 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import tensorflow as tf
-import tensorflow_probability as tfp
 from scipy.special import erf
 import vegas, gvar
 
 from absl import app, flags
 
 from iflow.integration import integrator
-from iflow.integration import couplings
+from iflow.integration import flows
+from iflow.integration import statistics
 
-tfd = tfp.distributions  # pylint: disable=invalid-name
-tfb = tfp.bijectors  # pylint: disable=invalid-name
 tf.keras.backend.set_floatx('float64')
 
 FLAGS = flags.FLAGS
@@ -41,6 +39,7 @@ flags.DEFINE_float('precision', 1e-5, 'Target precision in integrator comparison
                    short_name='tp')
 flags.DEFINE_bool('targetmode', False, 'Flag to trigger training until target precision is reached',
                   short_name='t')
+flags.DEFINE_bool('float32', False, 'Run the flow in float32, accumulating the integral in float64')
 
 class TestFunctions:
     """ Contains the functions discussed in the reference above.
@@ -323,61 +322,6 @@ class TestFunctions:
                     + 1.0/denominator4**2)
 
 
-def build(in_features, out_features, options):
-    """ Builds a dense NN.
-
-    The output layer is initialized to 0, so the first pass
-    before training gives the identity transformation.
-
-    Arguments:
-        in_features (int): dimensionality of the inputs space
-        out_features (int): dimensionality of the output space
-        options: additional arguments, not used at the moment
-
-    Returns:
-        A tf.keras.models.Model instance
-
-    """
-    del options
-
-    invals = tf.keras.layers.Input(in_features, dtype=tf.float64)
-    hidden = tf.keras.layers.Dense(32, activation='relu')(invals)
-    hidden = tf.keras.layers.Dense(32, activation='relu')(hidden)
-    hidden = tf.keras.layers.Dense(32, activation='relu')(hidden)
-    hidden = tf.keras.layers.Dense(32, activation='relu')(hidden)
-    outputs = tf.keras.layers.Dense(out_features, bias_initializer='zeros',
-                                    kernel_initializer='zeros')(hidden)
-    model = tf.keras.models.Model(invals, outputs)
-    model.summary()
-    return model
-
-
-def mask_flip(mask):
-    """ Interchange 0 <-> 1 in the mask. """
-    return 1-mask
-
-
-def binary_list(inval, length):
-    """ Convert x into a binary list of length l. """
-    return np.array([int(i) for i in np.binary_repr(inval, length)])
-
-
-def binary_masks(ndims):
-    """ Create binary masks for to account for symmetries. """
-    n_masks = int(np.ceil(np.log2(ndims)))
-    sub_masks = np.transpose(np.array(
-        [binary_list(i, n_masks)
-         for i in range(ndims)]))[::-1]
-    flip_masks = mask_flip(sub_masks)
-
-    # Combine masks
-    masks = np.empty((2*n_masks, ndims))
-    masks[0::2] = flip_masks
-    masks[1::2] = sub_masks
-
-    return masks
-
-
 def build_iflow(func, ndims):
     """ Build the iflow integrator
 
@@ -388,26 +332,15 @@ def build_iflow(func, ndims):
     Returns: Integrator: iflow Integrator object
 
     """
-    masks = binary_masks(ndims)
-    bijector = []
-    for mask in masks:
-        bijector.append(couplings.PiecewiseRationalQuadratic(mask, build,
-                                                             num_bins=16,
-                                                             blob=None,
-                                                             options=None))
-    bijector = tfb.Chain(list(reversed(bijector)))
-    low = np.zeros(ndims, dtype=np.float64)
-    high = np.ones(ndims, dtype=np.float64)
-    dist = tfd.Uniform(low=low, high=high)
-    dist = tfd.Independent(distribution=dist,
-                           reinterpreted_batch_ndims=1)
-    dist = tfd.TransformedDistribution(
-        distribution=dist,
-        bijector=bijector)
+    dtype = tf.float32 if FLAGS.float32 else tf.float64
+    dist = flows.build_flow(ndims, coupling='rational_quadratic',
+                            masks='binary', num_bins=16, width=32, depth=4,
+                            dtype=dtype)
 
     optimizer = tf.keras.optimizers.Adam(1e-3, clipnorm=10.0)
     integrate = integrator.Integrator(func, dist, optimizer,
-                                      loss_func='exponential')
+                                      loss_func='exponential',
+                                      accumulation_dtype=tf.float64)
 
     return integrate
 
@@ -426,12 +359,14 @@ def train_iflow(integrate, ptspepoch, epochs):
     """
     means = np.zeros(epochs)
     stddevs = np.zeros(epochs)
+    average = statistics.WeightedAverage()
     for epoch in range(epochs):
         loss, integral, error = integrate.train_one_step(ptspepoch,
                                                          integral=True)
         means[epoch] = integral
         stddevs[epoch] = error
-        _, current_precision = variance_weighted_result(means[:epoch+1], stddevs[:epoch+1])
+        average.add(integral, error)
+        current_precision = average.error
         if epoch % 10 == 0:
             print('Epoch: {:3d} Loss = {:8e} Integral = '
                   '{:8e} +/- {:8e} Total uncertainty = {:8e}'.format(epoch, loss,
@@ -441,34 +376,30 @@ def train_iflow(integrate, ptspepoch, epochs):
     return means, stddevs
 
 def train_iflow_target(integrate, ptspepoch, target):
-    """ Run the iflow integrator
+    """ Run the iflow integrator until a target relative precision
+
+    The number of points per epoch is adapted by a BatchSizeScheduler,
+    starting from ptspepoch.
 
     Args:
         integrate (Integrator): iflow Integrator class object
-        ptspepoch (int): number of points per epoch in training
-        target (float): target precision of final integral
+        ptspepoch (int): initial number of points per epoch in training
+        target (float): target relative precision of final integral
 
     Returns:
-        numpy.ndarray(float): integral estimations and its uncertainty of each epoch
+        numpy.ndarray(float): integral estimations, their uncertainty and the
+        number of points of each epoch
 
     """
-    means = []
-    stddevs = []
-    current_precision = 1e99
-    epoch = 0
-    while current_precision > target:
-        loss, integral, error = integrate.train_one_step(ptspepoch,
-                                                         integral=True)
-        means.append(integral)
-        stddevs.append(error)
-        _, current_precision = variance_weighted_result(np.array(means), np.array(stddevs))
-        if epoch % 10 == 0:
-            print('Epoch: {:3d} Loss = {:8e} Integral = '
-                  '{:8e} +/- {:8e} Total uncertainty = {:8e}'.format(epoch, loss,
-                                                                     integral, error,
-                                                                     current_precision))
-        epoch += 1
-    return np.array(means), np.array(stddevs)
+    scheduler = integrator.BatchSizeScheduler(
+        min_samples=max(ptspepoch // 4, 1), max_samples=16*ptspepoch,
+        initial_samples=ptspepoch)
+    means, stddevs, sizes = integrate.train_to_target(target, scheduler)
+    average = weighted_average(means, stddevs)
+    print('Epochs: {:3d} Integral = {:8e} +/- {:8e} Points per epoch = '
+          '{:d} to {:d}'.format(len(means), average.mean, average.error,
+                                sizes.min(), sizes.max()))
+    return means, stddevs, sizes
 
 def sample_iflow(integrate, ptspepoch, epochs):
     """ Sample from the iflow integrator
@@ -502,6 +433,22 @@ def rel_unc(mean_a, unc_a, mean_b, unc_b):
     ret = ret/sqr
     return ret
 
+def weighted_average(means, stddevs):
+    """ Accumulate estimates into a variance weighted average
+
+    Args:
+        means (numpy.ndarray(float)): estimates of each epoch
+        stddevs (numpy.ndarray(float)): uncertainties of each epoch
+
+    Returns:
+        statistics.WeightedAverage: the running average of all epochs
+
+    """
+    average = statistics.WeightedAverage()
+    for mean, stddev in zip(means, stddevs):
+        average.add(mean, stddev)
+    return average
+
 def variance_weighted_result(means, stddevs):
     """ Computes weighted mean and stddev of given means and
         stddevs arrays, using Inverse-variance weighting
@@ -672,10 +619,12 @@ def main(argv):
         vegas_results = []
         vegas_means = []
         vegas_stddevs = []
+        vegas_average = statistics.WeightedAverage()
         for i in range(epochs):
             current_result = vegas_integ(integrand_np, nitn=1, neval=ptspepoch)
             vegas_means.append(current_result.mean)
             vegas_stddevs.append(current_result.sdev)
+            vegas_average.add(current_result.mean, current_result.sdev)
             vegas_results.append(current_result)
 
             if FLAGS.function in ['Box', 'Ring', 'Triangle']:
@@ -685,8 +634,7 @@ def main(argv):
                 vegas_calls.append(func.calls - current_vegas_calls)
                 current_vegas_calls = func.calls
 
-            _, current_precision = variance_weighted_result(np.array(vegas_means),
-                                                            np.array(vegas_stddevs))
+            current_precision = vegas_average.error
             if i % 10 == 0:
                 print('Epoch: {:3d} Integral = '
                       '{:8e} +/- {:8e} Total uncertainty = {:8e}'.format(i, current_result.mean,
@@ -737,18 +685,11 @@ def main(argv):
         plt.ylabel('Total relative integral uncertainty')
 
         # Plot iflow
-        total_uncertainty = np.zeros(epochs)
-        for i in range(epochs):
-            #print(variance_weighted_result(mean_t[:i+1], err_t[:i+1]))
-            _, total_uncertainty[i] = variance_weighted_result(mean_t[:i+1], err_t[:i+1])
+        _, total_uncertainty = weighted_average(mean_t, err_t).history()
         plt.plot(x_values, total_uncertainty/target, color='r', label='i-flow')
 
         # plot VEGAS
-        len_vegas = len(vegas_calls)
-        vegas_total_uncertainty = np.zeros(len_vegas)
-        for i in range(len_vegas):
-            _, vegas_total_uncertainty[i] = variance_weighted_result(vegas_means[:i+1],
-                                                                     vegas_stddevs[:i+1])
+        _, vegas_total_uncertainty = vegas_average.history()
         plt.plot(np.cumsum(vegas_calls), vegas_total_uncertainty/target, color='b', label='VEGAS')
         if plot_FOAM:
             plt.plot(foam_calls, foam_stddevs/target, color='green', label='FOAM')
@@ -768,9 +709,10 @@ def main(argv):
         print("In target mode with absolute precision {}, based on relative precision {}".format(
             target_precision, FLAGS.precision))
         integrate = build_iflow(integrand, ndims)
-        mean_t, err_t = train_iflow_target(integrate, ptspepoch, target_precision)
+        mean_t, err_t, sizes_t = train_iflow_target(integrate, ptspepoch,
+                                                    FLAGS.precision)
         num_epochs = len(mean_t)
-        x_values = np.arange(ptspepoch, (num_epochs+1) * ptspepoch, ptspepoch)
+        x_values = np.cumsum(sizes_t)
         iflow_mean_wgt, iflow_err_wgt = variance_weighted_result(mean_t, err_t)
 
         print("Results for {:d} dimensions:".format(ndims))
@@ -779,7 +721,7 @@ def main(argv):
         print("Relative Uncertainty iflow result is {:.3f}".format(
             rel_unc(iflow_mean_wgt, iflow_err_wgt, target, 0.)))
         print("i-flow needed {:d} epochs and {:d} function calls".format(num_epochs,
-                                                                         num_epochs*ptspepoch))
+                                                                         x_values[-1]))
 
         # vegas
         vegas_integ = vegas.Integrator(ndims* [[0, 1]])
@@ -796,10 +738,12 @@ def main(argv):
 
         epoch = 0
         current_vegas_precision = 1e99
+        vegas_average = statistics.WeightedAverage()
         while current_vegas_precision > target_precision:
             current_result = vegas_integ(integrand_np, nitn=1, neval=ptspepoch)
             vegas_means.append(current_result.mean)
             vegas_stddevs.append(current_result.sdev)
+            vegas_average.add(current_result.mean, current_result.sdev)
             vegas_results.append(current_result)
             if FLAGS.function in ['Box', 'Ring', 'Triangle']:
                 vegas_calls.append(integrand_np.calls - current_vegas_calls)
@@ -808,8 +752,7 @@ def main(argv):
                 vegas_calls.append(func.calls - current_vegas_calls)
                 current_vegas_calls = func.calls
 
-            _, current_vegas_precision = variance_weighted_result(np.array(vegas_means),
-                                                                  np.array(vegas_stddevs))
+            current_vegas_precision = vegas_average.error
             if epoch % 10 == 0:
                 print('Epoch: {:3d} Integral = '
                       '{:8e} +/- {:8e} Total uncertainty = {:8e}'.format(epoch, current_result.mean,
@@ -833,7 +776,7 @@ def main(argv):
         # plot relative integral uncertainty per epoch
         plt.figure(dpi=150, figsize=[5., 4.])
         #plt.xlim(ptspepoch, np.maximum(epochs * ptspepoch, np.sum(vegas_calls)))
-        plt.xlim(ptspepoch, num_epochs * ptspepoch)
+        plt.xlim(x_values[0], x_values[-1])
         plt.xlabel('Evaluations in training')
         plt.ylim(1e-5, 1e1)
         plt.ylabel('Integral uncertainty (%)')
@@ -859,24 +802,17 @@ def main(argv):
         plt.yscale('log')
         plt.xscale('log')
         #plt.xlim(ptspepoch, np.maximum(epochs * ptspepoch, np.sum(vegas_calls)))
-        plt.xlim(ptspepoch, num_epochs * ptspepoch)
+        plt.xlim(x_values[0], x_values[-1])
         plt.xlabel('Evaluations in training')
         plt.ylim(target_precision/(2.*target), 1e0)
         plt.ylabel('Total relative integral uncertainty')
 
         # Plot iflow
-        total_uncertainty = np.zeros(num_epochs)
-        for i in range(num_epochs):
-            #print(variance_weighted_result(mean_t[:i+1], err_t[:i+1]))
-            _, total_uncertainty[i] = variance_weighted_result(mean_t[:i+1], err_t[:i+1])
+        _, total_uncertainty = weighted_average(mean_t, err_t).history()
         plt.plot(x_values, total_uncertainty/target, color='r', label='i-flow')
 
         # plot VEGAS
-        len_vegas = len(vegas_calls)
-        vegas_total_uncertainty = np.zeros(len_vegas)
-        for i in range(len_vegas):
-            _, vegas_total_uncertainty[i] = variance_weighted_result(vegas_means[:i+1],
-                                                                     vegas_stddevs[:i+1])
+        _, vegas_total_uncertainty = vegas_average.history()
         plt.plot(np.cumsum(vegas_calls), vegas_total_uncertainty/target, color='b', label='VEGAS')
         if plot_FOAM:
             plt.plot(foam_calls, foam_stddevs/target, color='green', label='FOAM')
@@ -0,0 +1,42 @@
+""" Test the integrand cache. """
+
+import numpy as np
+
+from iflow.integration.cache import IntegrandCache
+
+
+def test_cache():
+    """ Test storing and looking up function values. """
+    cache = IntegrandCache(100)
+    samples = np.random.random((10, 3))
+    values = np.sum(samples, axis=-1)
+
+    assert cache.get(samples) is None
+    cache.put(samples, values)
+    assert np.all(cache.get(samples) == values)
+    assert np.all(cache.get(samples.copy()) == values)
+    assert cache.get(samples[:5]) is None
+    assert cache.get(samples.astype(np.float32)) is None
+
+    cache.put(samples, 2*values)
+    assert len(cache) == 1
+    assert cache.size == 10
+    assert np.all(cache.get(samples) == 2*values)
+
+
+def test_cache_eviction():
+    """ Test that the least recently used batches are evicted. """
+    cache = IntegrandCache(25)
+    batches = [np.random.random((10, 3)) for _ in range(3)]
+    cache.put(batches[0], np.zeros(10))
+    cache.put(batches[1], np.ones(10))
+    cache.get(batches[0])
+    cache.put(batches[2], np.ones(10))
+
+    assert cache.size == 20
+    assert cache.get(batches[1]) is None
+    assert cache.get(batches[0]) is not None
+    assert cache.get(batches[2]) is not None
+
+    cache.put(np.random.random((30, 3)), np.zeros(30))
+    assert cache.size == 20
@@ -3,14 +3,18 @@
 # pylint: disable=protected-access
 
 import itertools
+from unittest import mock
 import pytest
 
 import numpy as np
 import tensorflow as tf
+import tensorflow_probability as tfp
 
 from iflow.integration import couplings
 
 
+tfb = tfp.bijectors  # pylint: disable=invalid-name
+
 tf.keras.backend.set_floatx('float64')
 
 
@@ -34,6 +38,70 @@ def test_coupling_init():
         couplings.CouplingBijector([1, 1, 0, 0], build_dense, blob='a')
 
 
+def test_coupling_forward_and_log_det():
+    """ Test the fused passes evaluate the coupling layer once. """
+    inputs = np.array(np.random.random((100, 4)), dtype=np.float64)
+    inputs = tf.convert_to_tensor(inputs)
+    layer = couplings.PiecewiseRationalQuadratic([1, 1, 0, 0], build_dense)
+    fldj = layer.forward_log_det_jacobian(inputs, event_ndims=1)
+
+    with mock.patch.object(layer, '_transform',
+                           wraps=layer._transform) as transform:
+        outputs, logdet = layer.forward_and_log_det(inputs)
+        assert transform.call_count == 1
+        recovered, ildj = layer.inverse_and_log_det(outputs)
+        assert transform.call_count == 2
+
+    assert np.allclose(outputs, layer.forward(inputs))
+    assert np.allclose(logdet, fldj)
+    assert np.allclose(recovered, inputs)
+    assert np.allclose(ildj, -fldj)
+
+
+def test_chain_forward_and_log_det():
+    """ Test the fused passes through a chain against the bijector API. """
+    inputs = np.array(np.random.random((100, 4)), dtype=np.float64)
+    inputs = tf.convert_to_tensor(inputs)
+    chain = tfb.Chain([
+        couplings.PiecewiseRationalQuadratic([1, 1, 0, 0], build_dense),
+        tfb.Scale(np.float64(0.5)),
+        couplings.AffineBijector([0, 1, 0, 1], build_dense)])
+
+    outputs, logdet = couplings.forward_and_log_det(chain, inputs)
+    assert np.allclose(outputs, chain.forward(inputs))
+    assert np.allclose(logdet, chain.forward_log_det_jacobian(
+        inputs, event_ndims=1))
+
+    recovered, ildj = couplings.inverse_and_log_det(chain, outputs)
+    assert np.allclose(recovered, inputs)
+    assert np.allclose(ildj, -logdet)
+
+
+def test_coupling_permutation():
+    """ Test the precomputed permutation of the coupling split. """
+    inputs = np.array(np.random.random((100, 4)), dtype=np.float64)
+    for mask, ordered in [([0, 0, 1, 1], True), ([1, 0, 1, 0], False)]:
+        layer = couplings.AffineBijector(mask, build_dense)
+        assert layer._ordered == ordered
+
+        outputs = layer.forward(inputs).numpy()
+        assert np.all(outputs[:, np.array(mask) == 0]
+                      == inputs[:, np.array(mask) == 0])
+        assert np.allclose(inputs, layer.inverse(outputs))
+
+
+def test_one_blob():
+    """ Test the one-blob encoding. """
+    inputs = np.array(np.random.random((100, 2)), dtype=np.float64)
+    layer = couplings.AffineBijector([1, 1, 0, 0], build_dense, blob=10)
+
+    centers = (np.arange(10) + 0.5) / 10
+    expected = np.exp(-50 * (inputs[..., np.newaxis] - centers)**2)
+    expected = expected.reshape((100, 20))
+
+    assert np.allclose(layer._one_blob(inputs), expected)
+
+
 def test_affine_init():
     """ Test affine coupling initialization. """
     layer = couplings.AffineBijector([1, 1, 0, 0], build_dense)
@@ -205,6 +273,16 @@ def test_quadratic_inversion():
     assert np.allclose(inputs, layer.forward(layer.inverse(inputs)))
 
 
+def test_quadratic_uniform_widths():
+    """ Test quadratic with fixed, equal bin widths. """
+    inputs = np.array(np.random.random((100, 4)), dtype=np.float64)
+    layer = couplings.PiecewiseQuadratic([1, 1, 0, 0], build_dense,
+                                         uniform_widths=True)
+    assert layer.transform_net.layers[-1].output_shape[-1] == 2*(10+1)
+    assert np.allclose(inputs, layer.inverse(layer.forward(inputs)))
+    assert np.allclose(inputs, layer.forward(layer.inverse(inputs)))
+
+
 def test_quadratic_determinant():
     """ Test quadratic jacobian. """
     inputs = np.array(np.random.random((10, 4)), dtype=np.float64)
@@ -307,6 +385,18 @@ def test_rational_quadratic_inversion():
     assert np.allclose(inputs, layer.forward(layer.inverse(inputs)))
 
 
+def test_rational_quadratic_uniform_widths():
+    """ Test rational quadratic with fixed, equal bin widths. """
+    inputs = np.array(np.random.random((100, 4)), dtype=np.float64)
+    layer = couplings.PiecewiseRationalQuadratic([1, 1, 0, 0], build_dense,
+                                                 uniform_widths=True)
+    assert layer.transform_net.layers[-1].output_shape[-1] == 2*(10*2+1)
+    assert np.allclose(inputs, layer.inverse(layer.forward(inputs)))
+    assert np.allclose(inputs, layer.forward(layer.inverse(inputs)))
+    assert np.allclose(layer._forward_log_det_jacobian(inputs),
+                       -layer._inverse_log_det_jacobian(layer.forward(inputs)))
+
+
 def test_rational_quadratic_determinant():
     """ Test rational quadratic jacobian. """
     inputs = np.array(np.random.random((100, 4)), dtype=np.float64)
@@ -331,3 +421,25 @@ def test_rational_quadratic_masks():
     for _mask in masks:
         layer = couplings.PiecewiseRationalQuadratic(_mask, build_dense)
         assert (inputs == layer.inverse(layer.forward(inputs)).numpy()).all()
+
+
+def test_float32_couplings():
+    """ Test that the spline couplings compute in the dtype of the inputs. """
+    def build_dense32(in_features, out_features, options):
+        del options
+        return tf.keras.models.Sequential([
+            tf.keras.layers.Input(in_features, dtype=tf.float32),
+            tf.keras.layers.Dense(16, dtype=tf.float32),
+            tf.keras.layers.Dense(out_features, dtype=tf.float32)])
+
+    inputs = np.array(np.random.random((100, 4)), dtype=np.float32)
+    for coupling in [couplings.PiecewiseLinear, couplings.PiecewiseQuadratic,
+                     couplings.PiecewiseCubic,
+                     couplings.PiecewiseRationalQuadratic]:
+        for blob in [None, 10]:
+            layer = coupling([1, 1, 0, 0], build_dense32, blob=blob)
+            outputs = layer.forward(inputs)
+            logdet = layer._forward_log_det_jacobian(inputs)
+            assert outputs.dtype == tf.float32
+            assert logdet.dtype == tf.float32
+            assert np.allclose(inputs, layer.inverse(outputs), atol=1e-4)
@@ -161,3 +161,67 @@ def test_jensen_shannon(divergence, distributions):
                                        distributions[3], log_m))
 
     assert abs(loss - expected) <= 4*loss/tf.sqrt(float(NSAMPLES))
+
+
+def test_weighted_divergences(divergence, distributions):
+    """ Test that unit weights reproduce the unweighted divergences. """
+    divergence.alpha = 0.5
+    divergence.beta = 0.5
+    weights = tf.ones_like(distributions[0])
+    for name in divergence.divergences:
+        loss = divergence(name)(*distributions)
+        weighted_loss = divergence(name)(*distributions, weights=weights)
+        assert np.isclose(loss, weighted_loss)
+
+
+def test_log_divergences(distributions):
+    """ Test that the log space divergences match the linear ones. """
+    divergence = divergences.Divergence(alpha=0.3, beta=0.6)
+    log_divergence = divergences.LogDivergence(alpha=0.3, beta=0.6)
+    prob_p, _, logp, logq = distributions
+    assert log_divergence.divergences == divergence.divergences
+    weights = tf.random.uniform(prob_p.shape, 0.5, 1.5)
+    for name in divergence.divergences:
+        for wgts in [None, weights]:
+            logq_var = tf.Variable(logq)
+            with tf.GradientTape(persistent=True) as tape:
+                loss = divergence(name)(prob_p, tf.exp(logq_var), logp,
+                                        logq_var, weights=wgts)
+                log_loss = log_divergence(name)(logp, logq_var, weights=wgts)
+            assert np.isclose(loss, log_loss)
+            assert np.allclose(tape.gradient(loss, logq_var),
+                               tape.gradient(log_loss, logq_var))
+
+
+def test_log_divergences_underflow():
+    """ Test the log space divergences for underflowing probabilities. """
+    log_divergence = divergences.LogDivergence(alpha=0.5, beta=0.5)
+    logp = tf.constant([-800., -801., -799.5], dtype=tf.float32)
+    logq = tf.constant([-800.5, -800.2, -799.], dtype=tf.float32)
+    for name in log_divergence.divergences:
+        assert np.isfinite(log_divergence(name)(logp, logq))
+
+
+def test_monitor(distributions):
+    """ Test the fused evaluation of several divergences. """
+    divergence = divergences.Divergence(alpha=0.3, beta=0.6)
+    log_divergence = divergences.LogDivergence(alpha=0.3, beta=0.6)
+    prob_p, prob_q, logp, logq = distributions
+    weights = tf.random.uniform(prob_p.shape, 0.5, 1.5)
+    for wgts in [None, weights]:
+        values = divergence.monitor(divergence.divergences, *distributions,
+                                    weights=wgts)
+        log_values = log_divergence.monitor(divergence.divergences,
+                                            logp, logq, weights=wgts)
+        for name in divergence.divergences:
+            expected = divergence(name)(*distributions, weights=wgts)
+            assert np.isclose(values[name], expected, rtol=1e-4)
+            assert np.isclose(log_values[name], expected, rtol=1e-4)
+
+    assert list(divergence.monitor(['kl', 'chi2'], prob_p, prob_q,
+                                   logp, logq)) == ['kl', 'chi2']
+    with pytest.raises(NotImplementedError):
+        divergence.monitor(['alpha'], prob_p, prob_q, logp, logq)
+    with pytest.raises(ValueError):
+        divergences.Divergence().monitor(['chernoff'], prob_p, prob_q,
+                                         logp, logq)
@@ -0,0 +1,144 @@
+""" Test the construction of flows. """
+
+# pylint: disable=protected-access
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from iflow.integration import couplings
+from iflow.integration import flows
+
+
+def _reference_binary_masks(ndims):
+    """ Binary masks built from the string representation. """
+    nbits = int(np.ceil(np.log2(ndims)))
+    sub_masks = np.array([[int(i) for i in np.binary_repr(index, nbits)]
+                          for index in range(ndims)]).T[::-1]
+    masks = np.empty((2*nbits, ndims))
+    masks[0::2] = 1 - sub_masks
+    masks[1::2] = sub_masks
+    return masks
+
+
+def test_masks():
+    """ Test the mask generators. """
+    for ndims in range(2, 20):
+        assert np.array_equal(flows.binary_masks(ndims),
+                              _reference_binary_masks(ndims))
+
+    assert np.array_equal(flows.checkerboard_masks(3, 3),
+                          [[1, 0, 1], [0, 1, 0], [1, 0, 1]])
+
+    masks = flows.random_masks(7, seed=3)
+    assert masks.shape == (6, 7)
+    assert np.all(np.sum(masks[0::2], axis=1) == 3)
+    assert np.all(masks[0::2] + masks[1::2] == 1)
+    assert np.array_equal(masks, flows.random_masks(7, seed=3))
+
+
+@pytest.mark.parametrize('coupling', sorted(flows.COUPLINGS))
+def test_build_flow(coupling):
+    """ Test building a flow of each coupling type. """
+    flow = flows.build_flow(4, coupling=coupling, masks='checkerboard',
+                            num_bins=4, width=8, depth=1, dtype=tf.float32)
+    layers = flow.bijector.bijectors
+    assert len(layers) == 2
+    assert all(isinstance(layer, flows.COUPLINGS[coupling])
+               for layer in layers)
+
+    samples = flow.sample(10)
+    assert samples.dtype == tf.float32
+    assert np.all(np.isfinite(flow.log_prob(samples)))
+
+
+@pytest.mark.parametrize('coupling', ['affine', 'rational_quadratic'])
+def test_build_flow_ensemble(coupling):
+    """ Test that the members of an ensemble are independent flows. """
+    flow = flows.build_flow(3, coupling=coupling, ensemble=3, blob=4,
+                            width=8, depth=1)
+    for variable in flow.trainable_variables:
+        variable.assign(tf.random.uniform(variable.shape, -0.5, 0.5,
+                                          dtype=variable.dtype))
+
+    samples = flow.sample((3, 10))
+    assert samples.shape == (3, 10, 3)
+    log_prob = flow.log_prob(samples)
+    assert log_prob.shape == (3, 10)
+
+    member = flows.build_flow(3, coupling=coupling, blob=4, width=8,
+                              depth=1)
+    for variable, stacked in zip(member.trainable_variables,
+                                 flow.trainable_variables):
+        variable.assign(tf.reshape(stacked[1], variable.shape))
+    assert np.allclose(log_prob[1], member.log_prob(samples[1]))
+
+
+def test_build_flow_independent():
+    """ Test that flows have their own variables and masks. """
+    flow = flows.build_flow(3, masks='random', seed=1, width=8, depth=1)
+    variable = flow.trainable_variables[-1]
+    variable.assign(tf.ones_like(variable))
+
+    other = flows.build_flow(3, masks='random', seed=1, width=8, depth=1)
+    assert other is not flow
+    assert np.all(variable == 1)
+    assert np.all(other.trainable_variables[-1] == 0)
+
+    layers = [flows.build_flow(16, masks='random').bijector.bijectors
+              for _ in range(2)]
+    masks = [[layer.transform_features.numpy() for layer in chain]
+             for chain in layers]
+    assert not all(np.array_equal(mask_1, mask_2)
+                   for mask_1, mask_2 in zip(*masks))
+
+
+def test_build_flow_cache():
+    """ Test that cached flows are reset and keep their functions. """
+    flows.clear_cache()
+    flow = flows.build_flow(3, masks='random', seed=1, width=8, depth=1,
+                            cache=True)
+    functions = flows.flow_functions(flow)
+    initial = [variable.numpy() for variable in flow.trainable_variables]
+    for variable in flow.trainable_variables:
+        variable.assign(tf.random.uniform(variable.shape, -0.5, 0.5,
+                                          dtype=variable.dtype))
+
+    samples, logq = functions.sample_and_log_prob(10)
+    assert np.allclose(logq, flow.log_prob(samples))
+    assert np.allclose(functions.log_prob(samples), logq)
+
+    cached = flows.build_flow(3, masks='random', seed=1, width=8, depth=1,
+                              cache=True)
+    assert cached is flow
+    assert flows.flow_functions(cached) is functions
+    assert all(np.array_equal(variable, value) for variable, value
+               in zip(cached.trainable_variables, initial))
+
+    assert flows.build_flow(3, masks='random', seed=1, width=8,
+                            depth=1) is not flow
+    assert flows.build_flow(3, masks='random', seed=1, width=16, depth=1,
+                            cache=True) is not flow
+    assert flows.build_flow(3, masks='random', seed=1, width=8, depth=1,
+                            dtype=tf.float32, cache=True) is not flow
+    assert len(flows._CACHE) == 3
+    flows.clear_cache()
+    assert len(flows._CACHE) == 0
+
+
+def test_build_flow_errors():
+    """ Test the validation of the arguments. """
+    with pytest.raises(ValueError):
+        flows.build_flow(1)
+    with pytest.raises(ValueError):
+        flows.build_flow(2, coupling='spline')
+    with pytest.raises(ValueError):
+        flows.build_flow(2, masks='diagonal')
+    with pytest.raises(ValueError):
+        flows.build_flow(3, masks=[[1, 1, 1]])
+    with pytest.raises(ValueError):
+        flows.build_flow(3, masks=[[1, 0]])
+
+    flow = flows.build_flow(3, masks=[[1, 0, 0], [0, 1, 1]])
+    assert isinstance(flow.bijector.bijectors[0],
+                      couplings.PiecewiseRationalQuadratic)
@@ -2,11 +2,17 @@
 
 # pylint: disable=invalid-name, protected-access
 
+import warnings
+
+import pytest
+
 import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
 
-from iflow.integration.integrator import Integrator
+from iflow.integration.flows import build_flow
+from iflow.integration.integrator import Integrator, BatchSizeScheduler
+from iflow.integration.replay import ReplayBuffer
 
 tfd = tfp.distributions
 
@@ -17,6 +23,35 @@ def _func(x):
     return x
 
 
+def _gauss(x):
+    return tf.exp(-tf.reduce_sum(x**2, axis=-1))
+
+
+def _sum(x):
+    return tf.reduce_sum(x, axis=-1)
+
+
+def _normal(loc=0.5, scale=1., dtype=tf.float64):
+    """ Normal distribution in 3 dimensions with a trainable mean. """
+    return tfd.Independent(
+        tfd.Normal(loc=tf.Variable(3*[loc], dtype=dtype),
+                   scale=tf.constant(3*[scale], dtype=dtype)),
+        reinterpreted_batch_ndims=1)
+
+
+def _uniform():
+    """ Uniform distribution on the unit cube in 3 dimensions. """
+    return tfd.Independent(tfd.Uniform(low=3*[0.], high=3*[1.]),
+                           reinterpreted_batch_ndims=1)
+
+
+def _integrator(func=_gauss, dist=None, **kwargs):
+    """ Integrator of func, by default trained on _normal with Adam. """
+    if dist is None:
+        dist = _normal()
+    return Integrator(func, dist, tf.keras.optimizers.Adam(1e-3), **kwargs)
+
+
 def test_integrator_init():
     """ Test integrator initialization. """
     dist = tfd.Uniform(low=3*[0.], high=3*[1.])
@@ -40,3 +75,311 @@ def test_one_step():
     assert np.all(loss > 0)
     assert np.all(integral > 0)
     assert np.all(std > 0)
+
+
+def test_sample_and_log_prob():
+    """ Test sampling points together with their log probability. """
+    dist = tfd.Independent(tfd.Uniform(low=3*[0.], high=3*[2.]),
+                           reinterpreted_batch_ndims=1)
+    optimizer = tf.keras.optimizers.Adam(1e-3)
+    integrator = Integrator(_func, dist, optimizer)
+
+    samples, logq = integrator.sample_and_log_prob(10)
+
+    assert samples.shape == (10, 3)
+    assert logq.shape == (10,)
+    assert np.allclose(logq, dist.log_prob(samples))
+
+
+def test_flow_log_prob():
+    """ Test the fused passes through a flow against the bijector API. """
+    dist = build_flow(3, coupling='affine', masks='checkerboard')
+    # Move away from the identity the flow is initialized to.
+    for variable in dist.trainable_variables:
+        variable.assign(tf.random.uniform(variable.shape, -0.5, 0.5,
+                                          dtype=variable.dtype))
+    optimizer = tf.keras.optimizers.Adam(1e-3)
+    integrator = Integrator(_func, dist, optimizer)
+
+    samples, logq = integrator.sample_and_log_prob(10)
+    assert np.allclose(logq, dist.log_prob(samples))
+    assert np.allclose(integrator._log_prob(samples), logq)
+
+
+def test_one_step_jit_compile():
+    """ Test training one step compiled with XLA. """
+    # Other tests switch on eager execution, which skips the tracing.
+    tf.config.run_functions_eagerly(False)
+    integrator = _integrator(jit_compile=True)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        loss, integral, std = integrator.train_one_step(10, integral=True)
+        integrator.train_one_step(10)
+
+    assert np.all(loss > 0)
+    assert np.all(integral > 0)
+    assert np.all(std > 0)
+    assert not np.allclose(integrator.dist.distribution.loc, 3*[0.5])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        integrator.train_one_step(np.int64(10))
+        integrator.train_one_step(10.)
+
+    with pytest.raises(TypeError):
+        integrator.train_one_step(tf.constant(10))
+
+    with pytest.warns(RuntimeWarning, match='retraced'):
+        integrator.train_one_step(20, integral=True)
+
+
+def test_integrate_chunked():
+    """ Test the chunked integration. """
+    integrator = _integrator(_sum, _uniform())
+
+    mean, var, ess = integrator.integrate_chunked(10000, chunk_size=3000,
+                                                  seed=42)
+
+    assert np.isclose(mean, 1.5, rtol=1e-2)
+    assert np.isclose(var, 0.25, rtol=1e-1)
+    assert 0 < ess < 10000
+
+
+def test_chunked_parallel():
+    """ Test the parallel chunked evaluation is reproducible. """
+    integrator = _integrator(_sum, _uniform())
+
+    serial = integrator.integrate_chunked(10000, chunk_size=1000, seed=42)
+    parallel = integrator.integrate_chunked(10000, chunk_size=1000,
+                                            nworkers=4, seed=42)
+    assert serial == parallel
+    # Large seeds are reduced to the int32 range
+    assert serial == integrator.integrate_chunked(10000, chunk_size=1000,
+                                                  seed=42 + 2**31)
+
+    weights, samples = integrator.sample_weights_chunked(
+        2500, yield_samples=True, chunk_size=1000, nworkers=4, seed=42)
+    assert weights.shape == (2500,)
+    assert samples.shape == (2500, 3)
+    assert np.allclose(weights, np.sum(samples, axis=-1))
+    assert np.all(weights == integrator.sample_weights_chunked(
+        2500, chunk_size=1000, seed=42))
+
+
+def test_chunked_python_func():
+    """ Test the chunked evaluation of a NumPy function. """
+    calls = []
+
+    def func(x):
+        calls.append(type(x))
+        return np.sum(x, axis=-1)
+
+    dist = _uniform()
+    integrator = _integrator(func, dist)
+    reference = _integrator(_sum, dist)
+
+    result = integrator.integrate_chunked(10000, chunk_size=1000,
+                                          nworkers=4, seed=42,
+                                          python_func=True)
+    assert np.allclose(result, reference.integrate_chunked(
+        10000, chunk_size=1000, seed=42))
+    assert calls == 10*[np.ndarray]
+
+    weights, samples = integrator.sample_weights_chunked(
+        2500, yield_samples=True, chunk_size=1000, nworkers=4, seed=42,
+        python_func=True)
+    assert samples.shape == (2500, 3)
+    assert np.allclose(weights, reference.sample_weights_chunked(
+        2500, chunk_size=1000, seed=42))
+
+    with pytest.raises(ValueError):
+        integrator.sample_weights_chunked(0, python_func=True)
+    with pytest.raises(ValueError):
+        reference.integrate_chunked(0)
+
+
+def test_unweight(tmp_path):
+    """ Test the generation of unweighted events. """
+    integrator = _integrator(_sum, _uniform())
+
+    events = integrator.unweight(20000, batch_size=5000, seed=42)
+    assert integrator.unweight(10, batch_size=100, seed=2**40).shape == (
+        10, 3)
+
+    # <x_1> for a density proportional to x_1 + x_2 + x_3
+    assert events.shape == (20000, 3)
+    assert np.allclose(np.mean(events, axis=0), 5./9., atol=1e-2)
+
+    out = np.lib.format.open_memmap(tmp_path / 'events.npy', mode='w+',
+                                    shape=(1000, 3))
+    events = integrator.unweight(1000, batch_size=5000, max_weight=3.,
+                                 out=out, seed=42)
+    assert events is out
+    assert np.all((out > 0) & (out < 1))
+    assert np.allclose(np.mean(out), 5./9., atol=3e-2)
+
+
+def test_train_replay():
+    """ Test training on points from the replay buffer. """
+    integrator = _integrator()
+    replay_buffer = ReplayBuffer(100)
+
+    loss, integral, std = integrator.train_replay(
+        10, replay_buffer, nupdates=3, integral=True)
+    integrator.train_replay(10, replay_buffer, nupdates=3)
+
+    assert np.all(loss > 0)
+    assert np.all(integral > 0)
+    assert np.all(std > 0)
+    assert len(replay_buffer) == 20
+    assert integrator.optimizer.iterations == 6
+    assert not np.allclose(integrator.dist.distribution.loc, 3*[0.5])
+
+    with pytest.raises(ValueError):
+        integrator.train_replay(10, replay_buffer, nupdates=0)
+    assert len(replay_buffer) == 20
+
+
+def test_reweight():
+    """ Test reweighting fixed points without calling the function. """
+    calls = []
+
+    def _count(x):
+        calls.append(len(x))
+        return np.exp(-np.sum(x**2, axis=-1))
+
+    def func(x):
+        return tf.numpy_function(_count, [x], tf.float64)
+
+    integrator = _integrator(func, cache_size=1000)
+    dist = integrator.dist
+    samples = integrator.sample(100).numpy()
+
+    weights = integrator.reweight(samples)
+    assert len(calls) == 1
+    assert np.allclose(weights, _gauss(samples)
+                       / dist.prob(samples).numpy())
+
+    dist.distribution.loc.assign(3*[0.])
+    new_weights = integrator.reweight(samples)
+    assert len(calls) == 1
+    assert np.allclose(new_weights, _gauss(samples)
+                       / dist.prob(samples).numpy())
+
+    other = integrator.sample(100).numpy()
+    integrator.reweight(other, values=np.ones(100))
+    assert np.allclose(integrator.reweight(other),
+                       1. / dist.prob(other).numpy())
+    assert len(calls) == 1
+
+
+def test_train_pipelined():
+    """ Test training with the function evaluated concurrently. """
+    calls = []
+
+    def _count(x):
+        calls.append(len(x))
+        return np.exp(-np.sum(x**2, axis=-1))
+
+    def func(x):
+        return tf.numpy_function(_count, [x], tf.float64)
+
+    integrator = _integrator(func)
+    losses = integrator.train_pipelined(10, nsteps=5, nworkers=2)
+
+    assert losses.shape == (5,)
+    assert np.all(losses > 0)
+    assert integrator.optimizer.iterations == 5
+    assert sorted(calls) == 10*[5]
+    assert not np.allclose(integrator.dist.distribution.loc, 3*[0.5])
+
+    calls.clear()
+    integrator = _integrator(_count)
+    losses = integrator.train_pipelined(10, nsteps=5, nworkers=2,
+                                        python_func=True)
+    assert np.all(losses > 0)
+    assert sorted(calls) == 10*[5]
+
+
+def test_train_to_target():
+    """ Test training until the target precision is reached. """
+    integrator = _integrator()
+    scheduler = BatchSizeScheduler(100, 1000, window=2,
+                                   significance=100.)
+
+    # Other tests switch on eager execution, which skips the tracing.
+    tf.config.run_functions_eagerly(False)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        means, stddevs, sizes = integrator.train_to_target(1e-2, scheduler)
+
+    weights = 1. / stddevs**2
+    assert np.sqrt(1. / np.sum(weights)) < (
+        1e-2 * np.sum(weights * means) / np.sum(weights))
+    assert sizes[0] == 128
+    assert sizes[-1] > 128
+    assert set(sizes) <= {128, 256, 512}
+    assert len(means) == len(stddevs) == len(sizes)
+
+
+def test_one_step_log_space():
+    """ Test training in log space for a tiny integrand in float32. """
+    def _tiny(x):
+        return 1e-30*_gauss(x)
+
+    for loss_func in ['chi2', 'kl']:
+        # A wide distribution keeps the variance of the weights f/q finite.
+        integrator = _integrator(_tiny, _normal(dtype=tf.float32),
+                                 loss_func=loss_func, log_space=True)
+        loss, integral, std = integrator.train_one_step(1000, integral=True)
+        assert np.isfinite(loss)
+        assert std > 0
+        assert abs(integral - 1e-30*np.pi**1.5) < 5*std
+
+
+def test_accumulation_dtype():
+    """ Test a float32 distribution with float64 moments and validation. """
+    dist = _normal(0.4, 0.2, tf.float32)
+    integrator = _integrator(dist=dist, accumulation_dtype=tf.float64)
+
+    loss, integral, std = integrator.train_one_step(1000, integral=True)
+    assert loss.dtype == tf.float64
+    assert integral.dtype == tf.float64
+    assert std > 0
+    assert integrator.integrate(100)[0].dtype == tf.float64
+    assert integrator.sample_weights(100).dtype == tf.float64
+
+    reference = _normal(0.4, 0.2)
+    logq_error, integral_error = integrator.validate(reference, 1000)
+    assert np.allclose(reference.trainable_variables[0],
+                       dist.trainable_variables[0])
+    assert logq_error < 1e-4
+    assert integral_error < 1e-4
+
+
+def test_monitor():
+    """ Test monitoring divergences during training. """
+    integrator = _integrator(loss_func='kl',
+                             monitor=['chi2', 'kl', 'hellinger'])
+
+    loss = integrator.train_one_step(1000)
+    assert sorted(integrator.metrics) == ['chi2', 'hellinger', 'kl']
+    assert np.isclose(integrator.metrics['kl'], loss, rtol=1e-4)
+    assert integrator.metrics['chi2'] > 0
+    assert integrator.metrics['hellinger'] > 0
+
+    # Steps on reused points update the metrics as well
+    replay_buffer = ReplayBuffer(100)
+    for variable in integrator.metrics.values():
+        variable.assign(-1.)
+    loss = integrator.train_replay(100, replay_buffer, nupdates=1)
+    assert np.isclose(integrator.metrics['kl'], loss, rtol=1e-4)
+    for variable in integrator.metrics.values():
+        variable.assign(-1.)
+    losses = integrator.train_pipelined(100, 2)
+    assert np.isclose(integrator.metrics['kl'], losses[-1], rtol=1e-4)
+    assert integrator.metrics['chi2'] > 0
+
+    with pytest.raises(NotImplementedError):
+        _integrator(monitor=['unknown'])
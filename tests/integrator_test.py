@@ -3,11 +3,12 @@
 import unittest
 
 import numpy as np
+import pytest
 
 import tensorflow as tf
 import tensorflow_probability as tfp
 
-from iflow.integration.integrator import Integrator
+from iflow.integration.integrator import Integrator, BatchSizeScheduler
 from iflow.integration.divergences import Divergence
 
 tfd = tfp.distributions  # pylint: disable=invalid-name
@@ -31,8 +32,8 @@ def test_train_one_step():
         return_value=tf.ones([100]))
     dist.log_prob = unittest.mock.MagicMock(
         return_value=-4.60517*tf.ones([100]))
-    dist.prob = unittest.mock.MagicMock(return_value=0.01*tf.ones([100]))
-    dist.trainable_variables = [dist.prob()]
+    dist.trainable_variables = [dist.log_prob()]
+    dist.log_prob.reset_mock()
     optimizer = unittest.mock.MagicMock()
     optimizer.apply_gradients = unittest.mock.MagicMock()
     integral = Integrator(func, dist, optimizer)
@@ -43,7 +44,7 @@ def test_train_one_step():
     dist.sample.assert_called_once_with(100)
     assert func.call_count == 1
     assert dist.log_prob.call_count == 1
-    assert dist.prob.call_count == 2
+    assert dist.prob.call_count == 0
     assert optimizer.apply_gradients.call_count == 1
 
 
@@ -52,17 +53,17 @@ def test_integrate():
     tf.config.experimental_run_functions_eagerly(True)
     func = unittest.mock.MagicMock(return_value=tf.random.uniform([1000]))
     dist = unittest.mock.MagicMock()
-    dist.sample = unittest.mock.MagicMock(
-        return_value=tf.ones([1000]))
-    dist.prob = unittest.mock.MagicMock(return_value=0.001*tf.ones([1000]))
+    dist.experimental_sample_and_log_prob = unittest.mock.MagicMock(
+        return_value=(tf.ones([1000]), tf.math.log(0.001*tf.ones([1000]))))
     optimizer = unittest.mock.MagicMock()
     integral = Integrator(func, dist, optimizer)
     mean, var = integral.integrate(1000)
 
     assert abs(mean - 1.0) < var
 
-    dist.sample.assert_called_once_with(1000)
-    assert dist.prob.call_count == 1
+    dist.experimental_sample_and_log_prob.assert_called_once_with(
+        1000, seed=None)
+    assert dist.prob.call_count == 0
     assert func.call_count == 1
 
     
@@ -71,17 +72,17 @@ def test_sample_weights():
     tf.config.experimental_run_functions_eagerly(True)
     func = unittest.mock.MagicMock(return_value=tf.random.uniform([1000]))
     dist = unittest.mock.MagicMock()
-    dist.sample = unittest.mock.MagicMock(
-        return_value=tf.ones([1000]))
-    dist.prob = unittest.mock.MagicMock(return_value=0.001*tf.ones([1000]))
+    dist.experimental_sample_and_log_prob = unittest.mock.MagicMock(
+        return_value=(tf.ones([1000]), tf.math.log(0.001*tf.ones([1000]))))
     optimizer = unittest.mock.MagicMock()
     integral = Integrator(func, dist, optimizer)
     weights = integral.sample_weights(1000)
 
     assert 0 < np.mean(weights)/np.max(weights) < 1
 
-    dist.sample.assert_called_once_with(1000)
-    assert dist.prob.call_count == 1
+    dist.experimental_sample_and_log_prob.assert_called_once_with(
+        1000, seed=None)
+    assert dist.prob.call_count == 0
     assert func.call_count == 1
 
 
@@ -104,14 +105,89 @@ def test_sample():
 def test_acceptance():
     """ Test the integral acceptance calculation. """
     tf.config.experimental_run_functions_eagerly(True)
-    func = unittest.mock.MagicMock(return_value=0.0002*tf.ones([5000]))
+    logq = tf.math.log(0.0002*tf.ones([50000]))
+    func = unittest.mock.MagicMock(return_value=tf.exp(logq))
     dist = unittest.mock.MagicMock()
-    dist.prob = unittest.mock.MagicMock(return_value=0.0002*tf.ones([5000]))
+    dist.experimental_sample_and_log_prob = unittest.mock.MagicMock(
+        return_value=(tf.ones([50000]), logq))
     optimizer = unittest.mock.MagicMock()
     integral = Integrator(func, dist, optimizer)
     eff = integral.acceptance(5000, npool=10)
 
     assert 0 < eff <= 1
 
-    assert func.call_count == 10
-    assert dist.prob.call_count == 10
+    assert func.call_count == 1
+    assert dist.experimental_sample_and_log_prob.call_count == 1
+    assert dist.experimental_sample_and_log_prob.call_args[0] == (50000,)
+
+    # The pool is drawn in chunks
+    dist.experimental_sample_and_log_prob = unittest.mock.MagicMock(
+        return_value=(tf.ones([10000]), logq[:10000]))
+    func.return_value = tf.exp(logq[:10000])
+    assert integral.acceptance(5000, npool=10, chunk_size=10000) == eff
+    assert dist.experimental_sample_and_log_prob.call_count == 5
+
+
+def test_batch_size_scheduler():
+    """ Test the adaptive number of samples per step. """
+    scheduler = BatchSizeScheduler(100, 600, window=5)
+    assert scheduler.sizes == [128, 256, 512]
+    noise = [0.1, -0.1, 0.1, -0.1, 0.]
+    # Significantly decreasing loss keeps the batch size
+    for loss in np.linspace(10, 1, 10):
+        assert scheduler.update(loss) == 128
+    for delta in noise:
+        scheduler.update(1. + delta)
+    assert scheduler.nsamples == 128
+    # Plateau within the noise grows the batch size up to the maximum
+    for delta in noise:
+        scheduler.update(1. + delta)
+    assert scheduler.nsamples == 256
+    for delta in 2*noise:
+        scheduler.update(1.05 + delta)
+    assert scheduler.nsamples == 512
+    # Significantly increasing loss shrinks the batch size
+    for delta in noise:
+        scheduler.update(2. + delta)
+    assert scheduler.nsamples == 256
+
+
+@pytest.mark.parametrize('second, expected', [
+    # Fluctuations beyond half the scale of the first window: shrink
+    ([1., 6., 1., 6.], 256),
+    # Mean within the noise of the first window, a plateau: grow
+    ([1.01, 0.99, 1.01, 0.99], 1024),
+    # Significantly worse mean: shrink
+    ([1.51, 1.49, 1.51, 1.49], 256),
+    # Significantly better mean: keep
+    ([0.51, 0.49, 0.51, 0.49], 512),
+])
+def test_batch_size_scheduler_policy(second, expected):
+    """ Test each rule of the batch size policy after a quiet window. """
+    scheduler = BatchSizeScheduler(128, 2048, initial_samples=512, window=4)
+    for loss in [1.01, 0.99, 1.01, 0.99]:
+        assert scheduler.update(loss) == 512
+    for loss in second:
+        scheduler.update(loss)
+    assert scheduler.nsamples == expected
+
+
+def test_batch_size_scheduler_noise():
+    """ Test that noisy losses shrink the batch size. """
+    scheduler = BatchSizeScheduler(128, 1024, initial_samples=300, window=4)
+    assert scheduler.nsamples == 256
+    for loss in [1., 10., 1., 10.]:
+        scheduler.update(loss)
+    assert scheduler.nsamples == 128
+    # The noise is measured relative to the first window, also near zero
+    for loss in [0.01, 0.011, 0.01, 0.011]:
+        scheduler.update(loss)
+    assert scheduler.nsamples == 128
+    for loss in [0.01, 0.011, 0.01, 0.011]:
+        scheduler.update(loss)
+    assert scheduler.nsamples == 256
+
+    with pytest.raises(ValueError):
+        BatchSizeScheduler(100, 120)
+    with pytest.raises(ValueError):
+        BatchSizeScheduler(window=1)
@@ -0,0 +1,128 @@
+""" Test the multi-channel integrator. """
+
+# pylint: disable=invalid-name, protected-access
+
+import numpy as np
+import pytest
+import tensorflow as tf
+import tensorflow_probability as tfp
+
+from iflow.integration.flows import build_flow
+from iflow.integration.multichannel import MultiChannelIntegrator
+
+tfd = tfp.distributions
+
+tf.keras.backend.set_floatx('float64')
+
+
+def _gauss(x, loc):
+    return tf.reduce_prod(tf.exp(-(x - loc)**2 / 0.02), axis=-1) / (
+        np.pi * 0.02)
+
+
+def _channels():
+    return [tfd.Independent(tfd.Normal(
+        loc=tf.Variable(2*[loc], dtype=tf.float64),
+        scale=tf.constant(2*[0.2], dtype=tf.float64)),
+                            reinterpreted_batch_ndims=1)
+            for loc in [0.3, 0.7]]
+
+
+def test_multichannel_log_prob():
+    """ Test the mixture density. """
+    dists = _channels()
+    integrator = MultiChannelIntegrator(
+        lambda x: _gauss(x, 0.25), dists, tf.keras.optimizers.Adam(1e-3))
+    integrator.channel_logits.assign([0., np.log(3.)])
+
+    samples = np.random.random((100, 2))
+    expected = (0.25 * dists[0].prob(samples)
+                + 0.75 * dists[1].prob(samples))
+    assert np.allclose(np.exp(integrator.log_prob(samples)), expected)
+    assert np.all(integrator.allocate(1000).numpy() == [250, 750])
+
+
+def test_multichannel_flow_log_prob():
+    """ Test the mixture density of flows from the fused inverse pass. """
+    dists = [build_flow(2, masks='checkerboard', num_bins=8, width=8,
+                        depth=2) for _ in range(2)]
+    integrator = MultiChannelIntegrator(
+        lambda x: _gauss(x, 0.25), dists, tf.keras.optimizers.Adam(1e-3))
+
+    samples = np.random.random((100, 2))
+    expected = 0.5 * dists[0].prob(samples) + 0.5 * dists[1].prob(samples)
+    assert np.allclose(np.exp(integrator.log_prob(samples)), expected)
+
+
+def test_multichannel_moments():
+    """ Test the stratified mean and uncertainty. """
+    integrator = MultiChannelIntegrator(
+        lambda x: _gauss(x, 0.25), _channels(), tf.keras.optimizers.Adam(1e-3))
+    integrator.channel_logits.assign([0., np.log(3.)])
+
+    values = [np.random.random(100), np.random.random(300) + 1.]
+    channels = np.repeat([0, 1], [100, 300])
+    mean, var, variances = integrator._moments(
+        tf.constant(np.concatenate(values)), channels, tf.constant([100, 300]))
+
+    error = np.sqrt(0.25**2 * np.var(values[0], ddof=1) / 100
+                    + 0.75**2 * np.var(values[1], ddof=1) / 300)
+    assert np.isclose(mean, 0.25*np.mean(values[0]) + 0.75*np.mean(values[1]))
+    assert np.isclose(np.sqrt(var / 399), error)
+    assert np.allclose(variances, [np.var(values[0], ddof=1),
+                                   np.var(values[1], ddof=1)])
+
+
+def test_multichannel_integrate():
+    """ Test the integral estimate and training of the channels. """
+    def func(x):
+        return 0.5 * _gauss(x, 0.25) + 0.5 * _gauss(x, 0.75)
+
+    integrator = MultiChannelIntegrator(
+        func, _channels(), tf.keras.optimizers.Adam(1e-2))
+    integrator.channel_logits.assign([0., np.log(3.)])
+
+    mean, var = integrator.integrate(20000)
+    assert abs(mean - 1.) < 5 * np.sqrt(var / 19999)
+
+    weights = integrator.sample_weights(1000)
+    assert np.isclose(np.mean(weights), 1., rtol=0.2)
+
+    for _ in range(50):
+        loss, mean, std = integrator.train_one_step(1000, integral=True)
+    assert np.all(loss > 0)
+    assert abs(mean - 1.) < 5 * std
+    assert integrator.global_step == 50
+    assert integrator.channel_stddevs.shape == (2,)
+    # The channel weights approach the equal weights of the two peaks
+    assert abs(integrator.channel_weights[0] - 0.5) < 0.25
+
+
+def test_multichannel_allocate():
+    """ Test the allocation of the samples to the channels. """
+    integrator = MultiChannelIntegrator(
+        lambda x: _gauss(x, 0.25), _channels(), tf.keras.optimizers.Adam(1e-3))
+    integrator.channel_logits.assign([0., np.log(3.)])
+
+    # Proportional to alpha_c s_c, with a tenth proportional to alpha_c
+    integrator.channel_stddevs = np.array([3., 1.])
+    assert np.all(integrator.allocate(1000).numpy() == [475, 525])
+    integrator.channel_stddevs = np.zeros(2)
+    assert np.all(integrator.allocate(1000).numpy() == [250, 750])
+
+    # Every channel keeps two points and the total is exact
+    integrator.channel_logits.assign([0., np.log(1000.)])
+    integrator.channel_stddevs = None
+    assert np.all(integrator.allocate(10).numpy() == [2, 8])
+    for nsamples in [4, 7, 11, 999]:
+        assert np.sum(integrator.allocate(nsamples)) == nsamples
+    with pytest.raises(ValueError):
+        integrator.allocate(3)
+
+    # A channel with a vanishing variance keeps getting points
+    integrator.channel_logits.assign([0., 0.])
+    integrator.channel_stddevs = np.array([0., 1.])
+    assert np.all(integrator.allocate(1000).numpy() == [50, 950])
+    _, _, std = integrator.train_one_step(1000, integral=True)
+    assert std > 0
+    assert np.all(integrator.channel_stddevs > 0)
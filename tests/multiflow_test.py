@@ -0,0 +1,57 @@
+""" Test the multi-flow integrator. """
+
+import numpy as np
+import tensorflow as tf
+
+from iflow.integration.flows import build_flow
+from iflow.integration.multiflow import MultiFlowIntegrator
+
+tf.keras.backend.set_floatx('float64')
+
+
+def _gauss(x):
+    return tf.reduce_prod(tf.exp(-(x - 0.5)**2 / 0.02), axis=-1) / (
+        np.pi * 0.02)
+
+
+def _ensemble(nmembers):
+    return build_flow(2, masks='checkerboard', num_bins=8, width=8, depth=2,
+                      ensemble=nmembers)
+
+
+def test_multiflow_integrate():
+    """ Test the integral estimates of all members. """
+    calls = []
+
+    def func(x):
+        calls.append(x.shape)
+        return _gauss(x)
+
+    integrator = MultiFlowIntegrator(func, _ensemble(3), 3,
+                                     tf.keras.optimizers.Adam(1e-3))
+    mean, var = integrator.integrate(20000)
+    assert mean.shape == (3,)
+    assert np.all(abs(mean - 1.) < 5 * np.sqrt(var / 19999))
+    assert calls == [(60000, 2)]
+
+
+def test_multiflow_train():
+    """ Test that the members are trained independently. """
+    tf.random.set_seed(3)
+    dist = _ensemble(2)
+    integrator = MultiFlowIntegrator(_gauss, dist, 2,
+                                     tf.keras.optimizers.Adam(1e-3))
+    _, _, initial = integrator.train_one_step(1000, integral=True)
+    for _ in range(30):
+        loss, mean, error = integrator.train_one_step(1000, integral=True)
+    assert loss.shape == mean.shape == error.shape == (2,)
+    assert np.all(loss > 0)
+    assert np.all(abs(mean - 1.) < 5 * error)
+    assert np.all(error < initial)
+
+    # One set of stacked variables, holding different weights per member
+    assert len(integrator.trainable_variables) == len(
+        _ensemble(None).trainable_variables)
+    kernel = integrator.trainable_variables[-2]
+    assert kernel.shape[0] == 2
+    assert not np.allclose(kernel[0], kernel[1])
@@ -0,0 +1,92 @@
+""" Test the transform networks. """
+
+import numpy as np
+import tensorflow as tf
+
+from iflow.integration import couplings
+from iflow.integration import flows
+from iflow.integration import networks
+from iflow.integration.integrator import Integrator
+
+
+def test_dense_network():
+    """ Test the shapes, initialization and variables of the network. """
+    network = networks.DenseNetwork(3, 5, width=8, depth=2,
+                                    dtype=tf.float64)
+    inputs = tf.constant(np.random.random((10, 3)))
+    outputs = network(inputs)
+
+    assert outputs.shape == (10, 5)
+    assert outputs.dtype == tf.float64
+    assert np.all(outputs == 0)
+    assert len(network.trainable_variables) == 6
+
+    network.kernels[-1].assign(np.random.normal(size=(8, 5)))
+    hidden = inputs
+    for kernel, bias in zip(network.kernels[:-1], network.biases[:-1]):
+        hidden = np.maximum(hidden @ kernel.numpy() + bias.numpy(), 0)
+    assert np.allclose(network(inputs), hidden @ network.kernels[-1].numpy())
+
+
+def test_dense_ensemble():
+    """ Test that each member of an ensemble is a network of its own. """
+    network = networks.DenseNetwork(3, 5, width=8, depth=2,
+                                    dtype=tf.float64, ensemble=4)
+    assert network.kernels[0].shape == (4, 3, 8)
+    assert network.biases[0].shape == (4, 1, 8)
+    network.kernels[-1].assign(np.random.normal(size=(4, 8, 5)))
+    network.biases[0].assign(np.random.normal(size=(4, 1, 8)))
+
+    inputs = tf.constant(np.random.random((4, 10, 3)))
+    outputs = network(inputs)
+    assert outputs.shape == (4, 10, 5)
+
+    member = networks.DenseNetwork(3, 5, width=8, depth=2, dtype=tf.float64)
+    for variable, stacked in zip(member.trainable_variables,
+                                 network.trainable_variables):
+        variable.assign(tf.reshape(stacked[2], variable.shape))
+    assert np.allclose(outputs[2], member(inputs[2]))
+
+
+def test_dense_factory():
+    """ Test the factory with the coupling layers. """
+    build = networks.dense(width=8, depth=2, activation='tanh',
+                           dtype=tf.float32)
+    layer = couplings.PiecewiseRationalQuadratic([1, 1, 0, 0], build)
+    assert isinstance(layer.transform_net, networks.DenseNetwork)
+    assert layer.transform_net.activation is tf.keras.activations.tanh
+    assert len(layer.trainable_variables) == 6
+
+    inputs = tf.constant(np.random.random((10, 4)), dtype=tf.float32)
+    assert np.allclose(layer.forward(inputs), inputs, atol=1e-6)
+
+    network = build(2, 3, {'depth': 1})
+    assert len(network.kernels) == 2
+    assert network.dtype == tf.float32
+
+
+def test_dense_seed():
+    """ Test that the initialization follows the TensorFlow seed. """
+    tf.random.set_seed(5)
+    first = networks.DenseNetwork(3, 5, dtype=tf.float32, seed=1)
+    tf.random.set_seed(5)
+    second = networks.DenseNetwork(3, 5, dtype=tf.float32, seed=1)
+    for kernel_1, kernel_2 in zip(first.kernels, second.kernels):
+        assert np.array_equal(kernel_1, kernel_2)
+
+
+def test_integrator_save_load(tmp_path, monkeypatch):
+    """ Test saving and loading the networks of a flow. """
+    monkeypatch.chdir(tmp_path)
+    dist = flows.build_flow(2, num_bins=4, width=8, depth=1)
+    integrator = Integrator(lambda x: tf.reduce_prod(x, axis=-1), dist,
+                            tf.keras.optimizers.Adam(1e-2))
+    integrator.train_one_step(100)
+    integrator.save_weights()
+    trained = [variable.numpy() for variable in dist.trainable_variables]
+
+    for variable in dist.trainable_variables:
+        variable.assign(tf.zeros_like(variable))
+    integrator.load_weights()
+    for variable, value in zip(dist.trainable_variables, trained):
+        assert np.array_equal(variable, value)
@@ -0,0 +1,41 @@
+""" Test the replay buffer. """
+
+import pytest
+
+import numpy as np
+
+from iflow.integration.replay import ReplayBuffer
+
+
+def test_replay_buffer():
+    """ Test adding and sampling points. """
+    buffer = ReplayBuffer(10, seed=42)
+    with pytest.raises(ValueError):
+        buffer.sample(1)
+
+    samples = np.random.random((4, 3))
+    buffer.add(samples, np.sum(samples, axis=-1), np.zeros(4))
+    assert len(buffer) == 4
+
+    points, values, logq = buffer.sample(100)
+    assert points.shape == (100, 3)
+    assert np.allclose(values, np.sum(points, axis=-1))
+    assert np.all(logq == 0)
+
+
+def test_replay_buffer_eviction():
+    """ Test that the oldest points are evicted. """
+    buffer = ReplayBuffer(10, seed=42)
+    for i in range(4):
+        buffer.add(np.full((4, 1), i), np.full(4, i), np.full(4, i))
+    assert len(buffer) == 10
+
+    points, values, logq = buffer.sample(1000)
+    assert set(np.unique(values)) == {1, 2, 3}
+    assert np.all(values == points[:, 0])
+    assert np.all(values == logq)
+    assert np.sum(values == 1) < np.sum(values == 2)
+
+    buffer.add(np.full((20, 1), 5), np.full(20, 5), np.full(20, 5))
+    assert len(buffer) == 10
+    assert np.all(buffer.sample(100)[1] == 5)
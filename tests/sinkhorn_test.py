@@ -0,0 +1,102 @@
+""" Test the Sinkhorn loss. """
+
+# pylint: disable=protected-access
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_probability as tfp
+
+from iflow.integration import sinkhorn
+from iflow.integration.integrator import Integrator
+
+tfd = tfp.distributions
+
+
+def _dense_sinkhorn(pts_x, pts_y, log_a, log_b, epsilon, niter=100):
+    """ Reference Sinkhorn divergence with the full cost matrix. """
+    def _transport(pts_x, pts_y, log_a, log_b):
+        cost = sinkhorn.dist(pts_x, pts_y) / epsilon
+        pot_f, pot_g = tf.zeros_like(log_a), tf.zeros_like(log_b)
+        for _ in range(niter):
+            pot_f = -epsilon * tf.reduce_logsumexp(
+                log_b + pot_g / epsilon - cost, axis=1)
+            pot_g = -epsilon * tf.reduce_logsumexp(
+                log_a + pot_f / epsilon - tf.transpose(cost), axis=1)
+        return (tf.reduce_sum(tf.exp(log_a) * pot_f)
+                + tf.reduce_sum(tf.exp(log_b) * pot_g))
+
+    return (_transport(pts_x, pts_y, log_a, log_b)
+            - 0.5 * _transport(pts_x, pts_x, log_a, log_a)
+            - 0.5 * _transport(pts_y, pts_y, log_b, log_b))
+
+
+def test_softmin():
+    """ Test the blockwise soft-minimum and its gradient. """
+    pts_x = tf.Variable(np.random.random((37, 2)))
+    pts_y = tf.Variable(np.random.random((29, 2)))
+    log_b = tf.Variable(np.random.normal(size=29))
+    upstream = tf.constant(np.random.normal(size=37))
+    epsilon = 0.05
+
+    with tf.GradientTape(persistent=True) as tape:
+        blocks = sinkhorn._softmin(pts_x, pts_y, log_b, epsilon, 8)
+        dense = -epsilon * tf.reduce_logsumexp(
+            log_b - sinkhorn.dist(pts_x, pts_y) / epsilon, axis=1)
+        blocks_sum = tf.reduce_sum(upstream * blocks)
+        dense_sum = tf.reduce_sum(upstream * dense)
+
+    assert np.allclose(blocks, dense)
+    for grad, expected in zip(tape.gradient(blocks_sum, [pts_x, pts_y, log_b]),
+                              tape.gradient(dense_sum, [pts_x, pts_y, log_b])):
+        assert np.allclose(grad, expected)
+
+
+def test_sinkhorn_divergence():
+    """ Test the Sinkhorn divergence against the dense iterations. """
+    pts_x = tf.constant(np.random.random((37, 2)))
+    pts_y = tf.constant(np.random.random((29, 2)) + 0.3)
+    log_a = tf.nn.log_softmax(np.random.normal(size=37))
+    log_b = tf.nn.log_softmax(np.random.normal(size=29))
+
+    loss = sinkhorn.sinkhorn_divergence(pts_x, pts_y, log_a, log_b,
+                                        epsilon=0.1, niter=100, tol=1e-10,
+                                        block_size=8)
+    assert np.isclose(loss, _dense_sinkhorn(pts_x, pts_y, log_a, log_b, 0.1))
+
+    loss = sinkhorn.sinkhorn_divergence(pts_x, pts_x, log_a, log_a,
+                                        epsilon=0.1)
+    assert abs(loss) < 1e-6
+
+
+def test_sinkhorn_gradient():
+    """ Test the gradient of the Sinkhorn divergence. """
+    pts_x = tf.Variable(np.random.random((20, 2)))
+    pts_y = tf.constant(np.random.random((15, 2)) + 0.3)
+    logits = tf.Variable(np.random.normal(size=20))
+    options = {'epsilon': 0.1, 'niter': 100, 'tol': 1e-10, 'block_size': 8}
+
+    with tf.GradientTape(persistent=True) as tape:
+        loss = sinkhorn.sinkhorn_divergence(
+            pts_x, pts_y, tf.nn.log_softmax(logits), **options)
+        dense = _dense_sinkhorn(pts_x, pts_y, tf.nn.log_softmax(logits),
+                                tf.fill([15], -np.log(15.)), 0.1)
+
+    for grad, expected in zip(tape.gradient(loss, [pts_x, logits]),
+                              tape.gradient(dense, [pts_x, logits])):
+        assert np.allclose(grad, expected, atol=1e-6)
+
+
+def test_sinkhorn_integrator():
+    """ Test training the integrator with the Sinkhorn loss. """
+    loc = tf.Variable([0.2, 0.2], dtype=tf.float64)
+    dist = tfd.Independent(tfd.Normal(loc=loc, scale=np.array([0.3, 0.3])),
+                           reinterpreted_batch_ndims=1)
+    optimizer = tf.keras.optimizers.Adam(1e-2)
+    integrator = Integrator(
+        lambda x: tf.exp(-tf.reduce_sum((x-0.6)**2, axis=-1)/0.18),
+        dist, optimizer,
+        loss_func=sinkhorn.SinkhornLoss(epsilon=0.01, block_size=64))
+
+    loss = integrator.train_one_step(200)
+    assert np.isfinite(loss)
+    assert np.all(loc > 0.2)
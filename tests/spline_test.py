@@ -17,6 +17,50 @@ def test_spline_utilities():
     array = spline._padded(array, 0, 0)  # pylint: disable=protected-access
     assert np.all(np.equal(array, np.array([0, 1, 1, 1, 0])))
 
+    array = spline._padded(  # pylint: disable=protected-access
+        np.ones((2, 3)), 0, 2)
+    assert np.all(np.equal(array, np.array(2*[[0, 1, 1, 1, 2]])))
+
+
+def test_normalize_bins():
+    """ Test the normalization of the bin widths and heights. """
+    # pylint: disable=protected-access
+    widths = np.array(np.random.random((100, 10, 8)), dtype=np.float64)
+    heights = np.array(np.random.random((100, 10, 8)), dtype=np.float64)
+
+    cumwidths, bin_widths, cumheights, bin_heights = \
+        spline._normalize_widths_and_heights(widths, heights, 1e-3, 1e-2,
+                                             bottom=-1., top=2.)
+
+    assert np.allclose(cumwidths[..., 0], 0)
+    assert np.allclose(cumwidths[..., -1], 1)
+    assert np.allclose(cumheights[..., 0], -1)
+    assert np.allclose(cumheights[..., -1], 2)
+    assert np.all(bin_widths >= 1e-3 * (1 - 1e-8))
+    assert np.all(bin_heights >= 3e-2 * (1 - 1e-8))
+
+    knots, sizes = spline._normalize_bins(widths, 1e-3)
+    assert np.allclose(knots, cumwidths)
+    assert np.allclose(sizes, bin_widths)
+
+
+def test_gather_bins():
+    """ Test the batched gather of the bin coefficients. """
+    # pylint: disable=protected-access
+    params = np.array(np.random.random((100, 10, 9)), dtype=np.float64)
+    knots = np.array(np.random.random((100, 10, 10)), dtype=np.float64)
+    bin_idx = np.random.randint(0, 9, (100, 10, 1)).astype(np.int32)
+
+    input_params, input_left, input_right = spline._gather_bins(
+        bin_idx, params, knots, knots[..., 1:])
+
+    assert np.all(np.equal(
+        input_params, np.take_along_axis(params, bin_idx, -1)[..., 0]))
+    assert np.all(np.equal(
+        input_left, np.take_along_axis(knots, bin_idx, -1)[..., 0]))
+    assert np.all(np.equal(
+        input_right, np.take_along_axis(knots, bin_idx+1, -1)[..., 0]))
+
 
 def test_linear_spline():
     """ Test linear spline forward. """
@@ -107,6 +151,22 @@ def test_quadratic_spline_boundary_inverse():
     assert not np.any(np.isnan(logabsdet))
 
 
+def test_quadratic_spline_uniform():
+    """ Test quadratic spline with fixed, equal bin widths. """
+    inputs = np.array(np.random.random((100, 10)), dtype=np.float64)
+    widths = np.zeros((100, 10, 10), dtype=np.float64)
+    heights = np.array(np.random.random((100, 10, 11)), dtype=np.float64)
+
+    output, logabsdet = quadratic_spline(inputs, None, heights)
+    expected, expected_logabsdet = quadratic_spline(inputs, widths, heights)
+    assert np.allclose(output, expected)
+    assert np.allclose(logabsdet, expected_logabsdet)
+
+    inverse, inverse_logabsdet = quadratic_spline(output, None, heights, True)
+    assert np.allclose(inverse, inputs)
+    assert np.allclose(inverse_logabsdet, -logabsdet)
+
+
 def test_cubic_spline_throws():
     """ Test cubic spline bin errors. """
     inputs = np.array(np.random.random((100, 10)), dtype=np.float64)
@@ -206,3 +266,23 @@ def test_rational_quadratic_spline_inverse():
     assert np.all(output >= 0)
     assert np.all(output <= 1)
     assert not np.any(np.isnan(logabsdet))
+
+
+def test_rational_quadratic_spline_uniform():
+    """ Test rational quadratic spline with fixed, equal bin widths. """
+    inputs = np.array(np.random.random((100, 10)), dtype=np.float64)
+    widths = np.zeros((100, 10, 10), dtype=np.float64)
+    heights = np.array(np.random.random((100, 10, 10)), dtype=np.float64)
+    derivatives = np.array(np.random.random((100, 10, 11))-0.5, dtype=np.float64)
+
+    output, logabsdet = rational_quadratic_spline(
+        inputs, None, heights, derivatives)
+    expected, expected_logabsdet = rational_quadratic_spline(
+        inputs, widths, heights, derivatives)
+    assert np.allclose(output, expected)
+    assert np.allclose(logabsdet, expected_logabsdet)
+
+    inverse, inverse_logabsdet = rational_quadratic_spline(
+        output, None, heights, derivatives, True)
+    assert np.allclose(inverse, inputs)
+    assert np.allclose(inverse_logabsdet, -logabsdet)
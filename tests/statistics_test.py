@@ -0,0 +1,117 @@
+""" Test streaming statistics. """
+
+import numpy as np
+
+from iflow.integration.statistics import (RunningMoments, WeightedAverage,
+                                          unweighting_efficiency)
+
+
+def test_running_moments():
+    """ Test the running moments against the full sample. """
+    weights = np.random.exponential(size=10000) + 1e6
+    moments = RunningMoments()
+    for chunk in np.array_split(weights, 7):
+        moments.update(chunk)
+
+    assert moments.count == 10000
+    assert np.isclose(moments.mean, np.mean(weights))
+    assert np.isclose(moments.variance, np.var(weights))
+    assert np.isclose(moments.error, np.std(weights)/np.sqrt(9999))
+    assert np.isclose(moments.ess,
+                      np.sum(weights)**2 / np.sum(weights**2))
+
+
+def test_running_moments_merge():
+    """ Test merging running moments. """
+    weights = np.random.random(1000)
+    moments_1 = RunningMoments()
+    moments_1.update(weights[:300])
+    moments_2 = RunningMoments()
+    moments_2.update(weights[300:])
+    moments_1.merge(moments_2)
+    moments_1.merge(RunningMoments())
+
+    assert moments_1.count == 1000
+    assert np.isclose(moments_1.mean, np.mean(weights))
+    assert np.isclose(moments_1.variance, np.var(weights))
+
+
+def test_running_moments_empty():
+    """ Test running moments without weights. """
+    moments = RunningMoments()
+
+    assert moments.count == 0
+    assert moments.variance == 0
+    assert moments.ess == 0
+    assert moments.error == np.inf
+
+
+def test_unweighting_efficiency():
+    """ Test the unweighting efficiency against an explicit bootstrap. """
+    rng = np.random.default_rng(42)
+    weights = rng.exponential(size=20000)
+    nopt = 2000
+
+    sample = rng.choice(weights, (1000, nopt))
+    expected = np.mean(sample) / np.median(np.max(sample, axis=1))
+
+    efficiency = unweighting_efficiency(weights, nopt, seed=42)
+    assert np.isclose(efficiency, expected, rtol=0.05)
+    assert unweighting_efficiency(weights, nopt, seed=42) == efficiency
+    assert unweighting_efficiency(np.ones(100), 10) == 1
+
+
+def test_weighted_average():
+    """ Test the running weighted average against the full prefixes. """
+    rng = np.random.default_rng(42)
+    stddevs = rng.uniform(0.5, 2., 50)
+    means = 3. + stddevs * rng.normal(size=50)
+    average = WeightedAverage(burn_in=5)
+    for mean, stddev in zip(means, stddevs):
+        average.add(mean, stddev)
+
+    assert len(average) == 50
+    hist_means, hist_errors = average.history()
+    assert np.all(np.isnan(hist_means[:5]))
+    assert np.all(np.isinf(hist_errors[:5]))
+    for i in range(5, 50):
+        weights = 1. / stddevs[5:i+1]**2
+        expected = np.sum(weights * means[5:i+1]) / np.sum(weights)
+        assert np.isclose(hist_means[i], expected)
+        assert np.isclose(hist_errors[i], 1. / np.sqrt(np.sum(weights)))
+
+    weights = 1. / stddevs[5:]**2
+    chi2 = np.sum(weights * (means[5:] - average.mean)**2)
+    assert np.isclose(average.chi2_dof, chi2 / 44)
+    assert 0.5 < average.chi2_dof < 1.5
+
+
+def test_weighted_average_empty():
+    """ Test the weighted average without estimates. """
+    average = WeightedAverage()
+    assert np.isnan(average.mean)
+    assert np.isinf(average.error)
+    assert np.isnan(average.chi2_dof)
+
+
+def test_weighted_average_zero_error():
+    """ Test that estimates without usable error are skipped. """
+    average = WeightedAverage(burn_in=1)
+    average.add(5., 0.)
+    average.add(2., 1.)
+    average.add(3., np.inf)
+    average.add(1., 1.)
+    average.add(3., 1.)
+
+    assert average.count == len(average) == 3
+    assert average.skipped == 2
+    assert np.isclose(average.mean, 2.)
+    assert np.isclose(average.error, np.sqrt(0.5))
+
+    # The history has an entry for every estimate, also the skipped ones
+    hist_means, hist_errors = average.history()
+    assert len(hist_means) == len(hist_errors) == 5
+    assert len(hist_means) == len(average) + average.skipped
+    assert np.all(np.isnan(hist_means[:3]))
+    assert np.allclose(hist_means[3:], [1., 2.])
+    assert np.all(np.isinf(hist_errors[:3]))